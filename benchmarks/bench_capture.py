@@ -0,0 +1,93 @@
+"""
+Compares the per-frame capture path against the block-based CaptureFrontEnd.
+
+Both paths get the same synthetic lobby audio (speech-like bursts over a
+noise floor). For each, the script reports CPU time per second of audio and
+how many VAD decisions agree with the old 48 kHz per-frame path.
+
+Usage:
+    python benchmarks/bench_capture.py [seconds]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import webrtcvad
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from capture import CaptureFrontEnd  # noqa: E402
+
+SAMPLE_RATE = 48000
+FRAME_DURATION = 20
+FRAME_SIZE = int(SAMPLE_RATE * FRAME_DURATION / 1000)
+
+
+def synthetic_lobby(seconds, seed=0):
+    # Alternating 1 s of warbling voiced tone and 1 s of noise floor
+    rng = np.random.default_rng(seed)
+    audio = np.zeros(SAMPLE_RATE * seconds, dtype=np.float32)
+    t = np.arange(SAMPLE_RATE) / SAMPLE_RATE
+    pitch = 200 + 100 * np.sin(2 * np.pi * 3 * t)
+    burst = 0.3 * np.sin(2 * np.pi * pitch * t) * (1 + 0.5 * np.sin(2 * np.pi * 5 * t))
+    for second in range(0, seconds, 2):
+        audio[second * SAMPLE_RATE:(second + 1) * SAMPLE_RATE] = burst
+    audio += 0.01 * rng.standard_normal(len(audio)).astype(np.float32)
+    return audio[:, None]  # soundcard hands back (frames, channels)
+
+
+def per_frame_path(audio):
+    # The original record_loop: one record() per 20 ms frame, VAD at 48 kHz
+    vad = webrtcvad.Vad(1)
+    buffer = bytearray()
+    decisions = []
+    for start in range(0, len(audio), FRAME_SIZE):
+        data = audio[start:start + FRAME_SIZE]
+        pcm_data = np.int16(data.flatten() * 32767).tobytes()
+        is_speech = vad.is_speech(pcm_data, SAMPLE_RATE)
+        if is_speech:
+            buffer.extend(pcm_data)
+        decisions.append(is_speech)
+    return decisions
+
+
+def block_path(audio, vad_rate, frames_per_block):
+    vad = webrtcvad.Vad(1)
+    front_end = CaptureFrontEnd(vad, sample_rate=SAMPLE_RATE, vad_rate=vad_rate,
+                                frame_duration=FRAME_DURATION, frames_per_block=frames_per_block)
+    buffer = bytearray()
+    decisions = []
+    for start in range(0, len(audio), front_end.block_size):
+        block = front_end.convert_block(audio[start:start + front_end.block_size])
+        for is_speech, frame in front_end.classify_block(block):
+            if is_speech:
+                buffer.extend(frame.data.cast('B'))
+            decisions.append(is_speech)
+    return decisions
+
+
+def measure(func, *args):
+    start = time.process_time()
+    result = func(*args)
+    return result, time.process_time() - start
+
+
+def main():
+    seconds = int(sys.argv[1]) if len(sys.argv) > 1 else 120
+    audio = synthetic_lobby(seconds)
+    baseline, baseline_cpu = measure(per_frame_path, audio)
+    print(f"{seconds} s of audio")
+    print(f"{'path':<28}{'CPU ms / audio s':>18}{'record() calls':>16}{'agreement':>12}")
+    print(f"{'per-frame @ 48 kHz':<28}{baseline_cpu * 1000 / seconds:>18.3f}"
+          f"{len(audio) // FRAME_SIZE:>16}{1.0:>12.3f}")
+    for vad_rate in (48000, 16000, 8000):
+        for frames_per_block in (5, 10):
+            decisions, cpu = measure(block_path, audio, vad_rate, frames_per_block)
+            agreement = np.mean(np.array(decisions) == np.array(baseline))
+            label = f"block x{frames_per_block} @ {vad_rate // 1000} kHz"
+            calls = len(audio) // (FRAME_SIZE * frames_per_block)
+            print(f"{label:<28}{cpu * 1000 / seconds:>18.3f}{calls:>16}{agreement:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
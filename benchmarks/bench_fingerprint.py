@@ -0,0 +1,85 @@
+"""
+Micro-benchmark: fingerprint.fingerprint and FingerprintIndex lookups.
+
+It fills an index with 2000 synthetic voiced clips (a harmonic series with
+a wandering pitch, gated on and off like syllables). It reports the cost of
+fingerprinting per audio-second, and the p50/p99 lookup time. It also
+reports the detection rate for re-captures of indexed clips (delayed,
+quieter, with added noise, like our own playback coming back through the
+loopback device), and the false-match rate for clips that are not in the
+index.
+
+Usage:
+    python benchmarks/bench_fingerprint.py [num_clips]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fingerprint import FingerprintIndex, fingerprint  # noqa: E402
+
+SAMPLE_RATE = 48000
+CLIP_SECONDS = 2
+NUM_QUERIES = 200
+
+
+def make_clip(seed, seconds=CLIP_SECONDS):
+    rng = np.random.default_rng(seed)
+    t = np.arange(SAMPLE_RATE * seconds) / SAMPLE_RATE
+    pitch = rng.uniform(90, 220) + 40 * np.sin(2 * np.pi * rng.uniform(0.5, 2) * t)
+    phase = np.cumsum(2 * np.pi * pitch / SAMPLE_RATE)
+    formant = rng.uniform(300, 3000)
+    voice = sum(np.sin(k * phase) * np.exp(-((k * pitch - formant) / 400) ** 2) for k in range(1, 20))
+    syllables = np.sin(2 * np.pi * rng.uniform(2, 5) * t) > -0.3
+    voice *= syllables
+    return (voice * 8000 / np.abs(voice).max()).astype(np.int16)
+
+
+def recapture(samples, rng):
+    # Delay by up to 20 ms, lower the level and add a noise floor
+    delay = int(rng.integers(0, SAMPLE_RATE // 50))
+    captured = np.concatenate([np.zeros(delay), samples * rng.uniform(0.3, 1.0)])
+    captured += rng.standard_normal(len(captured)) * 50
+    return np.clip(captured, -32768, 32767).astype(np.int16)
+
+
+def main():
+    num_clips = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    index = FingerprintIndex(max_entries=num_clips)
+    clips = [make_clip(seed) for seed in range(num_clips)]
+
+    start = time.perf_counter()
+    for key, samples in enumerate(clips):
+        index.add(key, fingerprint(samples, SAMPLE_RATE))
+    elapsed = time.perf_counter() - start
+    print(f"Fingerprinted and indexed {num_clips} clips: "
+          f"{elapsed / (num_clips * CLIP_SECONDS) * 1000:.2f} ms per audio-second")
+
+    rng = np.random.default_rng(1)
+    lookup_times = []
+    detected = 0
+    for key in rng.choice(num_clips, size=NUM_QUERIES, replace=False):
+        hashes = fingerprint(recapture(clips[key], rng), SAMPLE_RATE)
+        start = time.perf_counter()
+        match = index.query(hashes)
+        lookup_times.append(time.perf_counter() - start)
+        detected += match is not None and match[0] == key
+
+    false_matches = 0
+    for seed in range(num_clips, num_clips + NUM_QUERIES):
+        hashes = fingerprint(make_clip(seed), SAMPLE_RATE)
+        start = time.perf_counter()
+        false_matches += index.query(hashes) is not None
+        lookup_times.append(time.perf_counter() - start)
+
+    print(f"Lookup: p50 {np.percentile(lookup_times, 50) * 1000:.3f} ms, "
+          f"p99 {np.percentile(lookup_times, 99) * 1000:.3f} ms")
+    print(f"Re-captures detected: {detected}/{NUM_QUERIES}")
+    print(f"False matches: {false_matches}/{NUM_QUERIES}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+End-to-end benchmark: replays a lobby recording through the whole capture pipeline.
+
+For each replay speed it builds a fresh AudioRecorder in a temporary folder,
+fed by a FileSource and using the offline FakeTranscriber, and runs the
+file to the end. It then reports:
+- latency from the end of speech (the last speech frame read) to the clip
+  being published, p50/p99. This includes the silence hangover that ends
+  a clip (MAX_SILENCE_DURATION of audio).
+- frames dropped by the simulated capture device (overruns) and jobs
+  dropped by the pipeline's backpressure
+- CPU time per audio-second
+- the speed actually reached, as a multiple of real time
+
+Without a file, a two-minute synthetic lobby is generated first. With
+--sources N, N lobbies are captured at once, each on its own capture
+thread, to check that concurrent sources keep up with each other (given a
+file, every source replays it, so most clips are merged as duplicates).
+
+Usage:
+    python benchmarks/bench_pipeline.py [--sources N] [lobby.wav [speed ...]]
+    e.g. python benchmarks/bench_pipeline.py lobby.wav 1 4 16 max
+         python benchmarks/bench_pipeline.py --sources 4
+"""
+import os
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ROOT = tempfile.mkdtemp(prefix='echo_bench_')
+os.chdir(ROOT)  # Keep anything the app writes (clip store, folders) out of the working directory
+os.environ.setdefault('ECHO_LOG_LEVEL', 'WARNING')  # Keep the app's own logging out of the table
+import echoserver  # noqa: E402
+from sources import FileSource, SyntheticSource, parse_speed  # noqa: E402
+from transcription import FakeTranscriber  # noqa: E402
+
+DEFAULT_SPEEDS = ['1', '4', '16', 'max']
+
+
+def wait_until_idle(recorder, timeout=600):
+    # Wait for the sources to run out, then for every queued clip to be published and transcribed
+    deadline = time.perf_counter() + timeout
+    while recorder.is_listening and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    while time.perf_counter() < deadline:
+        stats = recorder.pipeline.get_stats()
+        transcription = recorder.transcription.get_stats()
+        if stats['queued'] + stats['in_flight'] + transcription['queued'] + transcription['in_flight'] == 0:
+            return
+        time.sleep(0.05)
+
+
+def run(paths, speed):
+    workdir = tempfile.mkdtemp(dir=ROOT)
+    os.chdir(workdir)
+    sources = [FileSource(path, speed=speed) for path in paths]
+    recorder = echoserver.AudioRecorder(sources=sources, transcriber=FakeTranscriber())
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    recorder.start()
+    wait_until_idle(recorder)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    recorder.stop()
+    recorder.store.close()
+
+    audio_seconds = sum(source.stream.position for source in sources) / recorder.SAMPLE_RATE
+    latencies = np.array(recorder.publish_latencies) * 1000
+    pipeline = recorder.pipeline.get_stats()
+    return {
+        'clips': len(recorder.recordings),
+        'merged': recorder.duplicate_stats['merged'],
+        'p50': np.percentile(latencies, 50) if len(latencies) else float('nan'),
+        'p99': np.percentile(latencies, 99) if len(latencies) else float('nan'),
+        'dropped_frames': sum(source.stream.dropped_samples for source in sources) // recorder.FRAME_SIZE,
+        'dropped_jobs': pipeline['dropped'],
+        'cpu_ms': cpu / audio_seconds * 1000,
+        'speedup': audio_seconds / len(sources) / wall,
+    }
+
+
+def main():
+    args = sys.argv[1:]
+    num_sources = 1
+    if args[:1] == ['--sources']:
+        num_sources = int(args[1])
+        args = args[2:]
+    if args:
+        paths = [os.path.abspath(args[0])] * num_sources
+    else:
+        paths = []
+        for seed in range(num_sources):
+            path = os.path.join(ROOT, f'lobby_{seed}.wav')
+            utterances = SyntheticSource(duration=120, seed=seed).render(path)
+            print(f"Generated a 120 s synthetic lobby with {len(utterances)} utterances")
+            paths.append(path)
+    speeds = args[1:] or DEFAULT_SPEEDS
+    with wave.open(paths[0], 'rb') as wav_file:
+        print(f"Replaying {num_sources} x {wav_file.getnframes() / wav_file.getframerate():.1f} s at once")
+    print()
+
+    print(f"{'speed':>6}{'clips':>7}{'merged':>8}{'p50 ms':>9}{'p99 ms':>9}{'dropped frames':>16}"
+          f"{'dropped jobs':>14}{'CPU ms/s':>10}{'reached':>9}")
+    for speed_text in speeds:
+        result = run(paths, parse_speed(speed_text))
+        print(f"{speed_text:>6}{result['clips']:>7}{result['merged']:>8}{result['p50']:>9.1f}{result['p99']:>9.1f}"
+              f"{result['dropped_frames']:>16}{result['dropped_jobs']:>14}{result['cpu_ms']:>10.1f}"
+              f"{result['speedup']:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
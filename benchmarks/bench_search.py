@@ -0,0 +1,112 @@
+"""
+Micro-benchmark: search.SearchIndex at 100k clips.
+
+It builds a synthetic library: transcriptions drawn from a 20k-word
+vocabulary with word frequency proportional to 1 / rank (Zipf's law), a few
+known call-outs mixed in, names on a fifth of the clips, and one clip in ten
+a favorite.
+It reports the time to build the index, the time to update one clip (as a
+rename or a finished transcription does), and p50/p99 query latency for
+exact, prefix and multi-word queries. The naive substring scan, which is
+what the old favorites filter does, is shown for comparison.
+
+Usage:
+    python benchmarks/bench_search.py [num_clips]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from search import SearchIndex  # noqa: E402
+
+COMMON_WORDS = ['the', 'a', 'you', 'i', 'to', 'is', 'it', 'that', 'and', 'go', 'got', 'anyone', 'mic', 'push',
+                'rotate', 'rush', 'b', 'site', 'nice', 'one', 'wait', 'for', 'me', 'let', 'us', 'no', 'yes',
+                'what', 'was', 'microphone', 'michael', 'middle', 'mid', 'midnight', 'bomb', 'plant', 'defuse']
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'ten', 'vo', 'sha', 'dre', 'gu', 'pin', 'wor', 'bel', 'ston', 'ix', 'ae']
+VOCABULARY_SIZE = 20000
+PHRASES = ['anyone got a mic', 'rotate b site', 'wait for me']  # Mixed into one clip in 500
+QUERIES = ['mic', 'anyone got a mic', 'mi', 'rotate b site', 'kalo', 'wor', 'the', 'zzz no match']
+
+
+def make_vocabulary(rng):
+    vocabulary = list(COMMON_WORDS)
+    seen = set(vocabulary)
+    while len(vocabulary) < VOCABULARY_SIZE:
+        word = ''.join(rng.choice(SYLLABLES, size=rng.integers(2, 5)))
+        if word not in seen:
+            seen.add(word)
+            vocabulary.append(word)
+    return vocabulary
+
+
+def make_clips(num_clips, seed=0):
+    rng = np.random.default_rng(seed)
+    vocabulary = make_vocabulary(rng)
+    weights = 1.0 / np.arange(1, len(vocabulary) + 1)
+    ranks = rng.choice(len(vocabulary), size=num_clips * 8, p=weights / weights.sum())
+    lengths = rng.integers(2, 9, size=num_clips)
+    clips = []
+    position = 0
+    for clip_id in range(1, num_clips + 1):
+        words = [vocabulary[r] for r in ranks[position:position + lengths[clip_id - 1]]]
+        if clip_id % 500 == 0:
+            words.append(PHRASES[clip_id // 500 % len(PHRASES)])
+        position += lengths[clip_id - 1]
+        name = ' '.join(vocabulary[r] for r in ranks[position - 2:position]) if clip_id % 5 == 0 else ''
+        list_type = 'favorites' if clip_id % 10 == 0 else 'recordings'
+        clips.append((list_type, {'id': clip_id, 'text': ' '.join(words), 'name': name}))
+    return clips
+
+
+def percentile_ms(times, q):
+    return np.percentile(times, q) * 1000
+
+
+def time_queries(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return times, result
+
+
+def naive_scan(clips, query):
+    query = query.lower()
+    return [clip for _, clip in clips if query in clip['name'].lower() or query in clip['text'].lower()]
+
+
+def main():
+    num_clips = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    clips = make_clips(num_clips)
+
+    index = SearchIndex()
+    start = time.perf_counter()
+    for list_type, clip in clips:
+        index.add(list_type, clip)
+    build_time = time.perf_counter() - start
+    stats = index.get_stats()
+    print(f"Indexed {stats['documents']} clips ({stats['tokens']} distinct tokens) in {build_time:.2f} s")
+
+    update_times = []
+    for list_type, clip in clips[:2000]:
+        clip = dict(clip, name=f"{clip['name']} renamed")
+        start = time.perf_counter()
+        index.add(list_type, clip)
+        update_times.append(time.perf_counter() - start)
+    print(f"Update one clip: p50 {percentile_ms(update_times, 50):.3f} ms, p99 {percentile_ms(update_times, 99):.3f} ms")
+    print()
+
+    print(f"{'query':<22}{'matches':>9}{'p50 ms':>9}{'p99 ms':>9}{'scan ms':>10}")
+    for query in QUERIES:
+        times, (total, _) = time_queries(lambda: index.search(query, limit=20), repeat=50)
+        scan_times, _ = time_queries(lambda: naive_scan(clips, query), repeat=3)
+        print(f"{query:<22}{total:>9}{percentile_ms(times, 50):>9.2f}{percentile_ms(times, 99):>9.2f}"
+              f"{min(scan_times) * 1000:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Micro-benchmark: pydub detect_nonsilent trimming vs trimming.find_nonsilent_bounds.
+
+For 1 s, 10 s and 60 s clips (speech-like noise with silence on both ends
+and a few gaps), it times the old path, which builds an AudioSegment, runs
+detect_nonsilent and slices. It also times the vectorised path on the
+int16 array, and checks both find the same bounds to within 1 ms.
+
+Usage:
+    python benchmarks/bench_trim.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+from pydub import AudioSegment, silence
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from trimming import find_nonsilent_bounds  # noqa: E402
+
+SAMPLE_RATE = 48000
+SILENCE_THRESH = -50
+MIN_SILENCE_LEN = 100
+
+
+def make_clip(seconds, seed=0):
+    rng = np.random.default_rng(seed)
+    samples = (rng.standard_normal(SAMPLE_RATE * seconds) * 20).astype(np.int16)  # Noise floor
+    sound_start = SAMPLE_RATE // 4
+    sound_end = len(samples) - SAMPLE_RATE // 4
+    speech = (rng.standard_normal(sound_end - sound_start) * 3000).astype(np.int16)
+    samples[sound_start:sound_end] = speech
+    # A few short pauses inside the speech
+    for gap in range(sound_start + SAMPLE_RATE // 2, sound_end - SAMPLE_RATE // 2, SAMPLE_RATE):
+        samples[gap:gap + SAMPLE_RATE // 10] //= 200
+    return samples
+
+
+def pydub_trim(samples):
+    audio_segment = AudioSegment(data=samples.tobytes(), sample_width=2, frame_rate=SAMPLE_RATE, channels=1)
+    nonsilent_ranges = silence.detect_nonsilent(
+        audio_segment, min_silence_len=MIN_SILENCE_LEN, silence_thresh=SILENCE_THRESH)
+    if not nonsilent_ranges:
+        return (0, 0), AudioSegment.empty()
+    start_trim = nonsilent_ranges[0][0]
+    end_trim = nonsilent_ranges[-1][1]
+    bounds = (start_trim * SAMPLE_RATE // 1000, end_trim * SAMPLE_RATE // 1000)
+    return bounds, audio_segment[start_trim:end_trim]
+
+
+def numpy_trim(samples):
+    start, end = find_nonsilent_bounds(samples, SAMPLE_RATE, SILENCE_THRESH, MIN_SILENCE_LEN)
+    return (start, end), samples[start:end]
+
+
+def best_of(func, samples, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(samples)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    tolerance = SAMPLE_RATE // 1000
+    print(f"{'clip':>6}{'pydub ms':>12}{'numpy ms':>12}{'speedup':>10}  bounds match")
+    for seconds in (1, 10, 60):
+        samples = make_clip(seconds)
+        repeat = 3 if seconds == 60 else 5
+        pydub_time, (pydub_bounds, _) = best_of(pydub_trim, samples, repeat)
+        numpy_time, (numpy_bounds, _) = best_of(numpy_trim, samples, repeat)
+        match = all(abs(a - b) <= tolerance for a, b in zip(pydub_bounds, numpy_bounds))
+        print(f"{seconds:>5}s{pydub_time * 1000:>12.2f}{numpy_time * 1000:>12.2f}"
+              f"{pydub_time / numpy_time:>9.1f}x  {match}")
+
+
+if __name__ == '__main__':
+    main()
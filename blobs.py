@@ -0,0 +1,143 @@
+import hashlib
+import os
+import re
+import shutil
+import threading
+import wave
+
+from encoding import write_wav
+
+BLOB_NAME = re.compile(r'^[0-9a-f]{40}\.[a-z0-9]+$')  # <sha1>.<extension>
+
+
+class BlobStore:
+    """
+    Content-addressed storage for clip audio.
+
+    Every clip's WAV is stored once under the hash of its audio, as
+    blobs/<first two hex digits>/<hash>.wav, and recordings and favorites
+    just reference it by path. Identical audio captured in different
+    sessions shares one file, and favoriting a clip is a metadata change
+    instead of a copy. Renditions (MP3/Opus) live next to the WAV under the
+    same hash, so they are shared as well. A blob's reference count is the
+    number of clips in the clip store pointing at it.
+
+    A blob handed out by `put` or `put_file` is pinned until `release` is
+    called, once the clip referencing it is in the clip store. Until then
+    `remove_unreferenced` leaves it alone, even though nothing references
+    it yet.
+
+    Parameters:
+    - root: Folder holding the blobs.
+    """
+
+    def __init__(self, root='blobs'):
+        self.root = root
+        self.lock = threading.Lock()
+        self.pins = {}  # audio hash -> clips being stored with it that aren't in the clip store yet
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def audio_hash(pcm_data, sample_rate, channels=1):
+        # The format is part of the key, so the same bytes at another rate are a different clip
+        digest = hashlib.sha1(f"{sample_rate}:{channels}:".encode())
+        digest.update(pcm_data)
+        return digest.hexdigest()
+
+    def folder_for(self, audio_hash):
+        return os.path.join(self.root, audio_hash[:2])
+
+    def path_for(self, audio_hash, extension='wav'):
+        return os.path.join(self.folder_for(audio_hash), f"{audio_hash}.{extension}")
+
+    @staticmethod
+    def is_blob_name(filename):
+        return bool(BLOB_NAME.match(filename))
+
+    def put(self, samples, sample_rate, channels=1):
+        """
+        Stores int16 samples as a WAV blob, unless identical audio is already stored.
+
+        Parameters:
+        - samples: int16 numpy array (interleaved if channels > 1).
+        - sample_rate: Sample rate of `samples`.
+        - channels: Number of channels.
+
+        Returns:
+        - (audio_hash, wav_path). The blob stays pinned until release(audio_hash).
+        """
+        audio_hash = self.audio_hash(samples.tobytes(), sample_rate, channels)
+        path = self.path_for(audio_hash)
+        self.pin(audio_hash)
+        if not os.path.exists(path):
+            os.makedirs(self.folder_for(audio_hash), exist_ok=True)
+            # Each writer has its own temporary file and the content is identical, so a second writer of the
+            # same blob just replaces the first one's file with the same bytes
+            write_wav(path, samples, sample_rate, channels)
+        return audio_hash, path
+
+    def put_file(self, wav_path):
+        """
+        Adopts an existing WAV file (e.g. a clip from before the blob store) as a blob.
+
+        The file is hardlinked into the store where the filesystem allows it
+        and copied otherwise.
+
+        Returns:
+        - (audio_hash, blob_path). The blob stays pinned until release(audio_hash).
+        """
+        with wave.open(wav_path, 'rb') as wav_file:
+            channels = wav_file.getnchannels()
+            sample_rate = wav_file.getframerate()
+            pcm_data = wav_file.readframes(wav_file.getnframes())
+        audio_hash = self.audio_hash(pcm_data, sample_rate, channels)
+        path = self.path_for(audio_hash)
+        with self.lock:
+            self.pins[audio_hash] = self.pins.get(audio_hash, 0) + 1
+            if not os.path.exists(path):
+                os.makedirs(self.folder_for(audio_hash), exist_ok=True)
+                try:
+                    os.link(wav_path, path)
+                except OSError:
+                    shutil.copy2(wav_path, path)
+        return audio_hash, path
+
+    def pin(self, audio_hash):
+        with self.lock:
+            self.pins[audio_hash] = self.pins.get(audio_hash, 0) + 1
+
+    def release(self, audio_hash):
+        # The clip stored with this blob is in the clip store now (or was given up)
+        with self.lock:
+            count = self.pins.get(audio_hash, 0) - 1
+            if count > 0:
+                self.pins[audio_hash] = count
+            else:
+                self.pins.pop(audio_hash, None)
+
+    def remove_unreferenced(self, audio_hash, count_references):
+        """
+        Deletes a blob and its renditions if no clip references it and none is about to.
+
+        The check and the delete happen under the lock `put` pins blobs with,
+        so a clip stored with identical audio at the same moment either keeps
+        the blob or writes it again.
+
+        Parameters:
+        - audio_hash: The blob.
+        - count_references: Function returning the number of clips referencing a blob.
+
+        Returns:
+        - The number of bytes deleted, or None if the blob is still in use.
+        """
+        with self.lock:
+            if self.pins.get(audio_hash) or count_references(audio_hash):
+                return None
+            freed = 0
+            folder = self.folder_for(audio_hash)
+            for filename in (os.listdir(folder) if os.path.isdir(folder) else []):
+                if filename.startswith(audio_hash + '.'):
+                    path = os.path.join(folder, filename)
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+            return freed
@@ -0,0 +1,298 @@
+import logging
+import threading
+
+import numpy as np
+
+from metrics import time_stage
+from sources import SourceExhausted
+
+logger = logging.getLogger(__name__)
+
+
+class BlockRingBuffer:
+    """
+    Preallocated int16 ring of fixed-size audio blocks.
+
+    Each captured block is written into the next slot, and callers get views
+    into that slot instead of fresh arrays. A view stays valid until the ring
+    wraps around, i.e. for `num_blocks - 1` further writes.
+
+    Parameters:
+    - num_blocks: Number of blocks kept.
+    - block_size: Samples per block.
+    """
+
+    def __init__(self, num_blocks, block_size):
+        self.data = np.zeros((num_blocks, block_size), dtype=np.int16)
+        self.num_blocks = num_blocks
+        self.block_size = block_size
+        self.position = 0  # Total blocks written so far
+
+    def next_slot(self):
+        # The slot the next block will be written into
+        return self.data[self.position % self.num_blocks]
+
+    def commit(self):
+        # Mark the slot returned by next_slot as filled and return it
+        slot = self.data[self.position % self.num_blocks]
+        self.position += 1
+        return slot
+
+
+class Decimator:
+    """
+    Vectorised polyphase resampler for integer downsampling (e.g. 48 kHz -> 16 kHz).
+
+    A windowed-sinc low-pass filter is evaluated only at the output sample
+    positions, in one matrix product per block. The filter history is
+    carried between blocks, so blocks can be fed one at a time without
+    clicks at the block edges.
+
+    Parameters:
+    - in_rate: Input sample rate.
+    - out_rate: Output sample rate. in_rate must be an integer multiple of it.
+    - num_taps: Filter length (odd).
+    """
+
+    def __init__(self, in_rate, out_rate, block_size, num_taps=31):
+        if in_rate % out_rate != 0:
+            raise ValueError(f"{in_rate} Hz is not an integer multiple of {out_rate} Hz")
+        self.factor = in_rate // out_rate
+        if block_size % self.factor != 0:
+            raise ValueError(f"Block size {block_size} is not a multiple of {self.factor}")
+        self.block_size = block_size
+        self.history_size = num_taps - 1
+        # Low-pass just below the new Nyquist frequency
+        cutoff = 0.9 / self.factor
+        n = np.arange(num_taps) - (num_taps - 1) / 2
+        taps = cutoff * np.sinc(cutoff * n) * np.hamming(num_taps)
+        taps /= taps.sum()
+        # Reversed so that a dot product with a window of input computes the convolution
+        self.taps = taps[::-1].astype(np.float32)
+        # Filter history followed by the current block, reused for every block
+        self.signal = np.zeros(self.history_size + block_size, dtype=np.float32)
+        # Window k ends on block sample k; keeping every factor-th one lines the
+        # last output up with the last input sample. This is a view, so it
+        # always sees whatever is currently in self.signal.
+        self.windows = np.lib.stride_tricks.sliding_window_view(
+            self.signal, num_taps)[self.factor - 1::self.factor]
+        self.filtered = np.empty(block_size // self.factor, dtype=np.float32)
+
+    def process(self, block, out=None):
+        """
+        Downsamples one block of int16 samples.
+
+        Parameters:
+        - block: 1-D int16 array of block_size samples.
+        - out: Optional int16 array of length block_size // factor to write into.
+
+        Returns:
+        - The downsampled int16 samples.
+        """
+        self.signal[:self.history_size] = self.signal[-self.history_size:]
+        self.signal[self.history_size:] = block
+        np.dot(self.windows, self.taps, out=self.filtered)
+        np.clip(self.filtered, -32768, 32767, out=self.filtered)
+        if out is None:
+            out = np.empty(len(self.filtered), dtype=np.int16)
+        out[:] = self.filtered
+        return out
+
+
+class CaptureFrontEnd:
+    """
+    Block-based capture front-end: conversion, ring buffering and downsampled VAD.
+
+    Instead of converting and classifying one 20 ms frame per `record()` call,
+    audio is read in larger blocks. Each block is converted to int16 once, in
+    place, into a preallocated ring. It is then resampled to the VAD rate in
+    one vectorised pass, and webrtcvad is run over zero-copy frame views.
+    webrtcvad works internally at 8 kHz, so classifying at 8 kHz gives the
+    same speech/silence decisions as 48 kHz but costs far less per call.
+
+    Parameters:
+    - vad: A configured webrtcvad.Vad instance.
+    - sample_rate: Capture sample rate.
+    - vad_rate: Sample rate VAD runs at (8000, 16000, 32000 or 48000).
+    - frame_duration: VAD frame length in ms (10, 20 or 30).
+    - frames_per_block: Number of VAD frames read per `record()` call.
+    - ring_blocks: Number of blocks kept in the ring buffer.
+    """
+
+    def __init__(self, vad, sample_rate=48000, vad_rate=8000, frame_duration=20,
+                 frames_per_block=5, ring_blocks=16):
+        self.vad = vad
+        self.sample_rate = sample_rate
+        self.vad_rate = vad_rate
+        self.frame_duration = frame_duration
+        self.frame_size = int(sample_rate * frame_duration / 1000)
+        self.vad_frame_size = int(vad_rate * frame_duration / 1000)
+        self.frames_per_block = frames_per_block
+        self.block_size = self.frame_size * frames_per_block
+        self.ring = BlockRingBuffer(ring_blocks, self.block_size)
+        self.decimator = Decimator(sample_rate, vad_rate, self.block_size) if vad_rate != sample_rate else None
+        self.vad_block = np.empty(self.vad_frame_size * frames_per_block, dtype=np.int16)
+        self.scratch = np.empty(self.block_size, dtype=np.float32)
+
+    def convert_block(self, data):
+        """
+        Converts one float32 block from soundcard into the next ring slot as int16.
+
+        Parameters:
+        - data: Array of shape (block_size, channels) or (block_size,). Only
+          the first channel is kept.
+
+        Returns:
+        - The filled int16 ring slot (a view, not a copy).
+        """
+        samples = data[:, 0] if data.ndim > 1 else data
+        np.multiply(samples, 32767, out=self.scratch)
+        np.clip(self.scratch, -32768, 32767, out=self.scratch)
+        slot = self.ring.next_slot()
+        slot[:] = self.scratch
+        return self.ring.commit()
+
+    def classify_block(self, block):
+        """
+        Runs VAD over every frame of an int16 block.
+
+        Returns:
+        - A list of (is_speech, frame) pairs, where frame is a zero-copy view
+          of the capture-rate samples of that frame.
+        """
+        if self.decimator is not None:
+            vad_samples = self.decimator.process(block, out=self.vad_block)
+        else:
+            vad_samples = block
+        vad_frames = vad_samples.reshape(self.frames_per_block, self.vad_frame_size)
+        frames = block.reshape(self.frames_per_block, self.frame_size)
+        return [
+            (self.vad.is_speech(vad_frames[i].data.cast('B'), self.vad_rate), frames[i])
+            for i in range(self.frames_per_block)
+        ]
+
+    def read(self, recorder):
+        """
+        Reads one block from a soundcard recorder and classifies it.
+
+        Returns:
+        - A list of (is_speech, frame) pairs as returned by classify_block.
+        """
+        data = recorder.record(numframes=self.block_size)
+        if len(data) != self.block_size:
+            # soundcard may hand back a short read; pad with silence to keep frames aligned
+            padded = np.zeros((self.block_size,) + data.shape[1:], dtype=np.float32)
+            padded[:len(data)] = data
+            data = padded
+        with time_stage('vad'):  # Conversion, resampling and VAD of one block; not the wait for audio
+            return self.classify_block(self.convert_block(data))
+
+
+class SourceCapture:
+    """
+    Captures one source on its own thread.
+
+    Every source gets its own CaptureFrontEnd (ring buffer, resampler and
+    VAD state) and its own Segmenter, so several sources can be captured at
+    once without sharing any per-stream state. Finished utterances are
+    handed to `on_clip`, which should only queue them (e.g. into the
+    pipeline) so that reading the device is never held up.
+
+    Parameters:
+    - source: The CaptureSource.
+    - tag: Name the source's clips are tagged with.
+    - front_end: A CaptureFrontEnd used by this source only.
+    - segmenter: A Segmenter used by this source only.
+    - on_clip: Callback taking (tag, utterance) for every finished utterance (see Segmenter.feed).
+    - on_state: Callback taking no arguments, called when this source starts
+      or stops recording an utterance and when it finishes.
+    """
+
+    def __init__(self, source, tag, front_end, segmenter, on_clip, on_state):
+        self.source = source
+        self.tag = tag
+        self.front_end = front_end
+        self.segmenter = segmenter
+        self.on_clip = on_clip
+        self.on_state = on_state
+        self.stream = None
+        self.thread = None
+        self.running = False
+        self.finished = False
+        self.clips = 0
+
+    def open(self):
+        # Resolve the device now, so a missing device fails in start() rather than in the thread
+        self.stream = self.source.recorder(self.front_end.sample_rate)
+
+    def start(self):
+        self.running = True
+        self.finished = False
+        self.thread = threading.Thread(target=self.run, name=f"capture-{self.tag}")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        try:
+            with self.stream as recorder:
+                logger.info("Listening for speech on %s...", self.tag)
+                try:
+                    while self.running:
+                        # One block read gives several frames; each frame is an int16 view into the ring buffer
+                        for is_speech, frame in self.front_end.read(recorder):
+                            was_recording = self.segmenter.is_recording
+                            utterance = self.segmenter.feed(is_speech, frame)
+                            if utterance is not None:
+                                self.emit(utterance)
+                            if self.segmenter.is_recording != was_recording:
+                                logger.debug("[%s] %s", self.tag, "Speech detected, recording..."
+                                             if self.segmenter.is_recording else "Silence detected, processing audio...")
+                                self.on_state()
+                except SourceExhausted:
+                    logger.info("Capture source %s finished.", self.tag)
+                    utterance = self.segmenter.flush()
+                    if utterance is not None:
+                        self.emit(utterance)
+                finally:
+                    self.segmenter.close()  # Stopped mid-utterance: drop it (and its spill file)
+        except Exception:
+            # E.g. the device was unplugged; the other sources keep capturing
+            logger.exception("Capture source %s failed", self.tag)
+        finally:
+            self.finished = True
+            self.on_state()
+
+    def emit(self, utterance):
+        self.clips += 1
+        self.on_clip(self.tag, utterance)
+
+    def get_stats(self):
+        stats = self.source.get_stats()
+        stats.update(self.segmenter.get_stats())
+        stats.update({'tag': self.tag, 'clips': self.clips, 'finished': self.finished})
+        return stats
+
+
+def decimate(samples, in_rate, out_rate):
+    """
+    Resamples a whole int16 clip in one pass (e.g. 48 kHz -> 16 kHz for transcription).
+
+    Parameters:
+    - samples: 1-D int16 array at in_rate.
+    - in_rate: Sample rate of `samples`.
+    - out_rate: Wanted sample rate; in_rate must be an integer multiple of it.
+
+    Returns:
+    - A new int16 array at out_rate. Up to factor - 1 trailing samples are dropped.
+    """
+    factor = in_rate // out_rate
+    usable = len(samples) - len(samples) % factor
+    if usable == 0:
+        return np.zeros(0, dtype=np.int16)
+    return Decimator(in_rate, out_rate, usable).process(samples[:usable])
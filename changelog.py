@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import deque
+
+
+class ChangeLog:
+    """
+    Bounded, monotonically versioned journal of changes to the recorder state.
+
+    Every add/update/remove of a recording or favorite (and every change of the
+    listening/recording flags) bumps the version by one. Clients remember the
+    last version they saw and ask for everything after it, so the cost of an
+    incremental update depends on how much changed, not on the library size.
+
+    Parameters:
+    - maxlen: Number of changes kept. Clients further behind than this get a
+      full snapshot instead.
+
+    The same journal backs the /events stream: `wait` blocks until the
+    version moves past what a client has already seen.
+    """
+
+    def __init__(self, maxlen=5000):
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        # Start from the wall clock so versions keep increasing across restarts
+        # and a client holding a version from a previous run gets resynced
+        self.version = int(time.time() * 1000)
+        self.entries = deque(maxlen=maxlen)
+
+    def record(self, op, list_type, key, item=None, event=None):
+        """
+        Appends a change and returns its version.
+
+        Parameters:
+        - op: 'add', 'update' or 'remove'.
+        - list_type: 'recordings', 'favorites' or 'state'.
+        - key: Identifier of the changed item within its list.
+        - item: Snapshot of the item after the change (None for removals).
+        - event: Event name pushed to /events subscribers, e.g. 'clip_created'.
+          Defaults to '<list_type>_<op>'.
+        """
+        with self.condition:
+            self.version += 1
+            self.entries.append({
+                'version': self.version,
+                'event': event or f"{list_type}_{op}",
+                'op': op,
+                'list': list_type,
+                'key': key,
+                'item': dict(item) if item is not None else None,
+            })
+            self.condition.notify_all()
+            return self.version
+
+    def append(self, entry):
+        """
+        Adds a change recorded by another journal, keeping its version.
+
+        Used by the API process to mirror the capture process's journal, so
+        clients see the same versions whichever process they talk to.
+        Entries not newer than the current version are ignored.
+        """
+        with self.condition:
+            if entry['version'] <= self.version:
+                return
+            self.version = entry['version']
+            self.entries.append(dict(entry))
+            self.condition.notify_all()
+
+    def reset(self, version):
+        # Drop every entry and continue from `version`; clients at any other version get a full snapshot
+        with self.condition:
+            self.version = version
+            self.entries.clear()
+            self.condition.notify_all()
+
+    def wait(self, version, timeout=None):
+        """
+        Blocks until there are changes after `version` or the timeout expires.
+        Returns the current version.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout=timeout)
+            return self.version
+
+    def current_version(self):
+        with self.lock:
+            return self.version
+
+    def since(self, version):
+        """
+        Returns the changes made after `version`, oldest first, or None when
+        `version` is older than the journal and the caller must resync.
+        Only walks the entries newer than `version`.
+        """
+        with self.lock:
+            if version == self.version:
+                return []
+            if version > self.version:
+                return None
+            if not self.entries or self.entries[0]['version'] > version + 1:
+                return None
+            changes = []
+            for entry in reversed(self.entries):
+                if entry['version'] <= version:
+                    break
+                changes.append(entry)
+        changes.reverse()
+        return changes
+
+    @staticmethod
+    def coalesce(changes):
+        """
+        Collapses several changes to the same item into one, keeping the latest
+        item snapshot. An add followed by a remove cancels out entirely.
+        """
+        merged = {}
+        for change in changes:
+            ident = (change['list'], change['key'])
+            previous = merged.get(ident)
+            if previous is None:
+                merged[ident] = dict(change)
+                continue
+            if change['op'] == 'remove':
+                if previous['op'] == 'add':
+                    del merged[ident]
+                else:
+                    merged[ident] = dict(change)
+            else:
+                op = 'add' if previous['op'] == 'add' else change['op']
+                merged[ident] = dict(change, op=op)
+        return sorted(merged.values(), key=lambda c: c['version'])
@@ -1,6 +1,5 @@
 import subprocess
 import sys
-import traceback
 import json
 
 # Monkey-patch subprocess.Popen to prevent focus shifts on Windows
@@ -14,501 +13,1074 @@ if sys.platform == 'win32':
 
     subprocess.Popen = Popen
 
+import argparse
+import logging
+import multiprocessing
 import threading
 import time
 import os
-import shutil
+import sqlite3
+import wave
+from collections import deque
 import numpy as np
-import soundcard as sc
 import webrtcvad
-import speech_recognition as sr
-from pydub import AudioSegment, silence
-from flask import Flask, render_template, jsonify, request, send_from_directory, abort
+from flask import (Blueprint, Flask, Response, abort, current_app, jsonify, render_template, request, send_file,
+                   send_from_directory)
+from pipeline import Pipeline
+from capture import CaptureFrontEnd, SourceCapture
+from segmenter import Segmenter
+from trimming import find_nonsilent_bounds
+from encoding import RenditionCache, audio_duration
+from playback import PlaybackEngine, sink_from_spec
+from store import ClipStore
+from transcription import TranscriptionService, create_transcriber
+from blobs import BlobStore
+from fingerprint import FingerprintIndex, fingerprint, fingerprint_file
+from peaks import write_peaks
+from library import ClipLibrary
+from mirror import LibraryMirror
+from ipc import CaptureUnavailable, CommandClient, CommandServer, load_authkey, parse_address
+from retention import RetentionManager
+from sources import LoopbackSource, sources_from_spec
+from metrics import CONTENT_TYPE, REGISTRY, time_stage
+from logs import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# End-to-end latency of every published clip, from its last speech frame
+CLIP_LATENCY = REGISTRY.histogram('echo_clip_latency_seconds', 'Time from the end of speech to the clip being published.')
 
 # AudioRecorder class definition
-class AudioRecorder:
-    def __init__(self):
+class AudioRecorder(ClipLibrary):
+    def __init__(self, sources=None, transcriber=None):
+        """
+        Captures, processes and stores clips; runs in the capture process.
+
+        Parameters:
+        - sources: CaptureSources to listen to at once (default: the default speaker's loopback device).
+        - transcriber: Transcriber backend (default: built from TRANSCRIBER and TRANSCRIBER_OPTIONS).
+        """
         self.timestamp = int(time.time())
-        self.session_folder = f"session_{self.timestamp}"
-        os.makedirs(self.session_folder, exist_ok=True)
-
-        # Create the favorites folder if it doesn't exist
-        self.favorites_folder = "favorites"
-        os.makedirs(self.favorites_folder, exist_ok=True)
-
-        self.is_listening = False
-        self.is_recording = False
-        self.recordings = []  # List to store recording metadata
-        self.favorites = []   # List to store favorites metadata
-
-        self.lock = threading.RLock()  # Use RLock instead of Lock
-        self.vad = webrtcvad.Vad()
-        self.vad.set_mode(1)  # VAD sensitivity
-        self.recognizer = sr.Recognizer()
-        self.audio_buffer = bytearray()
-        self.silence_duration = 0
+        # Create the favorites folder if it doesn't exist (holds favorites from before the blob store)
+        os.makedirs("favorites", exist_ok=True)
+        super().__init__(
+            f"session_{self.timestamp}",  # Session key; new clips' audio lives in the blob store
+            ClipStore('echo.db'),  # Clip metadata (replaces recordings.json / favorites.json)
+            BlobStore('blobs'),  # Clip audio, stored once per distinct content
+            favorites_folder="favorites"
+        )
+
+        self.VAD_MODE = 1  # VAD sensitivity
+        self.PRE_ROLL_DURATION = 0.3  # Seconds kept from before speech was detected, so word onsets aren't clipped
+        self.MAX_CLIP_DURATION = 30  # Longer utterances are split at their quietest point
+        self.SPILL_AFTER_DURATION = 5  # Utterances longer than this are written to disk as they grow
+        self.spill_folder = "spill"  # Spilled utterances waiting for the pipeline
+        os.makedirs(self.spill_folder, exist_ok=True)
+        for filename in os.listdir(self.spill_folder):
+            os.remove(os.path.join(self.spill_folder, filename))  # Left over from a previous run
+        self.publish_latencies = deque(maxlen=1000)  # Seconds from end of speech to clip published
         self.MAX_SILENCE_DURATION = 0.5  # Adjust as needed
         # Audio parameters
         self.SAMPLE_RATE = 48000
         self.NUM_CHANNELS = 1
         self.FRAME_DURATION = 20  # ms
         self.FRAME_SIZE = int(self.SAMPLE_RATE * self.FRAME_DURATION / 1000)
-        # Prepare devices
-        self.loopback_mic = self.get_loopback_microphone()
-        if self.loopback_mic is None:
-            raise RuntimeError("Could not find loopback microphone for the default speaker.")
+        self.VAD_RATE = 8000  # VAD runs on a downsampled copy; webrtcvad works at 8 kHz internally anyway
+        self.FRAMES_PER_BLOCK = 5  # Frames read per recorder.record() call (100 ms)
+        # Processing pipeline parameters
+        self.PIPELINE_QUEUE_SIZE = 8  # Max jobs waiting per stage
+        self.PIPELINE_BACKPRESSURE = 'drop_oldest'  # 'drop_oldest' or 'block'
+        self.TRIM_WORKERS = 2
+        self.ENCODE_WORKERS = 2
+        # Duplicate detection parameters
+        self.DUPLICATE_POLICY = 'merge'  # 'merge' (count it on the earlier clip), 'skip' or 'keep'
+        self.ECHO_WINDOW = 10  # Seconds after one of our clips finishes playing during which it counts as self-echo
+        self.fingerprints = FingerprintIndex(max_entries=2000)  # Recent recordings by clip id
+        self.echo_fingerprints = FingerprintIndex(max_entries=50)  # Clips we played recently, by WAV path
+        self.echo_expiry = {}  # WAV path -> time after which a capture of it is no longer self-echo
+        self.duplicate_stats = {'echo_suppressed': 0, 'merged': 0, 'skipped': 0}
+        self.pipeline = self.build_pipeline()
+        # Transcription parameters
+        self.TRANSCRIBER = 'google'  # 'google', 'vosk' (offline) or 'fake'
+        self.TRANSCRIBER_OPTIONS = {'language': 'en-ZA', 'timeout': 10}
+        self.TRANSCRIBE_WORKERS = 4  # Network bound, so more workers than cores is fine
+        if transcriber is None:
+            transcriber = create_transcriber(self.TRANSCRIBER, **self.TRANSCRIBER_OPTIONS)
+        self.transcription = TranscriptionService(
+            transcriber,
+            on_result=self.set_transcript,
+            store=self.store,
+            sample_rate=self.SAMPLE_RATE,
+            workers=self.TRANSCRIBE_WORKERS
+        )
+        # Retention parameters (None turns a limit off); favorites and the current session are always kept
+        self.RETENTION_MAX_BYTES = 5 * 1024 ** 3  # Disk budget for clip audio
+        self.RETENTION_MAX_AGE_DAYS = 90  # Recordings not played for this long are deleted
+        self.RETENTION_MAX_CLIPS_PER_SESSION = 1000
+        self.COMPACT_AFTER_DAYS = 7  # WAVs not played for this long are compacted to FLAC
+        self.retention = self.build_retention()
+        # Where audio comes from; devices are only opened on start(), with one capture thread per source
+        self.sources = list(sources) if sources else [LoopbackSource()]
+        self.captures = []
 
-        # Load favorites and recordings on startup
+        # Import the old JSON files once, then load favorites and recordings on startup
+        self.store.migrate_json(self.favorites_folder)
         self.load_favorites()
         self.load_recordings()
-
-    def get_loopback_microphone(self):
-        default_speaker = sc.default_speaker()
-        all_mics = sc.all_microphones(include_loopback=True)
-        for mic in all_mics:
-            if mic.isloopback and mic.name == default_speaker.name:
-                return mic
-        return None
+        self.store.set_meta('current_session', self.session_folder)  # Where an API process finds our recordings
 
     def start(self):
-        self.is_listening = True
-        self.thread = threading.Thread(target=self.record_loop)
-        self.thread.daemon = True
-        self.thread.start()
+        self.captures = self.build_captures()
+        # Resolve every capture device first, so a missing device fails here rather than in a thread
+        for capture in self.captures:
+            capture.open()
+        self.transcription.start()
+        self.transcription.resume(self.store.get_untranscribed())  # Left unfinished by an earlier run
+        self.pipeline.start()
+        self.set_state(is_listening=True)
+        for capture in self.captures:
+            capture.start()
+        self.retention.start()
 
     def stop(self):
-        self.is_listening = False
-        self.thread.join()
-
-    def record_loop(self):
-        def convert_audio(data):
-            # Convert audio data to 16-bit PCM
-            if data.shape[1] > 1:
-                data = data[:, 0]  # Take first channel if stereo
-            else:
-                data = data.flatten()
-            pcm_data = np.int16(data * 32767).tobytes()
-            return pcm_data
-
-        with self.loopback_mic.recorder(samplerate=self.SAMPLE_RATE, channels=[0], exclusive_mode=False) as recorder:
-            print("Listening for speech...")
-            while self.is_listening:
-                data = recorder.record(numframes=self.FRAME_SIZE)
-                pcm_data = convert_audio(data)
-                is_speech = self.vad.is_speech(pcm_data, self.SAMPLE_RATE)
-                if is_speech:
-                    self.silence_duration = 0
-                    self.audio_buffer.extend(pcm_data)
-                    if not self.is_recording:
-                        self.is_recording = True
-                        print("Speech detected, recording...")
-                elif len(self.audio_buffer) > 0:
-                    self.silence_duration += self.FRAME_DURATION / 1000.0
-                    if self.silence_duration > self.MAX_SILENCE_DURATION:
-                        print("Silence detected, processing audio...")
-                        self.process_audio_buffer()
-                else:
-                    pass  # No speech detected
-
-    def process_audio_buffer(self):
-        timestamp = int(time.time())
-        # Create AudioSegment from the raw audio buffer
-        audio_segment = AudioSegment(
-            data=bytes(self.audio_buffer),
-            sample_width=2,  # 16-bit PCM
-            frame_rate=self.SAMPLE_RATE,
-            channels=self.NUM_CHANNELS
+        self.retention.stop()
+        self.set_state(is_listening=False)
+        for capture in self.captures:
+            capture.stop()
+        self.pipeline.stop()
+        self.transcription.stop()
+
+    def build_captures(self):
+        """
+        Builds one SourceCapture per source, each with its own VAD and segmenter state.
+
+        Clips are tagged with the source's name, made unique with a suffix
+        when two sources share one.
+        """
+        captures = []
+        tags = set()
+        for source in self.sources:
+            tag = source.name
+            suffix = 2
+            while tag in tags:
+                tag = f"{source.name}-{suffix}"
+                suffix += 1
+            tags.add(tag)
+            front_end = CaptureFrontEnd(
+                webrtcvad.Vad(self.VAD_MODE),
+                sample_rate=self.SAMPLE_RATE,
+                vad_rate=self.VAD_RATE,
+                frame_duration=self.FRAME_DURATION,
+                frames_per_block=self.FRAMES_PER_BLOCK
+            )
+            segmenter = Segmenter(
+                sample_rate=self.SAMPLE_RATE,
+                frame_duration=self.FRAME_DURATION,
+                max_silence=self.MAX_SILENCE_DURATION,
+                pre_roll=self.PRE_ROLL_DURATION,
+                max_length=self.MAX_CLIP_DURATION,
+                spill_after=self.SPILL_AFTER_DURATION,
+                spill_dir=self.spill_folder
+            )
+            captures.append(SourceCapture(source, tag, front_end, segmenter,
+                                          on_clip=self.submit_clip, on_state=self.update_capture_state))
+        return captures
+
+    def build_retention(self):
+        """
+        Builds the background retention manager that keeps clip audio within its disk budget.
+
+        It works in small batches on a low-priority thread and waits while
+        any source is recording, so capture always comes first.
+        """
+        def days(value):
+            return value * 24 * 3600 if value is not None else None
+
+        return RetentionManager(
+            self.store,
+            self.blobs,
+            max_bytes=self.RETENTION_MAX_BYTES,
+            max_age=days(self.RETENTION_MAX_AGE_DAYS),
+            max_clips_per_session=self.RETENTION_MAX_CLIPS_PER_SESSION,
+            compact_after=days(self.COMPACT_AFTER_DAYS),
+            protect_session=self.session_folder,
+            favorites_folder=self.favorites_folder,
+            on_remove=self.forget_clip,
+            on_compact=self.move_clip_audio,
+            is_busy=lambda: self.is_recording
         )
 
-        # Trim leading and trailing silence
-        trimmed_audio = self.trim_silence(audio_segment)
+    def forget_clip(self, clip):
+        # Called by retention after evicting a recording; only clips loaded in this session are in memory
+        with self.lock:
+            recording = self.recordings_by_id.pop(clip['id'], None)
+            if recording is None:
+                return
+            self.recordings.remove(recording)
+            self.changes.record('remove', 'recordings', clip['id'], event='evicted')
+            self.search_index.remove(clip['id'])
+        self.fingerprints.remove(clip['id'])
 
-        if len(trimmed_audio) == 0:
-            print("Trimmed audio is empty after removing silence.")
-            self.audio_buffer = bytearray()
-            self.is_recording = False
-            self.silence_duration = 0
-            return
+    def move_clip_audio(self, clip_ids, new_path):
+        # Called by retention after compacting a WAV, so playback here and in the API process reads the new file
+        with self.lock:
+            lists = (('recordings', self.recordings_by_id), ('favorites', self.favorites_by_id))
+            for clip_id in clip_ids:
+                for list_type, clips_by_id in lists:
+                    clip = clips_by_id.get(clip_id)
+                    if clip is not None:
+                        clip['wav_filename'] = new_path
+                        self.changes.record('update', list_type, clip_id, clip, event='compacted')
 
-        wav_filename = os.path.join(self.session_folder, f"output_{timestamp}.wav")
-        # Export audio in the format expected by the recognizer (16 kHz, mono)
-        trimmed_audio.set_frame_rate(16000).set_channels(1).export(wav_filename, format="wav")
+    def record_play(self, clip):
+        # Count a play of a recording or favorite; retention evicts the least recently played first
+        now = int(time.time())
+        with self.lock:
+            clip['play_count'] = (clip.get('play_count') or 0) + 1
+            clip['last_played'] = now
+        self.store.record_play(clip['id'], now)
+
+    def build_pipeline(self):
+        """
+        Builds the post-capture pipeline: segment -> fingerprint -> trim -> encode -> publish.
+
+        Every stage has its own bounded queue and worker pool, so the capture
+        threads only ever hand off a finished buffer and go straight back to
+        reading their device. Queues are kept per capture source and served
+        round-robin, so a busy source can't starve a quiet one. Duplicates and self-echo are dropped at
+        the fingerprint stage, before any trimming, disk or transcription work.
+        Transcription runs in its own service after publish, so a slow
+        recognizer never holds a clip back.
+        """
+        pipeline = Pipeline(key=lambda job: job['source'])
+        size = self.PIPELINE_QUEUE_SIZE
+        policy = self.PIPELINE_BACKPRESSURE
+        pipeline.add_stage('segment', self.segment_stage, workers=1, maxsize=size, policy=policy,
+                           on_drop=self.discard_utterance)
+        pipeline.add_stage('fingerprint', self.fingerprint_stage, workers=1, maxsize=size, policy=policy)
+        pipeline.add_stage('trim', self.trim_stage, workers=self.TRIM_WORKERS, maxsize=size, policy=policy)
+        pipeline.add_stage('encode', self.encode_stage, workers=self.ENCODE_WORKERS, maxsize=size, policy=policy)
+        pipeline.add_stage('publish', self.publish_stage, workers=1, maxsize=size, policy='block')
+        return pipeline
 
+    def submit_clip(self, source, utterance):
+        # Called on a capture thread with a finished utterance (in memory or spilled to disk);
+        # only queue it, so capture never waits on trimming, encoding or transcription
+        self.pipeline.submit(dict(utterance, timestamp=int(time.time()), source=source))
+
+    def update_capture_state(self):
+        # Recording while any source is in an utterance; listening until every finite source has run out
+        with self.lock:
+            is_recording = any(capture.segmenter.is_recording for capture in self.captures)
+            is_listening = self.is_listening and not all(capture.finished for capture in self.captures)
+            self.set_state(is_listening=is_listening, is_recording=is_recording)
+
+    def get_source_stats(self):
+        # Per-source capture stats (just the sources' own before start())
+        if self.captures:
+            return [capture.get_stats() for capture in self.captures]
+        return [source.get_stats() for source in self.sources]
+
+    def segment_stage(self, job):
+        if 'pcm_path' in job:
+            # A long utterance the segmenter spilled to disk; it is at most MAX_CLIP_DURATION long
+            path = job.pop('pcm_path')
+            job['samples'] = np.fromfile(path, dtype=np.int16)
+            os.remove(path)
+        else:
+            # View the raw audio buffer as 16-bit samples (no copy)
+            job['samples'] = np.frombuffer(job.pop('pcm_data'), dtype=np.int16)
+        return job
+
+    def discard_utterance(self, job):
+        # An utterance dropped from the full segment queue; a spilled one owns its file in spill_folder
+        if 'pcm_path' in job:
+            try:
+                os.remove(job['pcm_path'])
+            except OSError:
+                pass
+
+    def fingerprint_stage(self, job):
+        # Drop our own playback picked up again by the loopback device, and
+        # merge or skip near-duplicates of a recent recording
+        signature = fingerprint(job['samples'], self.SAMPLE_RATE)
+        echo = self.match_echo(signature)
+        if echo is not None:
+            logger.info("Ignoring clip: it is our own playback of %s (similarity %.2f).", echo[0], echo[1])
+            self.count_duplicate('echo_suppressed')
+            return None
+        match = self.fingerprints.query(signature) if self.DUPLICATE_POLICY != 'keep' else None
+        if match is not None:
+            clip_id, similarity = match
+            logger.info("Clip is a near-duplicate of recording %s (similarity %.2f).", clip_id, similarity)
+            if self.DUPLICATE_POLICY == 'merge':
+                self.merge_duplicate(clip_id)
+            else:
+                self.count_duplicate('skipped')
+            return None
+        job['fingerprint'] = signature
+        return job
+
+    def match_echo(self, signature):
+        # (wav path, similarity) if the clip matches something we played within ECHO_WINDOW
+        now = time.time()
+        with self.lock:
+            expired = [path for path, expiry in self.echo_expiry.items() if expiry < now]
+            for path in expired:
+                del self.echo_expiry[path]
+        for path in expired:
+            self.echo_fingerprints.remove(path)
+        return self.echo_fingerprints.query(signature)
+
+    def note_playback(self, clip):
+        """
+        Remembers a clip we just played so its loopback capture is recognised as self-echo.
+
+        Parameters:
+        - clip: The recording or favorite that was played.
+        """
+        path = clip['wav_filename']
+        signature = self.fingerprints.get(clip.get('source_id') or clip['id'])
+        if signature is None:
+            signature = self.echo_fingerprints.get(path)
         try:
-            with sr.AudioFile(wav_filename) as source:
-                # Adjust for ambient noise
-                self.recognizer.adjust_for_ambient_noise(source, duration=0.5)
-                audio_data = self.recognizer.record(source)
-            # Get the recognition result with show_all=False to get a string directly
-            text = self.recognizer.recognize_google(audio_data, language='en-ZA')
-            print("Transcription:", text)
+            if signature is None:
+                signature = fingerprint_file(path)
+            duration = audio_duration(path)
         except Exception as e:
-            print(f"Transcription error: {e}")
-            traceback.print_exc()
-            text = f"[Error: {e}]"
+            logger.warning("Could not fingerprint %s: %s", path, e)
+            return
+        self.echo_fingerprints.add(path, signature)
+        with self.lock:
+            # Plays can queue up or overlap, so allow for the clip and the time before it starts
+            self.echo_expiry[path] = time.time() + duration + self.ECHO_WINDOW
 
-        mp3_filename = os.path.join(self.session_folder, f"output_{timestamp}.mp3")
-        trimmed_audio.export(mp3_filename, format="mp3")
-        print(f"Audio saved as {mp3_filename}")
+    def merge_duplicate(self, clip_id):
+        # Count a repeat on the earlier recording instead of storing the clip again
+        with self.lock:
+            recording = self.recordings_by_id.get(clip_id)
+            if not recording:
+                return
+            recording['repeat_count'] = recording.get('repeat_count', 1) + 1
+            repeat_count = recording['repeat_count']
+        # The store is written before the change is journaled, so an API process that reloads from the
+        # store at some version never misses a change journaled before it
+        self.store.update(clip_id, repeat_count=repeat_count)
+        with self.lock:
+            self.changes.record('update', 'recordings', clip_id, recording, event='repeated')
+        self.count_duplicate('merged')
 
+    def count_duplicate(self, kind):
+        with self.lock:
+            self.duplicate_stats[kind] += 1
+
+    def trim_stage(self, job):
+        # Trim leading and trailing silence
+        trimmed_samples = self.trim_silence(job.pop('samples'))
+        if len(trimmed_samples) == 0:
+            logger.debug("Trimmed audio is empty after removing silence.")
+            return None
+        job['trimmed_samples'] = trimmed_samples
+        return job
+
+    def encode_stage(self, job):
+        # Store the clip once, as a PCM WAV blob at capture rate named by its
+        # content hash (identical audio is only written once). Browser renditions
+        # (MP3/Opus) are made lazily by self.renditions when first requested.
+        with time_stage('wav_export'):
+            audio_hash, wav_filename = self.blobs.put(job['trimmed_samples'], self.SAMPLE_RATE, self.NUM_CHANNELS)
+        logger.info("Audio saved as %s", wav_filename)
+        # Waveform peaks for the UI, from the samples we already have in memory
+        peaks_path = self.blobs.path_for(audio_hash, 'peaks')
+        if not os.path.exists(peaks_path):
+            with time_stage('peaks'):
+                write_peaks(peaks_path, job['trimmed_samples'], self.SAMPLE_RATE)
+        job['audio_hash'] = audio_hash
+        job['wav_filename'] = wav_filename
+        job['mp3_filename'] = self.blobs.path_for(audio_hash, 'mp3')
+        return job
+
+    def publish_stage(self, job):
+        try:
+            self.publish(job)
+        finally:
+            self.blobs.release(job['audio_hash'])  # Referenced by the clip store now; retention may judge it again
+        return None
+
+    def publish(self, job):
+        recording = {
+            'timestamp': job['timestamp'],
+            'session': self.session_folder,
+            'wav_filename': job['wav_filename'],
+            'mp3_filename': job['mp3_filename'],
+            'audio_hash': job['audio_hash'],
+            'text': '',  # Filled in by set_transcript once transcription finishes
+            'transcript_status': 'transcribing',
+            'repeat_count': 1,
+            'capture_source': job['source'],
+            'name': ''  # Initialize name as empty string
+        }
+        self.store.add('recordings', recording)  # Assigns recording['id']
         with self.lock:
-            recording = {
-                'timestamp': timestamp,
-                'wav_filename': wav_filename,
-                'mp3_filename': mp3_filename,
-                'text': text,  # Ensure text is a string
-                'name': ''  # Initialize name as empty string
-            }
             self.recordings.append(recording)
-            self.save_recordings()
-        self.audio_buffer = bytearray()
-        self.is_recording = False
-        self.silence_duration = 0
+            self.recordings_by_id[recording['id']] = recording
+            self.changes.record('add', 'recordings', recording['id'], recording, event='clip_created')
+            self.search_index.add('recordings', recording)
+        self.fingerprints.add(recording['id'], job.pop('fingerprint'))
+        latency = time.perf_counter() - job['speech_end']
+        self.publish_latencies.append(latency)
+        CLIP_LATENCY.observe(latency)
+        self.transcription.submit(recording['id'], job.pop('trimmed_samples'))
+
+    def set_transcript(self, clip_id, text, status):
+        # Called by the transcription service; also fills in favorites made while it was running.
+        # Clips resumed from an earlier session may not be loaded, and are only updated in the store.
+        with self.lock:
+            clips = []
+            if clip_id in self.recordings_by_id:
+                clips.append(('recordings', self.recordings_by_id[clip_id]))
+            elif clip_id in self.favorites_by_id:
+                clips.append(('favorites', self.favorites_by_id[clip_id]))
+            favorite_id = self.favorite_ids_by_source.get(clip_id)
+            if favorite_id is not None and \
+                    self.favorites_by_id[favorite_id]['transcript_status'] in ('transcribing', 'pending'):
+                clips.append(('favorites', self.favorites_by_id[favorite_id]))
+            for list_type, clip in clips:
+                clip['text'] = text
+                clip['transcript_status'] = status
+        if not clips:
+            self.store.update(clip_id, text=text, transcript_status=status)
+        for _, clip in clips:
+            self.store.update(clip['id'], text=text, transcript_status=status)
+        with self.lock:
+            for list_type, clip in clips:
+                self.changes.record('update', list_type, clip['id'], clip, event='transcribed')
+                self.search_index.add(list_type, clip)
 
-    def trim_silence(self, audio_segment, silence_thresh=-50, min_silence_len=100):
+    def trim_silence(self, samples, silence_thresh=-50, min_silence_len=100):
         """
-        Trims leading and trailing silence from an audio segment.
+        Trims leading and trailing silence from a clip.
 
         Parameters:
-        - audio_segment: The AudioSegment to trim.
+        - samples: The int16 numpy array to trim.
         - silence_thresh: Silence threshold in dBFS. Default is -50 dBFS.
         - min_silence_len: Minimum length of silence to detect (in ms). Default is 100 ms.
 
         Returns:
-        - A new AudioSegment with silence trimmed from the start and end.
+        - A view of `samples` with silence trimmed from the start and end
+          (empty if the whole clip is silent).
         """
-        # Detect nonsilent parts [start, end] in milliseconds
-        nonsilent_ranges = silence.detect_nonsilent(
-            audio_segment,
-            min_silence_len=min_silence_len,
-            silence_thresh=silence_thresh
+        start_trim, end_trim = find_nonsilent_bounds(
+            samples,
+            self.SAMPLE_RATE,
+            silence_thresh=silence_thresh,
+            min_silence_len=min_silence_len
         )
+        return samples[start_trim:end_trim]
 
-        if not nonsilent_ranges:
-            # The entire audio is silent
-            return AudioSegment.empty()
-
-        # Combine nonsilent parts
-        start_trim = nonsilent_ranges[0][0]
-        end_trim = nonsilent_ranges[-1][1]
-        trimmed_audio = audio_segment[start_trim:end_trim]
-        return trimmed_audio
-
-    def get_status(self):
+    def add_to_favorites(self, clip_id):
         with self.lock:
-            return {
-                'is_listening': self.is_listening,
-                'is_recording': self.is_recording,
-                'recordings': list(reversed(self.recordings)),  # Newest first
-                'favorites': list(reversed(self.favorites))  # Newest first
-            }
-
-    def add_to_favorites(self, timestamp):
-        # Find the recording in self.recordings
-        with self.lock:
-            recording = next((r for r in self.recordings if r['timestamp'] == timestamp), None)
+            recording = self.recordings_by_id.get(clip_id)
             if not recording:
                 return False
             # Check if already in favorites
-            if any(fav['timestamp'] == timestamp for fav in self.favorites):
-                print(f"Recording with timestamp {timestamp} is already in favorites.")
+            if clip_id in self.favorite_ids_by_source:
+                logger.info("Recording %s is already in favorites.", clip_id)
                 return True  # Already in favorites
-            # Copy the audio files to the favorites folder
-            wav_dest = os.path.join(self.favorites_folder, os.path.basename(recording['wav_filename']))
-            mp3_dest = os.path.join(self.favorites_folder, os.path.basename(recording['mp3_filename']))
-            shutil.copy2(recording['wav_filename'], wav_dest)
-            shutil.copy2(recording['mp3_filename'], mp3_dest)
-            # Add to favorites list
-            favorite = {
-                'timestamp': recording['timestamp'],
-                'wav_filename': wav_dest,
-                'mp3_filename': mp3_dest,
-                'text': recording['text'],
-                'name': recording.get('name', '')
-            }
-            self.favorites.append(favorite)
-            self.save_favorites()
-        return True
-
-    def save_favorites(self):
-        print("Saving favorites...")
-        favorites_data = []
-        unique_timestamps = set()
-        for fav in self.favorites:
-            if fav['timestamp'] not in unique_timestamps:
-                unique_timestamps.add(fav['timestamp'])
-                favorites_data.append({
-                    'timestamp': fav['timestamp'],
-                    'wav_filename': os.path.basename(fav['wav_filename']),
-                    'mp3_filename': os.path.basename(fav['mp3_filename']),
-                    'text': fav.get('text', ''),
-                    'name': fav.get('name', '')
-                })
-        favorites_json_path = os.path.join(self.favorites_folder, 'favorites.json')
-        print(f"Saving favorites to {favorites_json_path}")
+            recording = dict(recording)
+        if recording.get('audio_hash'):
+            return self.add_favorite(clip_id, recording)
+        # A clip from before the blob store: adopt its WAV as a blob (hardlinked, not copied)
+        recording['audio_hash'], recording['wav_filename'] = self.blobs.put_file(recording['wav_filename'])
+        recording['mp3_filename'] = self.blobs.path_for(recording['audio_hash'], 'mp3')
         try:
-            with open(favorites_json_path, 'w') as f:
-                json.dump(favorites_data, f)
-            print("Favorites saved successfully.")
-        except Exception as e:
-            print(f"Error saving favorites: {e}")
+            return self.add_favorite(clip_id, recording)
+        finally:
+            self.blobs.release(recording['audio_hash'])
 
-    def load_favorites(self):
-        favorites_json = os.path.join(self.favorites_folder, 'favorites.json')
-        print(f"Loading favorites from {favorites_json}")
-        if os.path.exists(favorites_json):
-            try:
-                with open(favorites_json, 'r') as f:
-                    favorites_data = json.load(f)
-                    for fav in favorites_data:
-                        wav_filename = os.path.join(self.favorites_folder, fav['wav_filename'])
-                        mp3_filename = os.path.join(self.favorites_folder, fav['mp3_filename'])
-                        self.favorites.append({
-                            'timestamp': fav['timestamp'],
-                            'wav_filename': wav_filename,
-                            'mp3_filename': mp3_filename,
-                            'text': fav.get('text', ''),
-                            'name': fav.get('name', '')
-                        })
-                print("Favorites loaded successfully.")
-            except Exception as e:
-                print(f"Error loading favorites: {e}")
-                traceback.print_exc()
-        else:
-            # Create an empty favorites.json file
-            print("Favorites JSON file does not exist. Creating a new one.")
-            with open(favorites_json, 'w') as f:
-                json.dump([], f)
-
-        # Ensure all files in favorites folder are represented
-        existing_timestamps = {fav['timestamp'] for fav in self.favorites}
-        for filename in os.listdir(self.favorites_folder):
-            if filename.endswith('.wav'):
-                timestamp_str = filename.split('_')[1].split('.')[0]
-                try:
-                    timestamp = int(timestamp_str)
-                except ValueError:
-                    continue  # Skip files with unexpected names
-                if timestamp not in existing_timestamps:
-                    wav_filename = os.path.join(self.favorites_folder, filename)
-                    mp3_filename = os.path.join(self.favorites_folder, f"output_{timestamp}.mp3")
-                    self.favorites.append({
-                        'timestamp': timestamp,
-                        'wav_filename': wav_filename,
-                        'mp3_filename': mp3_filename,
-                        'text': '',
-                        'name': ''
-                    })
-        # Remove duplicates
-        self.favorites = list({fav['timestamp']: fav for fav in self.favorites}.values())
-        # Sort favorites by timestamp (newest first)
-        self.favorites.sort(key=lambda x: x['timestamp'], reverse=True)
-        self.save_favorites()  # Save any new additions
-
-    def save_recordings(self):
-        print("Saving recordings...")
-        recordings_data = []
-        unique_timestamps = set()
-        for rec in self.recordings:
-            if rec['timestamp'] not in unique_timestamps:
-                unique_timestamps.add(rec['timestamp'])
-                recordings_data.append({
-                    'timestamp': rec['timestamp'],
-                    'wav_filename': os.path.basename(rec['wav_filename']),
-                    'mp3_filename': os.path.basename(rec['mp3_filename']),
-                    'text': rec.get('text', ''),
-                    'name': rec.get('name', '')
-                })
-        recordings_json_path = os.path.join(self.session_folder, 'recordings.json')
-        print(f"Saving recordings to {recordings_json_path}")
+    def add_favorite(self, clip_id, recording):
+        # The favorite references the same blob as the recording; no audio is copied
+        favorite = {
+            'source_id': clip_id,
+            'session': recording['session'],
+            'timestamp': recording['timestamp'],
+            'wav_filename': recording['wav_filename'],
+            'mp3_filename': recording['mp3_filename'],
+            'audio_hash': recording['audio_hash'],
+            'capture_source': recording.get('capture_source'),
+            'text': recording['text'],
+            'transcript_status': recording['transcript_status'],
+            'name': recording.get('name', '')
+        }
+        # Not under self.lock: the store's favorites_source index rejects a second favorite of the recording
         try:
-            with open(recordings_json_path, 'w') as f:
-                json.dump(recordings_data, f)
-            print("Recordings saved successfully.")
-        except Exception as e:
-            print(f"Error saving recordings: {e}")
+            self.store.add('favorites', favorite)  # Assigns favorite['id']
+        except sqlite3.IntegrityError:
+            logger.info("Recording %s was favorited concurrently by another request.", clip_id)
+            return True
+        with self.lock:
+            self.favorites.append(favorite)
+            self.favorites_by_id[favorite['id']] = favorite
+            self.favorite_ids_by_source[clip_id] = favorite['id']
+            self.changes.record('add', 'favorites', favorite['id'], favorite, event='favorited')
+            self.search_index.add('favorites', favorite)
+        return True
 
-    def load_recordings(self):
-        recordings_json = os.path.join(self.session_folder, 'recordings.json')
-        print(f"Loading recordings from {recordings_json}")
-        if os.path.exists(recordings_json):
-            try:
-                with open(recordings_json, 'r') as f:
-                    recordings_data = json.load(f)
-                    for rec in recordings_data:
-                        wav_filename = os.path.join(self.session_folder, rec['wav_filename'])
-                        mp3_filename = os.path.join(self.session_folder, rec['mp3_filename'])
-                        self.recordings.append({
-                            'timestamp': rec['timestamp'],
-                            'wav_filename': wav_filename,
-                            'mp3_filename': mp3_filename,
-                            'text': rec.get('text', ''),
-                            'name': rec.get('name', '')
-                        })
-                print("Recordings loaded successfully.")
-            except Exception as e:
-                print(f"Error loading recordings: {e}")
-                traceback.print_exc()
+    def update_name(self, list_type, clip_id, new_name):
+        if list_type == 'recordings':
+            clips = self.recordings_by_id
+        elif list_type == 'favorites':
+            clips = self.favorites_by_id
         else:
-            # Create an empty recordings.json file
-            print("Recordings JSON file does not exist. Creating a new one.")
-            with open(recordings_json, 'w') as f:
-                json.dump([], f)
-
-        # Ensure all files in session folder are represented
-        existing_timestamps = {rec['timestamp'] for rec in self.recordings}
-        for filename in os.listdir(self.session_folder):
-            if filename.endswith('.wav'):
-                timestamp_str = filename.split('_')[1].split('.')[0]
-                try:
-                    timestamp = int(timestamp_str)
-                except ValueError:
-                    continue  # Skip files with unexpected names
-                if timestamp not in existing_timestamps:
-                    wav_filename = os.path.join(self.session_folder, filename)
-                    mp3_filename = os.path.join(self.session_folder, f"output_{timestamp}.mp3")
-                    self.recordings.append({
-                        'timestamp': timestamp,
-                        'wav_filename': wav_filename,
-                        'mp3_filename': mp3_filename,
-                        'text': '',
-                        'name': ''
-                    })
-        # Remove duplicates
-        self.recordings = list({rec['timestamp']: rec for rec in self.recordings}.values())
-        # Sort recordings by timestamp (newest first)
-        self.recordings.sort(key=lambda x: x['timestamp'], reverse=True)
-        self.save_recordings()  # Save any new additions
-
-    def update_name(self, list_type, timestamp, new_name):
+            logger.warning("Invalid list_type '%s' provided.", list_type)
+            return False
         with self.lock:
-            if list_type == 'recordings':
-                recording = next((r for r in self.recordings if r['timestamp'] == timestamp), None)
-                if recording:
-                    recording['name'] = new_name
-                    self.save_recordings()
-                    print(f"Successfully updated name to '{new_name}' for recording with timestamp {timestamp}")
-                    return True
-                else:
-                    print(f"Recording with timestamp {timestamp} not found in recordings.")
-                    return False
-            elif list_type == 'favorites':
-                recording = next((r for r in self.favorites if r['timestamp'] == timestamp), None)
-                if recording:
-                    recording['name'] = new_name
-                    self.save_favorites()
-                    print(f"Successfully updated name to '{new_name}' for favorite with timestamp {timestamp}")
-                    return True
-                else:
-                    print(f"Recording with timestamp {timestamp} not found in favorites.")
-                    return False
-            else:
-                print(f"Invalid list_type '{list_type}' provided.")
+            clip = clips.get(clip_id)
+            if not clip:
+                logger.warning("Clip %s not found in %s.", clip_id, list_type)
                 return False
+            clip['name'] = new_name
+        self.store.update(clip_id, name=new_name)
+        with self.lock:
+            self.changes.record('update', list_type, clip_id, clip, event='renamed')
+            self.search_index.add(list_type, clip)
+        logger.info("Successfully updated name to '%s' for %s clip %s", new_name, list_type, clip_id)
+        return True
+
+# Where to capture from and play to. The defaults use the sound card. Several sources are captured
+# at once when separated by commas, e.g. ECHO_CAPTURE_SOURCE='loopback#0,loopback#1,loopback:Discord'.
+# For running headless, e.g. ECHO_CAPTURE_SOURCE='file:lobby.wav@4' or 'synthetic', and ECHO_PLAYBACK_SINK='null'
+CAPTURE_SOURCE = os.environ.get('ECHO_CAPTURE_SOURCE', 'loopback')
+PLAYBACK_SINK = os.environ.get('ECHO_PLAYBACK_SINK', 'device')
+
+# Replace this with the name of your virtual microphone input device
+VIRTUAL_MIC_NAME = 'CABLE Input (VB-Audio Virtual Cable)'  # Adjust as per your virtual mic's name
+
+# The capture process listens for the API process's commands here (localhost only by default)
+IPC_ADDRESS = os.environ.get('ECHO_IPC_ADDRESS', '127.0.0.1:5001')
+IPC_KEY_FILE = 'ipc.key'  # Shared secret, created next to the clip store by whichever process starts first
+CAPTURE_STOP_TIMEOUT = 30  # Seconds the capture process gets to finish its clips and close the store on exit
+# The web UI / HTTP API
+API_HOST = os.environ.get('ECHO_API_HOST', '0.0.0.0')
+API_PORT = int(os.environ.get('ECHO_API_PORT', '5000'))
+API_THREADS = 16
+# Each open /events stream holds one of those threads for as long as the page is open. Past this many,
+# /events answers 503 and the page polls /status instead, so the rest of the API always has threads left
+MAX_EVENT_STREAMS = 8
 
-# Flask app setup
-app = Flask(__name__)
+class CaptureController:
+    """
+    The capture process: recorder, playback engine and the commands the API process may send.
 
-# Initialize the AudioRecorder
-recorder = AudioRecorder()
+    Capture, VAD, processing and playback run here, in their own
+    interpreter, so no number of HTTP requests can delay the capture
+    threads. The API process reads clips from the shared store and follows
+    the recorder's change journal. Everything that changes state (playing,
+    favoriting, renaming) comes back here through COMMANDS over
+    multiprocessing.connection.
 
-@app.route('/')
+    Parameters:
+    - recorder: AudioRecorder.
+    - player: PlaybackEngine for the virtual microphone.
+    """
+
+    COMMANDS = ('hello', 'play', 'stop_all', 'playback', 'favorite', 'rename', 'stats', 'metrics')
+
+    def __init__(self, recorder, player):
+        self.recorder = recorder
+        self.player = player
+
+    def hello(self):
+        # Starting point for an API process that is about to (re)load from the store and follow the journal
+        recorder = self.recorder
+        with recorder.lock:
+            return {
+                'version': recorder.changes.current_version(),
+                'session': recorder.session_folder,
+                'is_listening': recorder.is_listening,
+                'is_recording': recorder.is_recording,
+            }
+
+    def play(self, list_type, clip_id, mode):
+        """
+        Plays a recording or favorite on the virtual microphone.
+
+        Returns:
+        - (response dict, HTTP status code)
+        """
+        recording = self.recorder.find_clip(list_type, clip_id)
+        if not recording:
+            message = 'Favorite recording not found' if list_type == 'favorites' else 'Recording not found'
+            return {'status': 'error', 'message': message}, 404
+        if mode not in self.player.MODES:
+            return {'status': 'error', 'message': f"Invalid mode '{mode}'"}, 400
+        play_id = self.player.play(recording['wav_filename'], mode=mode)
+        if play_id is None:
+            return {'status': 'error', 'message': 'Virtual microphone not found'}, 503
+        self.recorder.note_playback(recording)  # So its loopback capture isn't recorded as a new clip
+        self.recorder.record_play(recording)
+        return {'status': 'playing' if mode != 'queue' else 'queued', 'id': clip_id, 'play_id': play_id}, 200
+
+    def stop_all(self):
+        self.player.stop_all()
+
+    def playback(self):
+        return self.player.get_status()
+
+    def favorite(self, clip_id):
+        return self.recorder.add_to_favorites(clip_id)
+
+    def rename(self, list_type, clip_id, name):
+        return self.recorder.update_name(list_type, clip_id, name)
+
+    def stats(self):
+        recorder = self.recorder
+        stats = recorder.pipeline.get_stats()
+        stats['transcription'] = recorder.transcription.get_stats()
+        stats['sources'] = recorder.get_source_stats()
+        stats['retention'] = recorder.retention.get_stats()
+        with recorder.lock:
+            stats['duplicates'] = dict(recorder.duplicate_stats)
+        return stats
+
+    def metrics(self):
+        return REGISTRY.render()
+
+    def collect_metrics(self):
+        """
+        Reads the recorder's and player's own counters for /metrics.
+
+        Called at scrape time, so none of this costs anything on the capture or
+        pipeline threads.
+        """
+        recorder = self.recorder
+        stages = recorder.pipeline.get_stats()['stages'] + [recorder.transcription.get_stats()]
+        transcription = stages[-1]
+        sources = recorder.get_source_stats()
+        retention = recorder.retention.get_stats()
+        playback = self.player.get_status()
+        caches = {
+            'transcript': (transcription['cache_hits'], transcription['cache_misses']),
+            'pcm': (playback['cache']['hits'], playback['cache']['misses']),
+        }
+        with recorder.lock:
+            duplicates = dict(recorder.duplicate_stats)
+            clips = {'recordings': len(recorder.recordings), 'favorites': len(recorder.favorites)}
+            state = {'listening': recorder.is_listening, 'recording': recorder.is_recording}
+        families = [
+            ('echo_queue_depth', 'gauge', 'Jobs waiting in each stage queue.',
+             [({'stage': s['name']}, s['queued']) for s in stages]
+             + [({'stage': 'playback'}, len(playback['queued']))]),
+            ('echo_jobs_in_flight', 'gauge', 'Jobs being processed by each stage.',
+             [({'stage': s['name']}, s['in_flight']) for s in stages]),
+            ('echo_jobs_processed_total', 'counter', 'Jobs finished by each stage.',
+             [({'stage': s['name']}, s['processed']) for s in stages]),
+            ('echo_jobs_dropped_total', 'counter', 'Jobs discarded by backpressure because a stage queue was full.',
+             [({'stage': s['name']}, s['dropped']) for s in stages]),
+            ('echo_job_errors_total', 'counter', 'Jobs that raised an exception.',
+             [({'stage': s['name']}, s['errors']) for s in stages]),
+            ('echo_transcription_failures_total', 'counter', 'Clips whose transcription failed after all retries.',
+             [({}, transcription['failures'])]),
+            ('echo_capture_overruns_total', 'counter',
+             'Times a capture device overflowed because it was read too late.',
+             [({'source': s.get('tag', s['source'])}, s.get('overruns', 0)) for s in sources]),
+            ('echo_capture_clips_total', 'counter', 'Utterances cut from each capture source.',
+             [({'source': s.get('tag', s['source'])}, s.get('clips', 0)) for s in sources]),
+            ('echo_cache_hits_total', 'counter', 'Cache lookups that found what they were looking for.',
+             [({'cache': name}, hits) for name, (hits, _) in caches.items()]),
+            ('echo_cache_misses_total', 'counter', 'Cache lookups that had to do the work.',
+             [({'cache': name}, misses) for name, (_, misses) in caches.items()]),
+            ('echo_cache_hit_ratio', 'gauge', 'Fraction of cache lookups that were hits since startup.',
+             [({'cache': name}, hits / (hits + misses) if hits + misses else float('nan'))
+              for name, (hits, misses) in caches.items()]),
+            ('echo_duplicates_total', 'counter',
+             'Captured clips dropped as self-echo or merged/skipped as near-duplicates.',
+             [({'kind': kind}, count) for kind, count in duplicates.items()]),
+            ('echo_clips', 'gauge', 'Clips in each list.', [({'list': name}, count) for name, count in clips.items()]),
+            ('echo_state', 'gauge', 'Whether the recorder is listening / recording (1 or 0).',
+             [({'state': name}, int(value)) for name, value in state.items()]),
+            ('echo_playback_voices', 'gauge', 'Clips currently being mixed into the virtual microphone.',
+             [({}, len(playback['playing']))]),
+            ('echo_retention_actions_total', 'counter',
+             'Clips evicted, WAVs compacted and sessions pruned by retention.',
+             [({'action': action}, retention[action]) for action in ('evicted', 'compacted', 'sessions_pruned')]),
+            ('echo_retention_freed_bytes_total', 'counter', 'Disk space freed by retention.',
+             [({}, retention['bytes_freed'])]),
+        ]
+        if retention['disk_bytes'] is not None:
+            families.append(('echo_clip_audio_bytes', 'gauge',
+                             'Disk space used by clip audio at the last retention scan.',
+                             [({}, retention['disk_bytes'])]))
+        dropped = [({'source': s.get('tag', s['source'])}, s['dropped_samples'] // recorder.FRAME_SIZE)
+                   for s in sources if 'dropped_samples' in s]
+        if dropped:
+            families.append(('echo_capture_dropped_frames_total', 'counter',
+                             'VAD frames of audio lost to capture overruns.',
+                             dropped))
+        return families
+
+# HTTP API; runs in the API process and only talks to the capture process through the store and IPC
+api = Blueprint('echo', __name__)
+
+def get_library():
+    # The API process's LibraryMirror
+    return current_app.extensions['echo_library']
+
+def send_command(command, **kwargs):
+    return get_library().client.call(command, **kwargs)
+
+@api.errorhandler(CaptureUnavailable)
+def capture_unavailable(e):
+    return jsonify({'status': 'error', 'message': f"Capture process is not running ({e})"}), 503
+
+@api.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/status')
+@api.route('/status')
 def status():
-    return jsonify(recorder.get_status())
-
-@app.route('/play/<int:timestamp>', methods=['POST'])
-def play_audio(timestamp):
-    # Find the recording
-    with recorder.lock:
-        recording = next((r for r in recorder.recordings if r['timestamp'] == timestamp), None)
-    if recording:
-        threading.Thread(target=play_over_virtual_mic, args=(recording['wav_filename'],)).start()
-        return jsonify({'status': 'playing', 'timestamp': timestamp})
-    else:
-        return jsonify({'status': 'error', 'message': 'Recording not found'}), 404
+    library = get_library()
+    since = request.args.get('since', type=int)
+    limit = request.args.get('limit', type=int)
+    offset = request.args.get('offset', default=0, type=int)
+    version = library.changes.current_version()
+    etag = f'"{version}"'
+    if since == version or (since is None and request.if_none_match.contains(str(version))):
+        return Response(status=304, headers={'ETag': etag})
+    status_data = library.get_status(since=since, limit=limit, offset=max(offset, 0))
+    response = jsonify(status_data)
+    response.headers['ETag'] = f'"{status_data["version"]}"'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
-@app.route('/play_favorite/<int:timestamp>', methods=['POST'])
-def play_favorite_audio(timestamp):
-    # Find the recording in favorites
-    with recorder.lock:
-        recording = next((r for r in recorder.favorites if r['timestamp'] == timestamp), None)
-    if recording:
-        threading.Thread(target=play_over_virtual_mic, args=(recording['wav_filename'],)).start()
-        return jsonify({'status': 'playing', 'timestamp': timestamp})
-    else:
-        return jsonify({'status': 'error', 'message': 'Favorite recording not found'}), 404
+def format_event(change):
+    # Serialise a journal entry as one Server-Sent Event, using its version as the event id
+    return f"id: {change['version']}\nevent: {change['event']}\ndata: {json.dumps(change)}\n\n"
+
+@api.route('/events')
+def events():
+    """
+    Server-Sent Events stream of recorder changes.
 
-@app.route('/update_name/<list_type>/<int:timestamp>', methods=['POST'])
-def update_name_route(list_type, timestamp):
+    Served from the API process's mirror of the capture process's journal.
+    Clients resume from the `Last-Event-ID` header (sent automatically by
+    EventSource on reconnect) or `?since=<version>`. If they are too far
+    behind for the change journal, a single 'resync' event tells them to
+    fetch a full /status snapshot. Idle connections just sleep on the
+    journal's condition variable and send a comment every 15 s to keep
+    proxies from closing them.
+
+    Each stream holds a server thread, so at most MAX_EVENT_STREAMS are
+    open at once; past that it answers 503 and clients poll /status.
+    """
+    library = get_library()
+    streams = current_app.extensions['echo_event_streams']
+    if not streams.acquire(blocking=False):
+        response = jsonify({'status': 'error', 'message': "Too many open event streams; poll /status instead"})
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    if since is None:
+        since = library.changes.current_version()
+
+    def stream(version):
+        yield "retry: 2000\n\n"
+        while True:
+            changes = library.changes.since(version)
+            if changes is None:
+                version = library.changes.current_version()
+                yield f"id: {version}\nevent: resync\ndata: {json.dumps({'version': version})}\n\n"
+                continue
+            for change in changes:
+                version = change['version']
+                yield format_event(change)
+            if library.changes.wait(version, timeout=15) == version:
+                yield ": keepalive\n\n"
+
+    response = Response(stream(since), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    response.call_on_close(streams.release)  # Also when the client goes away mid-stream
+    return response
+
+@api.route('/search')
+def search():
+    query = request.args.get('q', '')
+    list_type = request.args.get('list') or None
+    if list_type not in (None, 'recordings', 'favorites'):
+        return jsonify({'status': 'error', 'message': f"Invalid list '{list_type}'"}), 400
+    limit = min(max(request.args.get('limit', default=20, type=int), 1), 200)
+    offset = max(request.args.get('offset', default=0, type=int), 0)
+    return jsonify(get_library().search(query, list_type=list_type, limit=limit, offset=offset))
+
+@api.route('/pipeline')
+def pipeline_status():
+    return jsonify(send_command('stats'))
+
+@api.route('/metrics')
+def metrics():
+    # Prometheus text format of the capture process: per-stage latency histograms, queue depths, overruns, cache hits
+    return Response(send_command('metrics'), content_type=CONTENT_TYPE)
+
+@api.route('/metrics/api')
+def api_metrics():
+    # Metrics of this API process (rendition encodes, link to the capture process); scrape it as a separate target
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+def play_clip(list_type, clip_id, mode):
+    result, status_code = send_command('play', list_type=list_type, clip_id=clip_id, mode=mode)
+    return jsonify(result), status_code
+
+@api.route('/play/<int:clip_id>', methods=['POST'])
+def play_audio(clip_id):
+    return play_clip('recordings', clip_id, request.values.get('mode', 'mix'))
+
+@api.route('/play_favorite/<int:clip_id>', methods=['POST'])
+def play_favorite_audio(clip_id):
+    return play_clip('favorites', clip_id, request.values.get('mode', 'mix'))
+
+@api.route('/queue/<list_type>/<int:clip_id>', methods=['POST'])
+def queue_audio(list_type, clip_id):
+    # Play after everything currently playing or queued
+    return play_clip(list_type, clip_id, 'queue')
+
+@api.route('/interrupt/<list_type>/<int:clip_id>', methods=['POST'])
+def interrupt_audio(list_type, clip_id):
+    # Cut off whatever is playing and play this right away
+    return play_clip(list_type, clip_id, 'interrupt')
+
+@api.route('/stop_all', methods=['POST'])
+def stop_all_audio():
+    send_command('stop_all')
+    return jsonify({'status': 'stopped'})
+
+@api.route('/playback')
+def playback_status():
+    return jsonify(send_command('playback'))
+
+@api.route('/update_name/<list_type>/<int:clip_id>', methods=['POST'])
+def update_name_route(list_type, clip_id):
     try:
         new_name = request.form.get('name', '')
         if not new_name:
             return jsonify({'status': 'error', 'message': 'Name is empty'}), 400
-        print(f"Received request to update name to '{new_name}' for {list_type} with timestamp {timestamp}")
-        success = recorder.update_name(list_type, timestamp, new_name)
+        logger.debug("Received request to update name to '%s' for %s clip %s", new_name, list_type, clip_id)
+        success = send_command('rename', list_type=list_type, clip_id=clip_id, name=new_name)
         if success:
-            print(f"Successfully updated name to '{new_name}' for {list_type} with timestamp {timestamp}")
-            return jsonify({'status': 'success', 'timestamp': timestamp, 'name': new_name})
+            return jsonify({'status': 'success', 'id': clip_id, 'name': new_name})
         else:
-            print(f"Failed to update name for {list_type} with timestamp {timestamp}")
+            logger.warning("Failed to update name for %s clip %s", list_type, clip_id)
             return jsonify({'status': 'error', 'message': 'Recording not found'}), 404
+    except CaptureUnavailable:
+        raise
     except Exception as e:
-        print(f"Exception in update_name: {e}")
-        traceback.print_exc()
+        logger.exception("Exception in update_name: %s", e)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
-def play_over_virtual_mic(filename):
-    # Replace this with the name of your virtual microphone input device
-    virtual_mic_name = 'CABLE Input (VB-Audio Virtual Cable)'  # Adjust as per your virtual mic's name
+# Content-addressed files never change under the same URL, so browsers may keep them for a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
 
-    # Get the virtual microphone as a speaker
-    virtual_mic_speaker = None
-    for speaker in sc.all_speakers():
-        if virtual_mic_name.lower() in speaker.name.lower():
-            virtual_mic_speaker = speaker
-            break
+def send_clip(folder, filename):
+    """
+    Serves a clip's audio with byte-range requests and conditional GETs.
 
-    if virtual_mic_speaker is None:
-        print("Virtual microphone not found.")
-        return
-
-    # Read the audio file
-    audio_segment = AudioSegment.from_wav(filename)
-    samples = np.array(audio_segment.get_array_of_samples()).astype(np.float32) / (1 << 15)
-    samples = samples.reshape(-1, audio_segment.channels)
-    # Play the samples to the virtual microphone
-    with virtual_mic_speaker.player(samplerate=audio_segment.frame_rate, channels=audio_segment.channels, exclusive_mode=False) as player:
-        player.play(samples)
-    print(f"Played {filename} over virtual microphone.")
+    Range, If-Range, If-None-Match and If-Modified-Since are answered by
+    werkzeug's conditional responses, so a player seeking or resuming only
+    fetches the bytes it needs. Blob files are named by the hash of their
+    audio: they are cached as immutable, and the WAV's ETag is that hash.
+    Older clips in session folders are revalidated with their ETag instead.
+    """
+    library = get_library()
+    renditions = current_app.extensions['echo_renditions']
+    is_blob = library.blobs.is_blob_name(filename)
+    # Blobs are found by their hash; older clips are still read from their own folder
+    if is_blob:
+        folder = library.blobs.folder_for(filename)
+    # Encode MP3/Opus renditions on first request; everything else is served as-is
+    is_rendition = renditions.is_rendition(filename)
+    if is_rendition:
+        if renditions.get(os.path.join(folder, filename)) is None:
+            abort(404)
+    if not is_blob:
+        return send_from_directory(os.path.abspath(folder), filename)  # Relative to the working directory, not the app
+    # A rendition's bytes depend on the encoder, so only the WAV's ETag can be its audio hash
+    etag = True if is_rendition else os.path.splitext(filename)[0]
+    response = send_from_directory(os.path.abspath(folder), filename, etag=etag, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
-@app.route('/recordings/<filename>')
+@api.route('/recordings/<filename>')
 def get_recording(filename):
     # Ensure that the filename is safe
     if '..' in filename or filename.startswith('/'):
         abort(400)
-    return send_from_directory(recorder.session_folder, filename)
+    return send_clip(get_library().session_folder, filename)
 
-@app.route('/favorites/<filename>')
+@api.route('/favorites/<filename>')
 def get_favorite(filename):
     # Ensure that the filename is safe
     if '..' in filename or filename.startswith('/'):
         abort(400)
-    return send_from_directory(recorder.favorites_folder, filename)
+    return send_clip(get_library().favorites_folder, filename)
+
+@api.route('/peaks/<int:clip_id>')
+def get_peaks(clip_id):
+    """
+    Waveform peaks of a recording or favorite, in the binary format of peaks.encode_peaks.
+
+    A clip's audio never changes, so neither do its peaks: they are served
+    with a year-long immutable Cache-Control and an ETag for revalidation.
+    """
+    library = get_library()
+    clip = library.find_clip('recordings', clip_id) or library.find_clip('favorites', clip_id)
+    if not clip:
+        abort(404)
+    try:
+        path = library.get_peaks_path(clip)
+    except (OSError, EOFError, wave.Error) as e:
+        logger.warning("Could not compute peaks for clip %s: %s", clip_id, e)
+        abort(404)
+    response = send_file(os.path.abspath(path), mimetype='application/octet-stream',
+                         etag=clip.get('audio_hash') or True, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
-@app.route('/favorite/<int:timestamp>', methods=['POST'])
-def favorite_audio(timestamp):
-    success = recorder.add_to_favorites(timestamp)
+@api.route('/favorite/<int:clip_id>', methods=['POST'])
+def favorite_audio(clip_id):
+    success = send_command('favorite', clip_id=clip_id)
     if success:
-        return jsonify({'status': 'success', 'timestamp': timestamp})
+        return jsonify({'status': 'success', 'id': clip_id})
     else:
         return jsonify({'status': 'error', 'message': 'Recording not found'}), 404
 
-if __name__ == '__main__':
-    # Start the recorder only when running the script directly
+def collect_api_metrics(library, renditions):
+    # Counters of the API process, read at scrape time
+    rendition_stats = renditions.get_stats()
+    return [
+        ('echo_cache_hits_total', 'counter', 'Cache lookups that found what they were looking for.',
+         [({'cache': 'rendition'}, rendition_stats['hits'])]),
+        ('echo_cache_misses_total', 'counter', 'Cache lookups that had to do the work.',
+         [({'cache': 'rendition'}, rendition_stats['misses'])]),
+        ('echo_capture_connected', 'gauge', 'Whether this API process is following the capture process.',
+         [({}, int(library.connected))]),
+    ]
+
+def create_recorder():
+    # The recorder and playback engine of the capture process, configured from the environment
+    recorder = AudioRecorder(sources=sources_from_spec(CAPTURE_SOURCE))
+    # Long-lived playback service for the virtual microphone
+    player = PlaybackEngine(VIRTUAL_MIC_NAME, sample_rate=recorder.SAMPLE_RATE, sink=sink_from_spec(PLAYBACK_SINK))
+    return recorder, player
+
+def create_app(library=None):
+    """
+    Application factory for the HTTP API.
+
+    Parameters:
+    - library: LibraryMirror to serve. By default one is made from the clip
+      store in the working directory, following the capture process at
+      IPC_ADDRESS, and started.
+
+    Returns:
+    - The Flask app. Nothing in it captures or plays audio; that all
+      happens in the capture process (see run_capture).
+    """
+    if library is None:
+        client = CommandClient(parse_address(IPC_ADDRESS), authkey_path=IPC_KEY_FILE)
+        library = LibraryMirror(client, ClipStore('echo.db'), BlobStore('blobs'))
+        library.start()
+    renditions = RenditionCache()  # MP3/Opus are encoded on first request, in the API process
+    app = Flask(__name__)
+    app.extensions['echo_library'] = library
+    app.extensions['echo_renditions'] = renditions
+    app.extensions['echo_event_streams'] = threading.BoundedSemaphore(MAX_EVENT_STREAMS)
+    app.register_blueprint(api)
+    REGISTRY.register(lambda: collect_api_metrics(library, renditions), key='api')
+    return app
+
+def run_capture(stop_event=None):
+    """
+    Runs the capture process until interrupted (or until `stop_event` is set).
+
+    Captures and processes clips, plays them on the virtual microphone and
+    serves the API process's commands on IPC_ADDRESS.
+    """
+    # Log through a background thread; DEBUG also logs every speech start/end
+    setup_logging(os.environ.get('ECHO_LOG_LEVEL', 'INFO'))
+    recorder, player = create_recorder()
+    controller = CaptureController(recorder, player)
+    REGISTRY.register(controller.collect_metrics, key='capture')
+    server = CommandServer(parse_address(IPC_ADDRESS), load_authkey(IPC_KEY_FILE), controller,
+                           CaptureController.COMMANDS, recorder.changes)
     recorder.start()
-    # Run the Flask app with debug mode enabled
-    app.run(debug=True, use_reloader=False, host='0.0.0.0', port=5000)
+    # Open the virtual microphone stream and decode favorites up front so the first click plays instantly
+    if player.start():
+        with recorder.lock:
+            favorite_wavs = [fav['wav_filename'] for fav in recorder.favorites]
+        threading.Thread(target=player.preload, args=(favorite_wavs,), daemon=True).start()
+    server.start()
+    stop_event = stop_event or threading.Event()
+    try:
+        while not stop_event.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        recorder.stop()
+        player.stop()
+        recorder.store.close()
+
+def run_api(host=API_HOST, port=API_PORT, threads=API_THREADS):
+    # Serves the web UI / HTTP API with waitress (the Flask development server if waitress isn't installed)
+    setup_logging(os.environ.get('ECHO_LOG_LEVEL', 'INFO'))
+    app = create_app()
+    try:
+        import waitress
+    except ImportError:
+        logger.warning("waitress is not installed (pip install waitress); using Flask's development server")
+        app.run(host=host, port=port, threaded=True)
+        return
+    logger.info("Serving the web UI on http://%s:%d with %d threads", host, port, threads)
+    # Keep reading from busy connections, so a page closed mid-/events frees its stream at the next keepalive
+    waitress.serve(app, host=host, port=port, threads=threads, channel_request_lookahead=1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Echo soundboard.")
+    parser.add_argument('role', nargs='?', choices=('all', 'capture', 'api'), default='all',
+                        help="'capture' records and plays clips, 'api' serves the web UI, 'all' runs both "
+                             "(as two processes)")
+    args = parser.parse_args()
+    if args.role == 'capture':
+        run_capture()
+    elif args.role == 'api':
+        run_api()
+    else:
+        # Spawned rather than forked, the same on every platform: the child imports this module afresh
+        context = multiprocessing.get_context('spawn')
+        stop_event = context.Event()
+        capture = context.Process(target=run_capture, args=(stop_event,), name='capture')
+        capture.start()
+        try:
+            run_api()
+        finally:
+            # Let it finish the clips in flight and close the store; only kill it if it hangs
+            stop_event.set()
+            try:
+                capture.join(CAPTURE_STOP_TIMEOUT)
+            except KeyboardInterrupt:
+                pass  # Interrupted again: stop waiting
+            if capture.is_alive():
+                logger.warning("The capture process didn't stop within %d s; terminating it", CAPTURE_STOP_TIMEOUT)
+                capture.terminate()
+                capture.join()
+
+
+if __name__ == '__main__':
+    main()
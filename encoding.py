@@ -0,0 +1,204 @@
+import logging
+import os
+import tempfile
+import threading
+import wave
+
+import numpy as np
+from pydub import AudioSegment
+
+from metrics import time_stage
+
+logger = logging.getLogger(__name__)
+
+# Lossless format old clips are compacted to; it decodes to exactly the samples of the WAV
+COMPACT_FORMAT = 'flac'
+# Files a clip's audio can be stored in, in order of preference
+SOURCE_EXTENSIONS = ('wav', COMPACT_FORMAT)
+
+
+def temp_path_for(path):
+    """
+    Creates an empty temporary file next to `path`, to be written and then moved onto it.
+
+    Every call gets its own name, so concurrent writers of the same file
+    never share a temporary file, and the last os.replace wins.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.',
+                                     suffix='.part')
+    os.close(fd)
+    os.chmod(temp_path, 0o644)  # mkstemp makes it private to us
+    return temp_path
+
+
+def write_wav(path, samples, sample_rate, channels=1):
+    """
+    Writes int16 samples to a PCM WAV file without going through pydub/ffmpeg.
+
+    The file is written to a temporary file of its own and moved into place,
+    so readers never see a half-written clip.
+
+    Parameters:
+    - path: Destination .wav path.
+    - samples: int16 numpy array (interleaved if channels > 1).
+    - sample_rate: Sample rate of `samples`.
+    - channels: Number of channels.
+    """
+    temp_path = temp_path_for(path)
+    try:
+        with wave.open(temp_path, 'wb') as wav_file:
+            wav_file.setnchannels(channels)
+            wav_file.setsampwidth(2)  # 16-bit PCM
+            wav_file.setframerate(sample_rate)
+            wav_file.writeframes(samples.tobytes())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def read_audio(path):
+    """
+    Reads a clip's audio, whether it is a WAV or has been compacted.
+
+    WAVs are read directly; anything else (e.g. FLAC) is decoded through
+    pydub/ffmpeg.
+
+    Returns:
+    - (int16 numpy array, interleaved if channels > 1, sample_rate, channels)
+    """
+    if path.lower().endswith('.wav'):
+        with wave.open(path, 'rb') as wav_file:
+            if wav_file.getsampwidth() != 2:
+                raise ValueError(f"{path} is not 16-bit PCM")
+            channels = wav_file.getnchannels()
+            sample_rate = wav_file.getframerate()
+            samples = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype=np.int16)
+        return samples, sample_rate, channels
+    segment = AudioSegment.from_file(path).set_sample_width(2)
+    return np.array(segment.get_array_of_samples(), dtype=np.int16), segment.frame_rate, segment.channels
+
+
+def audio_duration(path):
+    # Length of a clip in seconds; only a WAV's header is read
+    if path.lower().endswith('.wav'):
+        with wave.open(path, 'rb') as wav_file:
+            return wav_file.getnframes() / wav_file.getframerate()
+    samples, sample_rate, channels = read_audio(path)
+    return len(samples) / channels / sample_rate
+
+
+def compact_wav(wav_path):
+    """
+    Writes a losslessly compressed copy of a WAV clip next to it.
+
+    The WAV itself is left in place, so the caller can point the clip at the
+    copy before deleting it.
+
+    Returns:
+    - The path of the compressed copy, e.g. <hash>.flac.
+    """
+    path = os.path.splitext(wav_path)[0] + '.' + COMPACT_FORMAT
+    temp_path = path + '.part'
+    with time_stage('compact'):
+        AudioSegment.from_wav(wav_path).export(temp_path, format=COMPACT_FORMAT)
+    os.replace(temp_path, path)
+    return path
+
+
+class RenditionCache:
+    """
+    Produces compressed renditions (MP3/Opus) of the canonical WAV clips on demand.
+
+    Most clips are never played in the browser, so nothing is encoded at
+    ingest. The first request for e.g. output_<ts>.mp3 encodes it next to the
+    WAV, and later requests are served from disk. Concurrent requests for the
+    same rendition share one encode job instead of each spawning ffmpeg.
+    """
+
+    # extension -> pydub export arguments
+    FORMATS = {
+        'mp3': {'format': 'mp3'},
+        'opus': {'format': 'ogg', 'codec': 'libopus'},
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}  # rendition path -> threading.Event set when its encode job finishes
+        self.hits = 0  # Requests served from a rendition already on disk
+        self.misses = 0  # Requests that had to encode (or wait for an encode)
+
+    @staticmethod
+    def source_for(rendition_path):
+        # The canonical audio a rendition is made from: output_<ts>.mp3 -> output_<ts>.wav,
+        # or output_<ts>.flac once the clip has been compacted
+        base = os.path.splitext(rendition_path)[0]
+        for extension in SOURCE_EXTENSIONS:
+            if os.path.exists(f"{base}.{extension}"):
+                return f"{base}.{extension}"
+        return base + '.wav'
+
+    def is_rendition(self, filename):
+        return os.path.splitext(filename)[1].lstrip('.').lower() in self.FORMATS
+
+    def get(self, rendition_path):
+        """
+        Returns the path of a rendition, encoding it first if it doesn't exist yet.
+
+        Parameters:
+        - rendition_path: Path of the wanted rendition, e.g. session_x/output_<ts>.mp3.
+
+        Returns:
+        - rendition_path once it exists, or None if there is no WAV to build it from
+          or the encode failed.
+        """
+        if os.path.exists(rendition_path):
+            with self.lock:
+                self.hits += 1
+            return rendition_path
+        source_path = self.source_for(rendition_path)
+        if not os.path.exists(source_path):
+            return None
+
+        with self.lock:
+            done = self.pending.get(rendition_path)
+            if done is None and os.path.exists(rendition_path):
+                # Another request finished encoding it since we looked
+                self.hits += 1
+                return rendition_path
+            self.misses += 1
+            owner = done is None
+            if owner:
+                done = threading.Event()
+                self.pending[rendition_path] = done
+
+        if not owner:
+            # Someone else is already encoding this rendition; wait for their result
+            done.wait()
+            return rendition_path if os.path.exists(rendition_path) else None
+
+        try:
+            self.encode(source_path, rendition_path)
+        except Exception as e:
+            logger.error("Error encoding %s: %s", rendition_path, e)
+        finally:
+            with self.lock:
+                del self.pending[rendition_path]
+            done.set()
+        return rendition_path if os.path.exists(rendition_path) else None
+
+    def encode(self, source_path, rendition_path):
+        extension = os.path.splitext(rendition_path)[1].lstrip('.').lower()
+        temp_path = temp_path_for(rendition_path)
+        try:
+            with time_stage(f'{extension}_encode'):
+                AudioSegment.from_file(source_path).export(temp_path, **self.FORMATS[extension])
+            os.replace(temp_path, rendition_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        logger.info("Encoded %s", rendition_path)
+
+    def get_stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'encoding': len(self.pending)}
@@ -0,0 +1,168 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from capture import decimate
+from encoding import read_audio
+
+FINGERPRINT_RATE = 8000  # Peaks are picked below 4 kHz, where speech and game audio carry most energy
+FFT_SIZE = 512  # 64 ms windows
+HOP_SIZE = 64  # 8 ms between frames, so clips captured out of step with the original still line up
+PEAK_FREQ_RADIUS = 8  # A peak is the loudest bin within +-8 bins (+-125 Hz) ...
+PEAK_TIME_RADIUS = 6  # ... and +-6 frames (+-48 ms)
+PEAK_MIN_DB = 20  # ... and at least this far above the clip's median level
+FREQ_QUANTUM = 2  # Peak frequencies are hashed in 31 Hz steps, so small shifts still hash the same
+FAN_OUT = 4  # Each peak is paired with the next few peaks
+MAX_PAIR_FRAMES = 63  # Pairs further apart than this (about 0.5 s) are not hashed
+
+
+def sliding_max(values, radius, axis):
+    # Max over a window of +-radius along one axis (edges padded with -inf)
+    pad = [(0, 0)] * values.ndim
+    pad[axis] = (radius, radius)
+    padded = np.pad(values, pad, constant_values=-np.inf)
+    return sliding_window_view(padded, 2 * radius + 1, axis=axis).max(axis=-1)
+
+
+def fingerprint(samples, sample_rate):
+    """
+    Computes a compact acoustic fingerprint of a clip.
+
+    The clip is resampled to 8 kHz and turned into a log spectrogram. The
+    spectral peaks ("constellation") are paired with their next few
+    neighbours, and each pair is hashed as (frequency 1, frequency 2, time
+    gap), together with the frame of its first peak. The hashes don't depend
+    on level or on where the clip starts, so the same audio captured again,
+    e.g. our own playback picked up by the loopback device, gives mostly the
+    same hashes at a constant frame offset.
+
+    Parameters:
+    - samples: int16 numpy array.
+    - sample_rate: Sample rate of `samples`.
+
+    Returns:
+    - A (hashes, frames) pair of equal-length uint32 arrays (empty for silence or very short clips).
+    """
+    audio = decimate(samples, sample_rate, FINGERPRINT_RATE).astype(np.float32)
+    if len(audio) < FFT_SIZE:
+        return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint32)
+    frames = sliding_window_view(audio, FFT_SIZE)[::HOP_SIZE] * np.hanning(FFT_SIZE).astype(np.float32)
+    spectrum = 20 * np.log10(np.abs(np.fft.rfft(frames, axis=1)) + 1.0)
+
+    neighbourhood = sliding_max(sliding_max(spectrum, PEAK_FREQ_RADIUS, 1), PEAK_TIME_RADIUS, 0)
+    floor = np.median(spectrum) + PEAK_MIN_DB
+    times, freqs = np.nonzero((spectrum == neighbourhood) & (spectrum > floor))  # Sorted by time
+
+    hashes = []
+    frames = []
+    for k in range(1, FAN_OUT + 1):
+        dt = times[k:] - times[:-k]
+        valid = (dt > 0) & (dt <= MAX_PAIR_FRAMES)
+        f1 = (freqs[:-k][valid] // FREQ_QUANTUM).astype(np.uint32)
+        f2 = (freqs[k:][valid] // FREQ_QUANTUM).astype(np.uint32)
+        hashes.append((f1 << 13) | (f2 << 6) | dt[valid].astype(np.uint32))
+        frames.append(times[:-k][valid].astype(np.uint32))
+    return np.concatenate(hashes), np.concatenate(frames)
+
+
+def fingerprint_file(path):
+    # Fingerprint of a clip's 16-bit WAV (or compacted) file; multi-channel files are mixed down first
+    samples, sample_rate, channels = read_audio(path)
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+    return fingerprint(samples, sample_rate)
+
+
+class FingerprintIndex:
+    """
+    In-memory index of clip fingerprints for near-duplicate lookup.
+
+    Every hash maps to the clips (and frames) containing it. A query looks
+    up each of its hashes and votes for (clip, frame offset). Audio that
+    really is the same lines up at one offset, while chance collisions with
+    unrelated clips scatter over many. A clip matches when enough of the
+    shorter fingerprint's hashes agree on one offset. Only the most recent
+    `max_entries` clips are kept, so memory stays bounded.
+
+    Parameters:
+    - max_entries: Number of clips kept before the oldest are evicted.
+    - threshold: Fraction of hashes shared at one offset for two clips to count as duplicates.
+    - min_hashes: Fingerprints with fewer hashes than this never match (too little audio to tell).
+    - min_matches: Hashes that must agree on one offset, however short the clips are.
+    """
+
+    def __init__(self, max_entries=2000, threshold=0.2, min_hashes=20, min_matches=8):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.min_hashes = min_hashes
+        self.min_matches = min_matches
+        self.entries = OrderedDict()  # key -> (hashes, frames), oldest first
+        self.postings = {}  # hash -> list of (key, frame)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def add(self, key, fingerprint):
+        hashes, frames = fingerprint
+        with self.lock:
+            self.remove_locked(key)
+            self.entries[key] = fingerprint
+            for value, frame in zip(hashes.tolist(), frames.tolist()):
+                entries = self.postings.get(value)
+                if entries is None:
+                    entries = self.postings[value] = []
+                entries.append((key, frame))
+            while len(self.entries) > self.max_entries:
+                self.remove_locked(next(iter(self.entries)))
+
+    def remove(self, key):
+        with self.lock:
+            self.remove_locked(key)
+
+    def remove_locked(self, key):
+        fingerprint = self.entries.pop(key, None)
+        if fingerprint is None:
+            return
+        for value in set(fingerprint[0].tolist()):
+            entries = [entry for entry in self.postings[value] if entry[0] != key]
+            if entries:
+                self.postings[value] = entries
+            else:
+                del self.postings[value]
+
+    def query(self, fingerprint):
+        """
+        Finds the indexed clip most similar to a fingerprint.
+
+        Returns:
+        - (key, similarity) of the best match at or above the threshold, or None.
+        """
+        hashes, frames = fingerprint
+        if len(hashes) < self.min_hashes:
+            return None
+        votes = {}
+        with self.lock:
+            for value, frame in zip(hashes.tolist(), frames.tolist()):
+                for key, indexed_frame in self.postings.get(value, ()):
+                    # Offsets are binned in pairs of frames, so a capture that is a fraction of a frame out still lines up
+                    vote = (key, (indexed_frame - frame) >> 1)
+                    votes[vote] = votes.get(vote, 0) + 1
+            best = None
+            for (key, offset), count in votes.items():
+                count += votes.get((key, offset + 1), 0)
+                if count < self.min_matches:
+                    continue
+                similarity = count / min(len(hashes), len(self.entries[key][0]))
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (key, similarity)
+        return best
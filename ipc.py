@@ -0,0 +1,229 @@
+import logging
+import os
+import threading
+import time
+from multiprocessing.connection import AuthenticationError, Client, Listener
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE = 15  # Seconds between keepalives on an idle change stream, so dead subscribers are noticed
+
+
+class CaptureUnavailable(ConnectionError):
+    """Raised when the capture process can't be reached."""
+
+
+def parse_address(spec):
+    # 'host:port' -> (host, port) for multiprocessing.connection
+    host, _, port = spec.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def load_authkey(path='ipc.key'):
+    """
+    Returns the shared secret that authenticates the API process to the capture process.
+
+    Whichever process starts first creates the key file with random bytes;
+    the other reads it. Both run in the same folder, next to the clip store.
+    """
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(os.urandom(32))
+    for _ in range(50):
+        with open(path, 'rb') as f:
+            key = f.read()
+        if len(key) == 32:
+            return key
+        time.sleep(0.01)  # The other process is still writing it
+    raise RuntimeError(f"{path} is not a valid IPC key; delete it and restart both processes")
+
+
+class CommandServer:
+    """
+    Serves commands and the change stream to API processes over multiprocessing.connection.
+
+    Every connection gets its own thread. A connection either sends
+    (command, kwargs) requests and gets ('ok', result) or ('error', message)
+    back, or subscribes with ('subscribe', {'since': version}) and from then
+    on receives ('changes', [journal entries]) as they are recorded,
+    ('keepalive', None) while idle, or a final ('resync', None) if it fell
+    too far behind the journal.
+
+    Parameters:
+    - address: (host, port) to listen on.
+    - authkey: Shared secret clients must know.
+    - handler: Object whose methods implement the commands.
+    - commands: Names of the handler methods clients may call.
+    - changes: ChangeLog streamed to subscribers.
+    """
+
+    def __init__(self, address, authkey, handler, commands, changes):
+        self.address = address
+        self.authkey = authkey
+        self.handler = handler
+        self.commands = set(commands)
+        self.changes = changes
+        self.listener = None
+        self.thread = None
+        self.running = False
+        self.connections = set()
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.listener = Listener(self.address, authkey=self.authkey)
+        self.running = True
+        self.thread = threading.Thread(target=self.accept_loop, name='ipc-accept', daemon=True)
+        self.thread.start()
+        logger.info("Listening for API processes on %s:%d", *self.address)
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        try:
+            Client(self.address, authkey=self.authkey).close()  # Wake up accept()
+        except OSError:
+            pass
+        self.thread.join()
+        self.listener.close()
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            connection.close()
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                connection = self.listener.accept()
+            except (OSError, EOFError, AuthenticationError) as e:
+                if self.running:
+                    logger.warning("Rejected an IPC connection: %s", e)
+                continue
+            if not self.running:
+                connection.close()
+                break
+            with self.lock:
+                self.connections.add(connection)
+            threading.Thread(target=self.serve, args=(connection,), name='ipc-connection', daemon=True).start()
+
+    def serve(self, connection):
+        try:
+            while self.running:
+                command, kwargs = connection.recv()
+                if command == 'subscribe':
+                    self.stream(connection, kwargs['since'])
+                    return
+                if command not in self.commands:
+                    connection.send(('error', f"Unknown command '{command}'"))
+                    continue
+                try:
+                    result = getattr(self.handler, command)(**kwargs)
+                except Exception as e:
+                    logger.exception("IPC command %s failed: %s", command, e)
+                    connection.send(('error', str(e)))
+                    continue
+                connection.send(('ok', result))
+        except (EOFError, OSError, TypeError):
+            pass  # The API process went away, or stop() closed the connection under us
+        finally:
+            with self.lock:
+                self.connections.discard(connection)
+            connection.close()
+
+    def stream(self, connection, version):
+        while self.running:
+            changes = self.changes.since(version)
+            if changes is None:
+                connection.send(('resync', None))
+                return
+            if changes:
+                connection.send(('changes', changes))
+                version = changes[-1]['version']
+            elif self.changes.wait(version, timeout=KEEPALIVE) == version:
+                connection.send(('keepalive', None))
+
+
+class CommandClient:
+    """
+    Sends commands to the capture process's CommandServer.
+
+    One connection is shared by every thread of the API process; commands
+    are quick (they only queue work in the capture process), so they are
+    sent one at a time. The connection is made on first use and remade
+    once if the capture process restarted in between.
+
+    Parameters:
+    - address: (host, port) of the CommandServer.
+    - authkey_path: Key file shared with the capture process.
+    - timeout: Seconds to wait for a reply.
+    """
+
+    def __init__(self, address, authkey_path='ipc.key', timeout=10):
+        self.address = address
+        self.authkey_path = authkey_path
+        self.timeout = timeout
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        try:
+            return Client(self.address, authkey=load_authkey(self.authkey_path))
+        except (OSError, EOFError, AuthenticationError) as e:
+            raise CaptureUnavailable(f"Capture process is not reachable at {self.address[0]}:{self.address[1]}") from e
+
+    def call(self, command, **kwargs):
+        """
+        Runs a command in the capture process and returns its result.
+
+        Raises:
+        - CaptureUnavailable if the capture process can't be reached or doesn't answer in time.
+        - RuntimeError if the command failed there.
+        """
+        with self.lock:
+            reused = self.connection is not None
+            if not reused:
+                self.connection = self.connect()
+            try:
+                status, result = self.request(command, kwargs)
+            except TimeoutError as e:
+                self.close_locked()  # Its reply may still arrive; never read it as the answer to the next command
+                raise CaptureUnavailable(str(e)) from e
+            except (OSError, EOFError) as e:
+                self.close_locked()
+                if not reused:
+                    raise CaptureUnavailable(f"Lost the capture process during '{command}'") from e
+                # The connection predates a restart of the capture process; try once on a fresh one
+                self.connection = self.connect()
+                try:
+                    status, result = self.request(command, kwargs)
+                except (OSError, EOFError) as e:
+                    self.close_locked()
+                    raise CaptureUnavailable(f"Lost the capture process during '{command}'") from e
+        if status == 'error':
+            raise RuntimeError(result)
+        return result
+
+    def request(self, command, kwargs):
+        self.connection.send((command, kwargs))
+        if not self.connection.poll(self.timeout):
+            raise TimeoutError(f"No reply to '{command}' within {self.timeout}s")
+        return self.connection.recv()
+
+    def subscribe(self, since):
+        # A separate connection that receives the change stream after `since` (see CommandServer)
+        connection = self.connect()
+        connection.send(('subscribe', {'since': since}))
+        return connection
+
+    def close_locked(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def close(self):
+        with self.lock:
+            self.close_locked()
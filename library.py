@@ -0,0 +1,180 @@
+import logging
+import os
+import threading
+
+from changelog import ChangeLog
+from peaks import write_peaks_for_wav
+from search import SearchIndex
+
+logger = logging.getLogger(__name__)
+
+
+class ClipLibrary:
+    """
+    In-memory view of the current session's recordings and the favorites.
+
+    This is what the web API reads: the clip lists (oldest first) with
+    their by-id lookups, the change journal behind /status and /events,
+    and the full-text search index. The capture process's AudioRecorder
+    keeps one up to date as clips come in, and the API process mirrors it
+    from the shared clip store and the recorder's change stream
+    (see mirror.LibraryMirror).
+
+    Parameters:
+    - session_folder: Session whose recordings are listed.
+    - store: ClipStore the clips are loaded from.
+    - blobs: BlobStore holding the clips' audio.
+    - favorites_folder: Folder of favorites from before the blob store.
+    """
+
+    def __init__(self, session_folder, store, blobs, favorites_folder='favorites'):
+        self.session_folder = session_folder
+        self.store = store
+        self.blobs = blobs
+        self.favorites_folder = favorites_folder
+        self.lock = threading.RLock()  # Use RLock instead of Lock
+        self.is_listening = False
+        self.is_recording = False
+        self.recordings = []  # List to store recording metadata (oldest first)
+        self.favorites = []   # List to store favorites metadata (oldest first)
+        self.recordings_by_id = {}
+        self.favorites_by_id = {}
+        self.favorite_ids_by_source = {}  # recording id -> favorite id
+        self.changes = ChangeLog()  # Versioned journal used for incremental /status
+        self.search_index = SearchIndex()  # Full-text index over names and transcriptions
+
+    def set_state(self, is_listening=None, is_recording=None):
+        # Flip the listening/recording flags and journal the change so clients pick it up
+        with self.lock:
+            changed = False
+            if is_listening is not None and is_listening != self.is_listening:
+                self.is_listening = is_listening
+                changed = True
+            if is_recording is not None and is_recording != self.is_recording:
+                self.is_recording = is_recording
+                changed = True
+            if changed:
+                self.changes.record('update', 'state', 'state', {
+                    'is_listening': self.is_listening,
+                    'is_recording': self.is_recording
+                }, event='state_changed')
+
+    def find_clip(self, list_type, clip_id):
+        # Look up a recording or favorite by id
+        with self.lock:
+            if list_type == 'recordings':
+                return self.recordings_by_id.get(clip_id)
+            if list_type == 'favorites':
+                return self.favorites_by_id.get(clip_id)
+        return None
+
+    @staticmethod
+    def page_newest_first(items, limit=None, offset=0):
+        # Slice the page out of the (oldest first) list without copying or reversing all of it
+        end = max(len(items) - offset, 0)
+        start = 0 if limit is None else max(end - limit, 0)
+        return items[start:end][::-1]
+
+    def get_status(self, since=None, limit=None, offset=0):
+        """
+        Returns the recorder status.
+
+        Parameters:
+        - since: Version the client already has. When given and the change
+          journal still covers it, only the changes after it are returned.
+        - limit: Maximum number of recordings/favorites per list in a full snapshot.
+        - offset: Number of newest items to skip in a full snapshot.
+
+        Returns:
+        - A dict with 'version' and either 'changes' (incremental) or the full
+          'recordings' and 'favorites' lists (newest first).
+        """
+        if since is not None:
+            changes = self.changes.since(since)
+            if changes is not None:
+                with self.lock:
+                    status = {
+                        'version': self.changes.current_version(),
+                        'is_listening': self.is_listening,
+                        'is_recording': self.is_recording,
+                        'full': False,
+                    }
+                status['changes'] = [c for c in ChangeLog.coalesce(changes) if c['list'] != 'state']
+                return status
+        with self.lock:
+            return {
+                'version': self.changes.current_version(),
+                'is_listening': self.is_listening,
+                'is_recording': self.is_recording,
+                'full': True,
+                'recordings': self.page_newest_first(self.recordings, limit, offset),  # Newest first
+                'favorites': self.page_newest_first(self.favorites, limit, offset),  # Newest first
+                'total_recordings': len(self.recordings),
+                'total_favorites': len(self.favorites)
+            }
+
+    def search(self, query, list_type=None, limit=20, offset=0):
+        """
+        Full-text search over recording and favorite names and transcriptions.
+
+        Parameters:
+        - query: Search text; the last word also matches as a prefix.
+        - list_type: 'recordings' or 'favorites' to search one list only (None for both).
+        - limit: Page size.
+        - offset: Number of results to skip.
+
+        Returns:
+        - A dict with the 'total' number of matches and the 'results' page,
+          best match first. Each result is the clip dict plus its 'score'.
+        """
+        total, hits = self.search_index.search(query, list_type=list_type, limit=limit, offset=offset)
+        results = []
+        with self.lock:
+            for hit_list, clip_id, score in hits:
+                clips = self.favorites_by_id if hit_list == 'favorites' else self.recordings_by_id
+                clip = clips.get(clip_id)
+                if clip:
+                    results.append(dict(clip, list_type=hit_list, score=score))
+        return {'query': query, 'total': total, 'results': results}
+
+    def get_peaks_path(self, clip):
+        """
+        Returns the path of a clip's waveform peaks file.
+
+        Peaks are stored next to the clip's audio, and are computed from the
+        WAV on first request for clips captured before they were made at ingest.
+        """
+        if clip.get('audio_hash'):
+            path = self.blobs.path_for(clip['audio_hash'], 'peaks')
+        else:
+            path = os.path.splitext(clip['wav_filename'])[0] + '.peaks'
+        if not os.path.exists(path):
+            write_peaks_for_wav(clip['wav_filename'], path)
+        return path
+
+    def load_favorites(self):
+        logger.info("Loading favorites from the clip store")
+        favorites = self.store.get_list('favorites')
+        with self.lock:
+            for fav in self.favorites:
+                self.search_index.remove(fav['id'])
+            self.favorites = favorites
+            self.favorites_by_id = {fav['id']: fav for fav in favorites}
+            self.favorite_ids_by_source = {
+                fav['source_id']: fav['id'] for fav in favorites if fav['source_id'] is not None
+            }
+            for fav in favorites:
+                self.search_index.add('favorites', fav)
+        logger.info("Loaded %d favorites.", len(favorites))
+
+    def load_recordings(self):
+        logger.info("Loading recordings for %s from the clip store", self.session_folder)
+        recordings = self.store.get_list('recordings', session=self.session_folder) if self.session_folder else []
+        with self.lock:
+            for rec in self.recordings:
+                self.search_index.remove(rec['id'])
+            self.recordings = recordings
+            self.recordings_by_id = {rec['id']: rec for rec in recordings}
+            for rec in recordings:
+                self.search_index.add('recordings', rec)
+        logger.info("Loaded %d recordings.", len(recordings))
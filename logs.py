@@ -0,0 +1,36 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+LOG_FORMAT = '%(asctime)s %(levelname)-7s %(name)s: %(message)s'
+
+listener = None  # The QueueListener writing records out, once setup_logging has run
+
+
+def setup_logging(level='INFO', stream=None):
+    """
+    Routes all logging through a queue, so logging never blocks the caller on I/O.
+
+    Threads that log (the capture loop, pipeline workers, request handlers)
+    only put the record on an in-memory queue; a single background listener
+    thread formats it and writes it out. Calling it again only changes the
+    level.
+
+    Parameters:
+    - level: Minimum level logged, e.g. 'DEBUG', 'INFO' or 'WARNING'.
+    - stream: Where log lines are written (default: stderr).
+    """
+    global listener
+    root = logging.getLogger()
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    if listener is not None:
+        return
+    records = queue.SimpleQueue()
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    listener.start()
+    atexit.register(listener.stop)  # Flush what is still queued on exit
@@ -0,0 +1,166 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets, from sub-millisecond VAD blocks to slow transcriptions
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_labels(labels):
+    # {'stage': 'trim'} -> '{stage="trim"}', escaped as the Prometheus text format requires
+    if not labels:
+        return ''
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def format_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return 'NaN'
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """
+    Thread-safe latency histogram with fixed buckets, one series per label value.
+
+    Observing a value is a bisect and three additions under a lock, so it is
+    cheap enough to call from the capture thread and every pipeline worker.
+
+    Parameters:
+    - name: Metric name, e.g. 'echo_stage_seconds'.
+    - help: One-line description for the HELP comment.
+    - label_name: Name of the single label that tells series apart (or None).
+    - buckets: Increasing bucket upper bounds; +Inf is added automatically.
+    """
+
+    def __init__(self, name, help, label_name=None, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_name = label_name
+        self.buckets = tuple(buckets)
+        self.series = {}  # label value -> [bucket counts (last one is +Inf), sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, label=None):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label)
+            if series is None:
+                series = self.series[label] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, label=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, label)
+
+    def get_series(self):
+        # label value -> (cumulative bucket counts, sum, count)
+        with self.lock:
+            snapshot = {label: (list(counts), total, count) for label, (counts, total, count) in self.series.items()}
+        result = {}
+        for label, (counts, total, count) in snapshot.items():
+            cumulative = []
+            running = 0
+            for bucket_count in counts:
+                running += bucket_count
+                cumulative.append(running)
+            result[label] = (cumulative, total, count)
+        return result
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label, (cumulative, total, count) in sorted(self.get_series().items(), key=lambda item: str(item[0])):
+            labels = {self.label_name: label} if self.label_name is not None else {}
+            for bound, bucket_count in zip(self.buckets + (math.inf,), cumulative):
+                lines.append(f"{self.name}_bucket{format_labels(dict(labels, le=format_value(bound)))} {bucket_count}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Collects the app's metrics and renders them in the Prometheus text format.
+
+    Latencies are recorded as they happen, in Histograms. Everything the app
+    already counts (queue depths, drops, cache hits, ...) is read at scrape
+    time from collector functions instead, so the hot paths pay nothing
+    extra for it. A collector returns a list of
+    (name, type, help, [(labels dict, value), ...]) tuples, where type is
+    'counter' or 'gauge'. A collector registered under a key replaces the
+    one registered under it before. create_app and run_capture register
+    theirs under a key, so calling either factory again in one process
+    doesn't export each sample twice, which Prometheus rejects.
+    """
+
+    def __init__(self):
+        self.histograms = []
+        self.collectors = {}  # key -> collector, in registration order
+        self.lock = threading.Lock()
+
+    def histogram(self, name, help, label_name=None, buckets=DEFAULT_BUCKETS):
+        histogram = Histogram(name, help, label_name=label_name, buckets=buckets)
+        with self.lock:
+            self.histograms.append(histogram)
+        return histogram
+
+    def register(self, collector, key=None):
+        with self.lock:
+            self.collectors[collector if key is None else key] = collector
+
+    def unregister(self, collector):
+        with self.lock:
+            for key in [key for key, registered in self.collectors.items() if registered == collector]:
+                del self.collectors[key]
+
+    def render(self):
+        with self.lock:
+            histograms = list(self.histograms)
+            collectors = list(self.collectors.values())
+        lines = []
+        for histogram in histograms:
+            lines.extend(histogram.render())
+        for collector in collectors:
+            for name, kind, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+# Shared by every module, so instrumentation doesn't need a registry passed around
+REGISTRY = MetricsRegistry()
+
+# Time spent in each step a clip goes through, labelled by stage:
+# 'vad' (per capture block), the pipeline stages ('segment', 'fingerprint', 'trim', 'encode', 'publish'),
+# 'wav_export', 'peaks', 'metadata_save', 'transcribe' (queue job) / 'transcriber' (one backend call),
+# 'mp3_encode' / 'opus_encode' (renditions), 'compact' (retention compacting an old WAV)
+# and 'playback_start' (play request to first block mixed)
+STAGE_SECONDS = REGISTRY.histogram('echo_stage_seconds', 'Time spent per processing stage.', label_name='stage')
+
+
+def time_stage(stage):
+    # Context manager timing a block of code into echo_stage_seconds{stage=...}
+    return STAGE_SECONDS.time(stage)
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage)
@@ -0,0 +1,131 @@
+import logging
+import threading
+
+from ipc import CaptureUnavailable
+from library import ClipLibrary
+
+logger = logging.getLogger(__name__)
+
+
+class LibraryMirror(ClipLibrary):
+    """
+    The API process's copy of the capture process's clip library.
+
+    Clip lists are loaded straight from the shared clip store, so a large
+    library never goes through the IPC channel. After that, the mirror
+    follows the capture process's change stream and applies every journal
+    entry, keeping the entry's version. /status and /events versions
+    therefore mean the same thing in every API process. Reads never wait
+    for the capture process.
+
+    When the capture process isn't running, the mirror serves what the
+    store holds for the last session and reports it as not listening. It
+    reconnects in the background, reloading from the store each time.
+
+    Parameters:
+    - client: CommandClient connected to the capture process.
+    - store: ClipStore shared with the capture process.
+    - blobs: BlobStore shared with the capture process.
+    - favorites_folder: Folder of favorites from before the blob store.
+    - retry_delay: Seconds between attempts to reach the capture process.
+    """
+
+    def __init__(self, client, store, blobs, favorites_folder='favorites', retry_delay=2.0):
+        super().__init__(store.get_meta('current_session'), store, blobs, favorites_folder)
+        self.client = client
+        self.retry_delay = retry_delay
+        self.connected = False
+        self.subscription = None
+        self.stopping = threading.Event()
+        self.thread = None
+        self.load_favorites()
+        self.load_recordings()
+
+    def start(self):
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name='library-mirror', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        subscription = self.subscription
+        if subscription is not None:
+            subscription.close()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                self.follow()
+            except CaptureUnavailable:
+                pass
+            except (EOFError, OSError):
+                if not self.stopping.is_set():
+                    logger.warning("Lost the capture process; reconnecting")
+            finally:
+                if self.subscription is not None:
+                    self.subscription.close()
+                    self.subscription = None
+            if self.connected:
+                self.connected = False
+                self.set_state(is_listening=False, is_recording=False)
+            self.stopping.wait(self.retry_delay)
+
+    def follow(self):
+        # Load a consistent starting point, then apply the change stream until it ends
+        hello = self.client.call('hello')
+        self.subscription = self.client.subscribe(hello['version'])
+        # Clips in the store may be newer than hello['version']; replaying their changes is harmless
+        with self.lock:
+            self.session_folder = hello['session']
+            self.load_favorites()
+            self.load_recordings()
+            self.is_listening = hello['is_listening']
+            self.is_recording = hello['is_recording']
+            self.changes.reset(hello['version'])
+            self.connected = True
+        logger.info("Following the capture process (session %s)", self.session_folder)
+        while not self.stopping.is_set():
+            kind, payload = self.subscription.recv()
+            if kind == 'resync':
+                logger.info("Fell behind the capture process; reloading")
+                return
+            if kind == 'changes':
+                with self.lock:
+                    for change in payload:
+                        self.apply_change(change)
+
+    def apply_change(self, change):
+        # Apply one journal entry from the capture process to the local lists, then journal it here too
+        item = change['item']
+        if change['list'] == 'state':
+            self.is_listening = item['is_listening']
+            self.is_recording = item['is_recording']
+        else:
+            if change['list'] == 'favorites':
+                clips, clips_by_id = self.favorites, self.favorites_by_id
+            else:
+                clips, clips_by_id = self.recordings, self.recordings_by_id
+            clip = clips_by_id.get(change['key'])
+            if change['op'] == 'remove':
+                if clip is not None:
+                    clips.remove(clip)
+                    del clips_by_id[change['key']]
+                    self.search_index.remove(change['key'])
+            else:
+                if clip is None:
+                    clip = clips_by_id[change['key']] = {}
+                    clips.append(clip)
+                clip.clear()
+                clip.update(item)
+                if change['list'] == 'favorites' and clip.get('source_id') is not None:
+                    self.favorite_ids_by_source[clip['source_id']] = clip['id']
+                self.search_index.add(change['list'], clip)
+        self.changes.append(change)
+
+    def get_status(self, since=None, limit=None, offset=0):
+        status = super().get_status(since=since, limit=limit, offset=offset)
+        status['capture_connected'] = self.connected
+        return status
@@ -0,0 +1,85 @@
+import os
+import struct
+
+import numpy as np
+
+from encoding import read_audio, temp_path_for
+
+PEAK_SAMPLES = 512  # Samples per peak at the finest level (about 10 ms at 48 kHz)
+LEVEL_FACTOR = 4  # Each coarser level merges this many peaks of the one below
+NUM_LEVELS = 3  # 512, 2048 and 8192 samples per peak
+MAGIC = b'ECPK'
+VERSION = 1
+# magic, version, level count, sample rate, clip length in samples
+HEADER = struct.Struct('<4sBBxxII')
+# samples per peak, peak count
+LEVEL_HEADER = struct.Struct('<II')
+
+
+def compute_peaks(samples, peak_samples=PEAK_SAMPLES, level_factor=LEVEL_FACTOR, num_levels=NUM_LEVELS):
+    """
+    Computes min/max waveform peaks of a clip at several resolutions.
+
+    Each level holds one (min, max) pair per bucket of samples, scaled to
+    int8 (the top 8 bits of the int16 samples), which is all a waveform a
+    few hundred pixels wide needs. Coarser levels are built from the finer
+    ones, so the samples are only scanned once.
+
+    Parameters:
+    - samples: 1-D int16 numpy array.
+    - peak_samples: Samples per peak at the finest level.
+    - level_factor: Peaks of one level merged into each peak of the next.
+    - num_levels: Number of levels.
+
+    Returns:
+    - A list of (samples_per_peak, int8 array of shape (count, 2)), finest first.
+    """
+    if len(samples) == 0:
+        return [(peak_samples * level_factor ** i, np.zeros((0, 2), dtype=np.int8)) for i in range(num_levels)]
+    starts = np.arange(0, len(samples), peak_samples)
+    mins = np.minimum.reduceat(samples, starts)
+    maxs = np.maximum.reduceat(samples, starts)
+    levels = [(peak_samples, np.stack([mins >> 8, maxs >> 8], axis=1).astype(np.int8))]
+    for i in range(1, num_levels):
+        starts = np.arange(0, len(mins), level_factor)
+        mins = np.minimum.reduceat(mins, starts)
+        maxs = np.maximum.reduceat(maxs, starts)
+        levels.append((peak_samples * level_factor ** i, np.stack([mins >> 8, maxs >> 8], axis=1).astype(np.int8)))
+    return levels
+
+
+def encode_peaks(levels, sample_rate, num_samples):
+    """
+    Packs peak levels into the compact binary format served at /peaks.
+
+    Layout (little-endian): a header of 'ECPK', version (u8), level count
+    (u8), 2 padding bytes, sample rate (u32) and clip length in samples
+    (u32); then one (samples per peak u32, peak count u32) pair per level;
+    then each level's interleaved int8 min/max values, finest level first.
+    """
+    parts = [HEADER.pack(MAGIC, VERSION, len(levels), sample_rate, num_samples)]
+    parts += [LEVEL_HEADER.pack(samples_per_peak, len(peaks)) for samples_per_peak, peaks in levels]
+    parts += [peaks.tobytes() for _, peaks in levels]
+    return b''.join(parts)
+
+
+def write_peaks(path, samples, sample_rate):
+    # Compute and store a clip's peaks; written to a temporary file of its own and moved into place like the WAVs,
+    # so two requests computing the same missing peaks don't trip over each other
+    data = encode_peaks(compute_peaks(samples), sample_rate, len(samples))
+    temp_path = temp_path_for(path)
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def write_peaks_for_wav(wav_path, path):
+    # Peaks of an existing 16-bit WAV (or compacted) file; multi-channel files are mixed down first
+    samples, sample_rate, channels = read_audio(wav_path)
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+    write_peaks(path, samples, sample_rate)
@@ -0,0 +1,256 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+
+class FairQueue:
+    """
+    Bounded job queue with a separate FIFO per key, served round-robin.
+
+    With one key (the default) this is a plain bounded FIFO. Stages fed by
+    several capture sources key jobs by source: every source gets its own
+    bound, and workers take the next job from each source with work in turn.
+    A source with a backlog then only delays and drops its own jobs, and
+    can't starve the others or push their jobs out.
+
+    Parameters:
+    - maxsize: Maximum number of jobs waiting per key.
+    - key: Optional function mapping a job to its key.
+    """
+
+    def __init__(self, maxsize, key=None):
+        self.maxsize = max(1, int(maxsize))
+        self.key = key
+        self.queues = OrderedDict()  # key -> deque of jobs, in round-robin order
+        self.size = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def put(self, job, drop_oldest=False):
+        """
+        Adds a job, waiting for room unless `drop_oldest` is set.
+
+        Returns:
+        - The jobs with the same key that were dropped to make room (oldest first).
+        """
+        key = self.key(job) if self.key is not None else None
+        dropped = []
+        with self.condition:
+            jobs = self.queues.get(key)
+            if jobs is None:
+                jobs = self.queues[key] = deque()
+            while len(jobs) >= self.maxsize:
+                if drop_oldest:
+                    dropped.append(jobs.popleft())
+                    self.size -= 1
+                else:
+                    self.condition.wait()
+            jobs.append(job)
+            self.size += 1
+            self.condition.notify_all()
+        return dropped
+
+    def get(self):
+        """
+        Takes the next job, round-robin over keys.
+
+        Returns:
+        - The job, or None once the queue is closed and empty.
+        """
+        with self.condition:
+            while self.size == 0:
+                if self.closed:
+                    return None
+                self.condition.wait()
+            for key, jobs in self.queues.items():
+                if jobs:
+                    break
+            job = jobs.popleft()
+            self.size -= 1
+            if jobs:
+                self.queues.move_to_end(key)  # This key had its turn
+            else:
+                del self.queues[key]
+            self.condition.notify_all()
+            return job
+
+    def open(self):
+        with self.condition:
+            self.closed = False
+
+    def close(self):
+        # Let workers finish what is queued, then make get() return None
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def qsize(self):
+        with self.condition:
+            return self.size
+
+
+class Stage:
+    """
+    One step of the clip processing pipeline.
+
+    Each stage owns a bounded input queue and a pool of worker threads that
+    call `func(job)`. Whatever `func` returns is handed to the next stage;
+    returning None ends the job there (e.g. a clip that trimmed to nothing).
+
+    Parameters:
+    - name: Stage name used in the stats output and as the stage label of
+      its echo_stage_seconds latency histogram.
+    - func: Callable taking a job and returning the job for the next stage (or None).
+    - workers: Number of worker threads for this stage.
+    - maxsize: Maximum number of jobs waiting in the input queue.
+    - policy: Backpressure policy when the queue is full:
+        'block'       - the producer waits until there is room.
+        'drop_oldest' - the oldest waiting job is discarded to make room.
+    - key: Optional function giving a job's fairness key (e.g. its capture
+      source); see FairQueue. Queue bounds and drops then apply per key.
+    - on_drop: Optional callback taking a job discarded by 'drop_oldest',
+      e.g. to delete files the job owns.
+    """
+
+    POLICIES = ('block', 'drop_oldest')
+
+    def __init__(self, name, func, workers=1, maxsize=8, policy='block', key=None, on_drop=None):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown backpressure policy '{policy}'")
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.policy = policy
+        self.queue = FairQueue(maxsize, key=key)
+        self.on_drop = on_drop
+        self.next_stage = None
+        self.threads = []
+        self.stats_lock = threading.Lock()
+        self.enqueued = 0
+        self.dropped = 0
+        self.in_flight = 0
+        self.processed = 0
+        self.errors = 0
+
+    def put(self, job, wait=False):
+        # With `wait`, wait for room even under 'drop_oldest' (for producers that may be slowed down)
+        dropped = self.queue.put(job, drop_oldest=self.policy == 'drop_oldest' and not wait)
+        with self.stats_lock:
+            self.enqueued += 1
+            self.dropped += len(dropped)
+        for dropped_job in dropped:
+            logger.warning("[%s] Queue full, dropped oldest job.", self.name)
+            if self.on_drop is not None:
+                try:
+                    self.on_drop(dropped_job)
+                except Exception as e:
+                    logger.exception("[%s] Error cleaning up a dropped job: %s", self.name, e)
+
+    def start(self):
+        self.queue.open()  # In case the stage was stopped before
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.worker_loop, name=f"{self.name}-{i}")
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.queue.close()  # Workers drain what is queued, then exit
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def worker_loop(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            with self.stats_lock:
+                self.in_flight += 1
+            start = time.perf_counter()
+            try:
+                result = self.func(job)
+            except Exception as e:
+                logger.exception("[%s] Error processing job: %s", self.name, e)
+                result = None
+                with self.stats_lock:
+                    self.errors += 1
+            finally:
+                observe_stage(self.name, time.perf_counter() - start)
+                with self.stats_lock:
+                    self.in_flight -= 1
+                    self.processed += 1
+            if result is not None and self.next_stage is not None:
+                self.next_stage.put(result)
+
+    def get_stats(self):
+        with self.stats_lock:
+            return {
+                'name': self.name,
+                'workers': self.workers,
+                'policy': self.policy,
+                'queued': self.queue.qsize(),
+                'enqueued': self.enqueued,
+                'dropped': self.dropped,
+                'in_flight': self.in_flight,
+                'processed': self.processed,
+                'errors': self.errors,
+            }
+
+
+class Pipeline:
+    """
+    A chain of Stages connected by bounded queues.
+
+    Jobs submitted with `submit` enter the first stage and flow through the
+    rest in the order the stages were added.
+
+    Parameters:
+    - key: Optional fairness key function applied to every stage (see FairQueue).
+    """
+
+    def __init__(self, key=None):
+        self.stages = []
+        self.key = key
+        self.running = False
+
+    def add_stage(self, name, func, workers=1, maxsize=8, policy='block', on_drop=None):
+        stage = Stage(name, func, workers=workers, maxsize=maxsize, policy=policy, key=self.key, on_drop=on_drop)
+        if self.stages:
+            self.stages[-1].next_stage = stage
+        self.stages.append(stage)
+        return stage
+
+    def start(self):
+        if self.running:
+            return
+        for stage in self.stages:
+            stage.start()
+        self.running = True
+
+    def stop(self):
+        if not self.running:
+            return
+        # Stop front to back so each stage drains into the next before it goes away
+        for stage in self.stages:
+            stage.stop()
+        self.running = False
+
+    def submit(self, job):
+        if not self.stages:
+            raise RuntimeError("Pipeline has no stages.")
+        self.stages[0].put(job)
+
+    def get_stats(self):
+        stages = [stage.get_stats() for stage in self.stages]
+        return {
+            'queued': sum(s['queued'] for s in stages),
+            'dropped': sum(s['dropped'] for s in stages),
+            'in_flight': sum(s['in_flight'] for s in stages),
+            'stages': stages,
+        }
@@ -0,0 +1,345 @@
+import itertools
+import logging
+import threading
+import time
+import wave
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from encoding import read_audio
+from metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+
+class PCMCache:
+    """
+    LRU cache of decoded float32 clips, bounded by memory rather than entry count.
+
+    Parameters:
+    - max_bytes: Total size of cached sample arrays before the least recently
+      used ones are evicted.
+    """
+
+    def __init__(self, max_bytes=128 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # path -> float32 array of shape (frames, channels)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        with self.lock:
+            samples = self.entries.get(path)
+            if samples is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return samples
+
+    def put(self, path, samples):
+        with self.lock:
+            previous = self.entries.pop(path, None)
+            if previous is not None:
+                self.size -= previous.nbytes
+            if samples.nbytes > self.max_bytes:
+                return  # Too big to ever fit; play it uncached
+            self.entries[path] = samples
+            self.size += samples.nbytes
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.nbytes
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+class NullSink:
+    """
+    Output device stand-in that discards audio, for running without a sound card.
+
+    It consumes blocks at the real-time rate, like a device would, so the
+    mixer behaves the same as with real output.
+    """
+
+    name = 'null'
+
+    def player(self, samplerate, channels, blocksize=None, exclusive_mode=False):
+        return NullPlayer(samplerate)
+
+
+class NullPlayer:
+    def __init__(self, samplerate):
+        self.samplerate = samplerate
+        self.next_time = None
+
+    def __enter__(self):
+        self.next_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def write(self, data):
+        pass
+
+    def play(self, data):
+        self.write(data)
+        # Block like a device would once its buffer is full
+        self.next_time = max(self.next_time, time.perf_counter() - 0.1) + len(data) / self.samplerate
+        wait = self.next_time - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+
+
+class WavFileSink(NullSink):
+    """
+    Output device stand-in that records everything played into a WAV file.
+
+    Parameters:
+    - path: WAV file to write (replaced each time the stream is opened).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = f"file:{path}"
+
+    def player(self, samplerate, channels, blocksize=None, exclusive_mode=False):
+        return WavFilePlayer(self.path, samplerate, channels)
+
+
+class WavFilePlayer(NullPlayer):
+    def __init__(self, path, samplerate, channels):
+        super().__init__(samplerate)
+        self.path = path
+        self.channels = channels
+        self.wav_file = None
+
+    def __enter__(self):
+        self.wav_file = wave.open(self.path, 'wb')
+        self.wav_file.setnchannels(self.channels)
+        self.wav_file.setsampwidth(2)
+        self.wav_file.setframerate(self.samplerate)
+        return super().__enter__()
+
+    def __exit__(self, *exc_info):
+        self.wav_file.close()
+        return False
+
+    def write(self, data):
+        self.wav_file.writeframes((np.clip(data, -1, 1) * 32767).astype(np.int16).tobytes())
+
+
+def sink_from_spec(spec):
+    """
+    Builds a playback sink from a short description.
+
+    Parameters:
+    - spec: 'device' for the real output device (returns None), 'null', or 'file:<path>'.
+    """
+    kind, _, argument = spec.partition(':')
+    if kind == 'device':
+        return None
+    if kind == 'null':
+        return NullSink()
+    if kind == 'file':
+        return WavFileSink(argument)
+    raise ValueError(f"Unknown playback sink '{spec}'")
+
+
+class PlaybackEngine:
+    """
+    Long-lived playback service for the virtual microphone.
+
+    The output device is resolved once and its player stream stays open on a
+    single mixer thread. Clips are decoded once into float32 at the stream
+    rate and kept in a PCMCache. Every block, the mixer sums all active clips
+    ("voices"), so overlapping plays mix instead of fighting over the device.
+    A click is picked up at the next block boundary, so the time to first
+    sample is one block (10 ms by default) plus the device buffer.
+
+    Parameters:
+    - device_name: Substring of the output device name, matched case-insensitively.
+    - sample_rate: Stream sample rate; clips at other rates are resampled on decode.
+    - channels: Stream channel count.
+    - block_duration: Mixer block length in ms.
+    - cache_bytes: Memory bound of the decoded clip cache.
+    - sink: Optional NullSink/WavFileSink used instead of a sound card device.
+    """
+
+    MODES = ('mix', 'queue', 'interrupt')
+
+    def __init__(self, device_name, sample_rate=48000, channels=1, block_duration=10,
+                 cache_bytes=128 * 1024 * 1024, sink=None):
+        self.device_name = device_name
+        self.sink = sink
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.block_size = int(sample_rate * block_duration / 1000)
+        self.cache = PCMCache(cache_bytes)
+        self.voices = []  # Clips currently being mixed: {'id', 'path', 'samples', 'position'}
+        self.queue = deque()  # Clips waiting for the voices to finish
+        self.ids = itertools.count(1)
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.speaker = None
+
+    def find_speaker(self):
+        if self.sink is not None:
+            return self.sink
+        import soundcard as sc  # Only needed for real devices
+        for speaker in sc.all_speakers():
+            if self.device_name.lower() in speaker.name.lower():
+                return speaker
+        return None
+
+    def start(self):
+        """
+        Resolves the output device and starts the mixer thread.
+
+        Returns:
+        - True if the engine is running, False if the device was not found.
+        """
+        with self.condition:
+            if self.running:
+                return True
+            self.speaker = self.find_speaker()
+            if self.speaker is None:
+                logger.error("Virtual microphone not found.")
+                return False
+            self.running = True
+        self.thread = threading.Thread(target=self.mix_loop, name='playback')
+        self.thread.daemon = True
+        self.thread.start()
+        return True
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def load(self, path):
+        # Decoded float32 samples for a WAV clip, from the cache if possible
+        samples = self.cache.get(path)
+        if samples is None:
+            samples = self.decode(path)
+            self.cache.put(path, samples)
+        return samples
+
+    def preload(self, paths):
+        # Decode clips ahead of time (e.g. favorites) so their first play is instant
+        for path in paths:
+            try:
+                self.load(path)
+            except Exception as e:
+                logger.warning("Could not preload %s: %s", path, e)
+
+    def decode(self, path):
+        data, rate, channels = read_audio(path)  # WAV, or FLAC once retention has compacted the clip
+        samples = data.reshape(-1, channels).astype(np.float32) / (1 << 15)
+        # Match the stream's channel count
+        if channels != self.channels:
+            samples = np.repeat(samples.mean(axis=1, keepdims=True), self.channels, axis=1)
+        # Match the stream's sample rate
+        if rate != self.sample_rate and len(samples):
+            length = int(round(len(samples) * self.sample_rate / rate))
+            positions = np.linspace(0, len(samples) - 1, length)
+            samples = np.stack([
+                np.interp(positions, np.arange(len(samples)), samples[:, c])
+                for c in range(self.channels)
+            ], axis=1).astype(np.float32)
+        return np.ascontiguousarray(samples)
+
+    def play(self, path, mode='mix'):
+        """
+        Schedules a clip on the virtual microphone.
+
+        Parameters:
+        - path: WAV file to play.
+        - mode: 'mix' plays it on top of whatever is playing, 'queue' plays it
+          after everything currently playing or queued, and 'interrupt' stops
+          what is playing and starts it right away.
+
+        Returns:
+        - An id for the scheduled clip, or None if the output device is unavailable.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown playback mode '{mode}'")
+        if not self.start():
+            return None
+        requested = time.perf_counter()
+        voice = {'id': next(self.ids), 'path': path, 'samples': self.load(path), 'position': 0,
+                 'requested': requested}
+        with self.condition:
+            if mode == 'interrupt':
+                self.voices = [voice]
+            elif mode == 'queue' and (self.voices or self.queue):
+                voice['requested'] = None  # Waiting its turn on purpose; not counted as start latency
+                self.queue.append(voice)
+            else:
+                self.voices.append(voice)
+            self.condition.notify_all()
+        return voice['id']
+
+    def stop_all(self):
+        with self.condition:
+            self.voices = []
+            self.queue.clear()
+
+    def mix_block(self, out):
+        # Sum one block of every active voice into `out`; called with the condition held
+        out.fill(0)
+        if not self.voices and self.queue:
+            self.voices.append(self.queue.popleft())
+        for voice in self.voices:
+            if voice['position'] == 0 and voice['requested'] is not None:
+                # Time from the play request to its first block, including decoding a clip that wasn't cached
+                observe_stage('playback_start', time.perf_counter() - voice['requested'])
+                voice['requested'] = None
+            chunk = voice['samples'][voice['position']:voice['position'] + self.block_size]
+            out[:len(chunk)] += chunk
+            voice['position'] += len(chunk)
+        finished = [v for v in self.voices if v['position'] >= len(v['samples'])]
+        if finished:
+            self.voices = [v for v in self.voices if v['position'] < len(v['samples'])]
+            for voice in finished:
+                logger.info("Played %s over virtual microphone.", voice['path'])
+        np.clip(out, -1.0, 1.0, out=out)
+
+    def mix_loop(self):
+        out = np.zeros((self.block_size, self.channels), dtype=np.float32)
+        with self.speaker.player(samplerate=self.sample_rate, channels=self.channels,
+                                 blocksize=self.block_size, exclusive_mode=False) as player:
+            while True:
+                with self.condition:
+                    if not self.running:
+                        break
+                    if not self.voices and not self.queue:
+                        # Nothing to play: sleep until a clip arrives, keeping the stream fed with silence
+                        self.condition.wait(timeout=self.block_size / self.sample_rate)
+                    self.mix_block(out)
+                player.play(out)
+
+    def get_status(self):
+        with self.condition:
+            return {
+                'running': self.running,
+                'device': self.speaker.name if self.speaker is not None else None,
+                'playing': [{'id': v['id'], 'path': v['path']} for v in self.voices],
+                'queued': [{'id': v['id'], 'path': v['path']} for v in self.queue],
+                'cache': self.cache.get_stats(),
+            }
@@ -0,0 +1,326 @@
+import glob
+import logging
+import os
+import sys
+import threading
+import time
+
+from encoding import SOURCE_EXTENSIONS, RenditionCache, compact_wav
+
+logger = logging.getLogger(__name__)
+
+# Files retention may delete when it prunes a session folder nothing references any more
+SESSION_FILE_EXTENSIONS = SOURCE_EXTENSIONS + tuple(RenditionCache.FORMATS) + ('peaks', 'part')
+
+
+class RetentionManager:
+    """
+    Background retention for recordings: disk quota, age limit, per-session limit and compaction.
+
+    Each pass, in order:
+    - evicts recordings not used (played, or else captured) for `max_age` seconds
+    - evicts the least recently used recordings of sessions holding more than `max_clips_per_session`
+    - evicts the least recently used recordings until the clip audio fits in `max_bytes`
+    - compacts WAVs whose clips haven't been used for `compact_after` seconds to lossless FLAC,
+      and deletes their MP3/Opus renditions (they are re-encoded from the FLAC if requested again)
+    - deletes old session folders with no recordings left in the store
+
+    Least recently used means oldest last play (or capture, if never
+    played), then fewest plays. Favorites, favorited recordings and the
+    current session are never evicted. A clip's audio file is only deleted
+    once no other clip references it.
+
+    Work is done in batches of `batch_size` clips or files. After every
+    batch the thread sleeps for `pause` seconds, and it waits for as long
+    as `is_busy()` returns True (e.g. while a source is in an utterance),
+    so it never competes with capture. On Linux the thread also runs at
+    the lowest CPU priority.
+
+    Parameters:
+    - store: ClipStore.
+    - blobs: BlobStore the clips' audio lives in.
+    - max_bytes: Disk budget for clip audio, in bytes (None for no limit).
+    - max_age: Seconds after its last use that a recording is evicted (None for no limit).
+    - max_clips_per_session: Recordings kept per session (None for no limit).
+    - compact_after: Seconds after its last use that a clip's WAV is compacted (None to never compact).
+    - protect_session: Session whose recordings are never evicted (the current one).
+    - session_pattern: Glob of the old session folders holding clips from before the blob store.
+    - favorites_folder: Folder of favorites from before the blob store (counted towards max_bytes, never evicted).
+    - on_remove: Called with the clip dict after a clip has been evicted.
+    - on_compact: Called with (ids of the clips moved, new path) after a WAV has been compacted.
+    - is_busy: Returns True while retention should wait.
+    - batch_size: Clips or files handled per batch.
+    - pause: Seconds slept after each batch.
+    - interval: Seconds between passes.
+    - initial_delay: Seconds before the first pass, so startup isn't slowed down.
+    """
+
+    def __init__(self, store, blobs, max_bytes=None, max_age=None, max_clips_per_session=None,
+                 compact_after=None, protect_session=None, session_pattern='session_*',
+                 favorites_folder='favorites', on_remove=None, on_compact=None, is_busy=None, batch_size=20,
+                 pause=0.2, interval=600, initial_delay=60):
+        self.store = store
+        self.blobs = blobs
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_clips_per_session = max_clips_per_session
+        self.compact_after = compact_after
+        self.protect_session = protect_session
+        self.session_pattern = session_pattern
+        self.favorites_folder = favorites_folder
+        self.on_remove = on_remove
+        self.on_compact = on_compact
+        self.is_busy = is_busy
+        self.batch_size = max(1, int(batch_size))
+        self.pause = pause
+        self.interval = interval
+        self.initial_delay = initial_delay
+        self.stopping = threading.Event()
+        self.thread = None
+        self.failed_compactions = set()  # WAVs that failed to compact; not retried until restart
+        self.lock = threading.Lock()
+        self.stats = {'passes': 0, 'evicted': 0, 'compacted': 0, 'sessions_pruned': 0, 'bytes_freed': 0,
+                      'disk_bytes': None}
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name='retention', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        if sys.platform.startswith('linux'):
+            # Per-thread nice value on Linux; elsewhere this would lower the whole process
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+            except OSError:
+                pass
+        delay = self.initial_delay
+        while not self.stopping.wait(delay):
+            try:
+                self.run_pass()
+            except Exception as e:
+                logger.exception("Retention pass failed: %s", e)
+            delay = self.interval
+
+    def yield_batch(self):
+        """
+        Gives way to capture after a batch of work.
+
+        Returns:
+        - False if retention is stopping and the pass should end.
+        """
+        if self.stopping.wait(self.pause):
+            return False
+        while self.is_busy is not None and self.is_busy():
+            if self.stopping.wait(self.pause):
+                return False
+        return True
+
+    def run_pass(self):
+        # One full pass over every policy; each step stops early if retention is stopping
+        now = int(time.time())
+        if self.max_age is not None:
+            self.evict_expired(now - self.max_age)
+        if self.max_clips_per_session is not None:
+            self.evict_crowded_sessions()
+        if self.max_bytes is not None:
+            self.enforce_quota()
+        if self.compact_after is not None:
+            self.compact_old(now - self.compact_after)
+        self.prune_sessions()
+        with self.lock:
+            self.stats['passes'] += 1
+
+    def evict_expired(self, used_before):
+        while not self.stopping.is_set():
+            clips = self.store.get_least_recently_used(self.batch_size, used_before=used_before,
+                                                       exclude_session=self.protect_session)
+            if not clips:
+                return
+            for clip in clips:
+                self.evict(clip)
+            logger.info("Retention: evicted %d recordings unused for too long", len(clips))
+            if not self.yield_batch():
+                return
+
+    def evict_crowded_sessions(self):
+        for session, count in self.store.get_crowded_sessions(self.max_clips_per_session):
+            if session == self.protect_session:
+                continue
+            excess = count - self.max_clips_per_session
+            while excess > 0 and not self.stopping.is_set():
+                clips = self.store.get_least_recently_used(min(excess, self.batch_size), session=session)
+                if not clips:
+                    break  # The rest are favorited
+                for clip in clips:
+                    self.evict(clip)
+                excess -= len(clips)
+                logger.info("Retention: evicted %d recordings from %s", len(clips), session)
+                if not self.yield_batch():
+                    return
+
+    def enforce_quota(self):
+        usage = self.measure_usage()
+        if usage is None:
+            return
+        while usage > self.max_bytes and not self.stopping.is_set():
+            clips = self.store.get_least_recently_used(self.batch_size, exclude_session=self.protect_session)
+            if not clips:
+                logger.warning("Retention: clip audio uses %d bytes, over the %d byte quota, but nothing more can "
+                               "be evicted", usage, self.max_bytes)
+                break
+            for clip in clips:
+                usage -= self.evict(clip)
+                if usage <= self.max_bytes:
+                    break
+            with self.lock:
+                self.stats['disk_bytes'] = usage
+            if not self.yield_batch():
+                return
+
+    def measure_usage(self):
+        """
+        Adds up the size of the blob store and the old session and favorites folders, a batch of folders at a time.
+
+        Returns:
+        - The total in bytes, or None if retention is stopping.
+        """
+        folders = [self.favorites_folder] + sorted(glob.glob(self.session_pattern))
+        folders += [os.path.join(self.blobs.root, name) for name in sorted(os.listdir(self.blobs.root))]
+        total = 0
+        for i, folder in enumerate(folders):
+            if not os.path.isdir(folder):
+                continue
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        total += entry.stat().st_size
+            if (i + 1) % self.batch_size == 0 and not self.yield_batch():
+                return None
+        with self.lock:
+            self.stats['disk_bytes'] = total
+        return total
+
+    def evict(self, clip):
+        """
+        Removes one recording, and its audio once no other clip references it.
+
+        Returns:
+        - The number of bytes freed on disk.
+        """
+        if not self.store.remove(clip['id']):
+            return 0
+        if self.on_remove is not None:
+            self.on_remove(clip)
+        freed = 0
+        if clip.get('audio_hash'):
+            # Atomic with BlobStore.put, so a clip being published with the same audio keeps its blob
+            freed = self.blobs.remove_unreferenced(clip['audio_hash'], self.store.count_references) or 0
+        elif self.store.count_path_references(clip['wav_filename']) == 0:
+            # A clip from before the blob store: its WAV (or FLAC) sits in the session folder with its renditions
+            base = os.path.splitext(clip['wav_filename'])[0]
+            paths = [f"{base}.{extension}" for extension in SESSION_FILE_EXTENSIONS]
+            freed = self.sizes_of(paths)
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+        with self.lock:
+            self.stats['evicted'] += 1
+            self.stats['bytes_freed'] += freed
+        return freed
+
+    def compact_old(self, used_before):
+        while not self.stopping.is_set():
+            paths = self.store.get_uncompacted(used_before, self.batch_size, exclude=self.failed_compactions)
+            if not paths:
+                return
+            if not any([self.compact(path) for path in paths]):
+                # Most likely no encoder is installed; don't try again with every batch of every pass
+                logger.warning("Retention: no clip could be compacted, compaction is off until restart")
+                self.compact_after = None
+                return
+            if not self.yield_batch():
+                return
+
+    def compact(self, wav_path):
+        # Replace a WAV by its FLAC copy, then drop the renditions made from it; returns True on success
+        base = os.path.splitext(wav_path)[0]
+        renditions = [f"{base}.{extension}" for extension in RenditionCache.FORMATS]
+        size_before = self.sizes_of([wav_path] + renditions)
+        try:
+            compact_path = compact_wav(wav_path)
+        except Exception as e:
+            logger.warning("Retention: could not compact %s: %s", wav_path, e)
+            self.failed_compactions.add(wav_path)
+            return False
+        name = os.path.basename(wav_path)
+        audio_hash = os.path.splitext(name)[0] if self.blobs.is_blob_name(name) else None
+        # Under the lock BlobStore.put pins blobs with: identical audio being stored right now gets this WAV,
+        # so it is only deleted if nothing is about to use it or was stored with it meanwhile
+        with self.blobs.lock:
+            clip_ids = self.store.replace_wav_filename(wav_path, compact_path)
+            in_use = (audio_hash is not None and self.blobs.pins.get(audio_hash)) or \
+                self.store.count_path_references(wav_path)
+            if not in_use:
+                for path in [wav_path] + renditions:
+                    if os.path.exists(path):
+                        os.remove(path)
+        if self.on_compact is not None:
+            self.on_compact(clip_ids, compact_path)
+        freed = size_before - self.sizes_of([wav_path, compact_path] + renditions)
+        logger.info("Retention: compacted %s (%d bytes freed)", wav_path, freed)
+        with self.lock:
+            self.stats['compacted'] += 1
+            self.stats['bytes_freed'] += freed
+        return True
+
+    def prune_sessions(self):
+        # Delete old session folders whose recordings have all been evicted
+        for folder in sorted(glob.glob(self.session_pattern)):
+            if self.stopping.is_set():
+                return
+            if folder == self.protect_session or not os.path.isdir(folder) or self.store.count_session(folder):
+                continue
+            for name in self.list_folder(folder):
+                path = os.path.join(folder, name)
+                if name != 'recordings.json' and name.rsplit('.', 1)[-1] not in SESSION_FILE_EXTENSIONS:
+                    continue
+                if name.rsplit('.', 1)[-1] in SOURCE_EXTENSIONS and self.store.count_path_references(path):
+                    continue  # Still the audio of a clip stored elsewhere (e.g. an old favorite)
+                os.remove(path)
+            try:
+                os.rmdir(folder)
+            except OSError:
+                logger.info("Retention: left %s in place, it holds other files", folder)
+                continue
+            logger.info("Retention: removed empty session %s", folder)
+            with self.lock:
+                self.stats['sessions_pruned'] += 1
+            if not self.yield_batch():
+                return
+
+    @staticmethod
+    def list_folder(folder):
+        return os.listdir(folder) if os.path.isdir(folder) else []
+
+    @staticmethod
+    def sizes_of(paths):
+        total = 0
+        for path in paths:
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, failed_compactions=len(self.failed_compactions))
@@ -0,0 +1,199 @@
+import bisect
+import heapq
+import re
+import threading
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+# How much a match in each field counts towards the score
+FIELD_WEIGHTS = {'name': 2.0, 'text': 1.0}
+PREFIX_FACTOR = 0.5  # A prefix match ("mi" -> "mic") counts half as much as an exact one
+MIN_PREFIX_LENGTH = 2  # Shorter last terms only match exactly, so "a" doesn't expand to half the vocabulary
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall((text or '').lower())
+
+
+class SearchIndex:
+    """
+    Incremental inverted index over clip names and transcriptions.
+
+    Each token maps to the set of clips containing it, per field. A sorted
+    vocabulary lets the last query term match as a prefix, so results update
+    as you type. Adding or updating a clip only touches that clip's own
+    tokens. Queries are answered with set unions and intersections over the
+    postings of their own terms, and only the clips matching every term are
+    scored one by one, so they stay fast as the library grows.
+
+    Clips are keyed by id alone, which is unique across recordings and
+    favorites because both live in the same table of the clip store.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = {field: {} for field in FIELD_WEIGHTS}  # field -> token -> set of clip ids
+        self.doc_tokens = {}  # clip id -> {token: best field weight}
+        self.doc_lists = {}  # clip id -> list_type
+        self.list_members = {}  # list_type -> set of clip ids
+        self.vocabulary = []  # Sorted list of tokens with at least one posting
+
+    def add(self, list_type, clip):
+        """
+        Indexes a clip, replacing whatever was indexed for it before.
+
+        Parameters:
+        - list_type: 'recordings' or 'favorites'.
+        - clip: Clip dict with 'id', 'name' and 'text'.
+        """
+        key = clip['id']
+        fields = {field: set(tokenize(clip.get(field))) for field in FIELD_WEIGHTS}
+        tokens = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in fields[field]:
+                tokens[token] = max(tokens.get(token, 0), weight)
+        with self.lock:
+            self.remove_locked(key)
+            for field, field_tokens in fields.items():
+                postings = self.postings[field]
+                for token in field_tokens:
+                    posting = postings.get(token)
+                    if posting is None:
+                        posting = postings[token] = set()
+                    posting.add(key)
+            for token in tokens:
+                if not self.in_vocabulary(token):
+                    bisect.insort(self.vocabulary, token)
+            self.doc_tokens[key] = tokens
+            self.doc_lists[key] = list_type
+            self.list_members.setdefault(list_type, set()).add(key)
+
+    def remove(self, clip_id):
+        with self.lock:
+            self.remove_locked(clip_id)
+
+    def remove_locked(self, key):
+        list_type = self.doc_lists.pop(key, None)
+        if list_type is None:
+            return
+        self.list_members[list_type].discard(key)
+        for token in self.doc_tokens.pop(key):
+            for postings in self.postings.values():
+                posting = postings.get(token)
+                if posting is not None:
+                    posting.discard(key)
+                    if not posting:
+                        del postings[token]
+            if not any(token in postings for postings in self.postings.values()):
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, token)]
+
+    def in_vocabulary(self, token):
+        i = bisect.bisect_left(self.vocabulary, token)
+        return i < len(self.vocabulary) and self.vocabulary[i] == token
+
+    def expand(self, term, prefix):
+        # Tokens matching a query term: the exact token and, for a prefix term, every longer token it starts
+        exact = [term] if self.in_vocabulary(term) else []
+        longer = []
+        if prefix and len(term) >= MIN_PREFIX_LENGTH:
+            start = bisect.bisect_right(self.vocabulary, term)
+            end = bisect.bisect_left(self.vocabulary, term + '\uffff')
+            longer = self.vocabulary[start:end]
+        return exact, longer
+
+    def union(self, field, tokens):
+        postings = self.postings[field]
+        result = set()
+        for token in tokens:
+            result.update(postings.get(token, ()))
+        return result
+
+    def term_tiers(self, exact, longer, list_type):
+        """
+        Groups the clips matching one query term by score.
+
+        Each (field, exact or prefix) combination is a plain set union, and a
+        clip only stays in its best tier, so the work is done by set
+        operations rather than a Python loop over every match.
+
+        Returns:
+        - A list of (score, set of clip ids), best score first, with no clip in two tiers.
+        """
+        candidates = []
+        for field, weight in FIELD_WEIGHTS.items():
+            candidates.append((weight, self.union(field, exact)))
+            candidates.append((weight * PREFIX_FACTOR, self.union(field, longer)))
+        candidates.sort(key=lambda tier: tier[0], reverse=True)
+        members = self.list_members.get(list_type, set()) if list_type is not None else None
+        tiers = []
+        seen = set()
+        for score, keys in candidates:
+            keys -= seen
+            if members is not None:
+                keys &= members
+            if keys:
+                seen |= keys
+                if tiers and tiers[-1][0] == score:
+                    tiers[-1][1].update(keys)
+                else:
+                    tiers.append((score, keys))
+        return tiers
+
+    @staticmethod
+    def page_tiers(tiers, limit, offset):
+        # Newest first within each tier; only the tiers the page reaches are looked at
+        page = []
+        wanted = offset + limit
+        for score, keys in tiers:
+            page += [(score, key) for key in heapq.nlargest(wanted - len(page), keys)]
+            if len(page) >= wanted:
+                break
+        return page[offset:]
+
+    def search(self, query, list_type=None, limit=20, offset=0):
+        """
+        Finds clips containing every term of `query`.
+
+        The last term also matches as a prefix. Results are ranked by how
+        many terms matched in the name (weighted higher) or the text, exact
+        matches above prefix matches, then newest first.
+
+        Parameters:
+        - query: Free text, e.g. "anyone got a mi".
+        - list_type: Restrict to 'recordings' or 'favorites' (None for both).
+        - limit: Page size.
+        - offset: Number of results to skip.
+
+        Returns:
+        - (total, [(list_type, clip_id, score), ...]) for the requested page.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return 0, []
+        with self.lock:
+            per_term = []
+            for i, term in enumerate(terms):
+                exact, longer = self.expand(term, prefix=i == len(terms) - 1)
+                tiers = self.term_tiers(exact, longer, list_type)
+                if not tiers:
+                    return 0, []
+                per_term.append(tiers)
+            if len(per_term) == 1:
+                tiers = per_term[0]
+                page = self.page_tiers(tiers, limit, offset)
+                return sum(len(keys) for _, keys in tiers), [(self.doc_lists[key], key, score) for score, key in page]
+            # Clips matching every term, smallest match set first so the intersection shrinks fast
+            matches = sorted((set().union(*(keys for _, keys in tiers)) for tiers in per_term), key=len)
+            candidates = matches[0].intersection(*matches[1:])
+            totals = dict.fromkeys(candidates, 0.0)
+            for tiers in per_term:
+                for score, keys in tiers:
+                    for key in candidates & keys:
+                        totals[key] += score
+            # Best score first, then newest (highest id) first
+            page = heapq.nlargest(offset + limit, zip(totals.values(), totals.keys()))[offset:]
+            return len(totals), [(self.doc_lists[key], key, score) for score, key in page]
+
+    def get_stats(self):
+        with self.lock:
+            return {'documents': len(self.doc_tokens), 'tokens': len(self.vocabulary)}
@@ -0,0 +1,211 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+
+
+class Segmenter:
+    """
+    Streaming segmenter: cuts one source's stream of VAD-classified frames into utterances.
+
+    Memory per source stays bounded however long the audio runs:
+    - While idle, only the last `pre_roll` seconds are kept, in a fixed
+      ring. An utterance starts once `onset_frames` of the last
+      `onset_window` frames are speech (so a single stray VAD decision
+      doesn't start one), and it begins with the pre-roll, so word onsets
+      aren't clipped.
+    - Every frame of an utterance is kept, pauses included, until speech
+      has been followed by more than `max_silence` seconds of non-speech
+      (the hangover). The clip then ends `post_roll` seconds after its last
+      speech frame.
+    - An utterance that reaches `max_length` seconds is split at the
+      quietest frame in its last `split_window` seconds; the rest carries
+      on as the next clip.
+    - Once an utterance is longer than `spill_after` seconds, it is
+      written to a file in `spill_dir` as it grows instead of being kept
+      in memory.
+
+    Every capture source has its own Segmenter, so sources never share or
+    interrupt each other's utterances.
+
+    Parameters:
+    - sample_rate: Sample rate of the frames.
+    - frame_duration: Length of one frame in ms.
+    - max_silence: Seconds of non-speech that end an utterance.
+    - pre_roll: Seconds of audio kept from before the utterance started.
+    - post_roll: Seconds of audio kept after the last speech frame.
+    - onset_frames, onset_window: Speech frames needed within the last
+      `onset_window` frames to start an utterance.
+    - max_length: Longest clip in seconds.
+    - split_window: Seconds at the end of an over-long clip searched for the quietest split point.
+    - spill_after: Seconds an utterance is kept in memory before it is spilled to disk.
+    - spill_dir: Folder for spilled utterances (default: the system temp folder).
+    """
+
+    def __init__(self, sample_rate=48000, frame_duration=20, max_silence=0.5, pre_roll=0.3, post_roll=0.1,
+                 onset_frames=2, onset_window=3, max_length=30.0, split_window=3.0, spill_after=5.0,
+                 spill_dir=None):
+        frames_per_second = 1000 / frame_duration
+        self.frame_duration = frame_duration
+        self.frame_samples = int(sample_rate * frame_duration / 1000)
+        self.frame_bytes = self.frame_samples * 2
+        self.max_silence_frames = int(max_silence * frames_per_second)
+        self.post_roll_frames = int(post_roll * frames_per_second)
+        self.onset_frames = onset_frames
+        self.onset_window = onset_window
+        self.max_frames = int(max_length * frames_per_second)
+        self.split_frames = max(1, min(int(split_window * frames_per_second), self.max_frames - 1))
+        self.spill_after_frames = int(spill_after * frames_per_second)
+        self.spill_dir = spill_dir
+        # Idle state: ring of the most recent frames and their VAD decisions
+        self.pre_roll_frames = max(int(pre_roll * frames_per_second), onset_window)
+        self.ring = np.zeros((self.pre_roll_frames, self.frame_samples), dtype=np.int16)
+        self.ring_speech = np.zeros(self.pre_roll_frames, dtype=bool)
+        self.ring_position = 0  # Frames written to the ring since the last utterance
+        # Utterance state
+        self.is_recording = False
+        self.buffer = bytearray()
+        self.spill_file = None
+        self.num_frames = 0
+        self.energies = np.zeros(self.max_frames, dtype=np.float32)  # Mean square of every frame, for splitting
+        self.last_speech_frame = 0  # Frames up to and including the last speech frame
+        self.silent_frames = 0
+        self.last_speech_time = None  # perf_counter() of the last speech frame
+        self.spilled = 0  # Utterances spilled to disk so far
+        self.splits = 0  # Utterances split because they reached max_length
+
+    def feed(self, is_speech, frame):
+        """
+        Adds one frame.
+
+        Parameters:
+        - is_speech: VAD decision for the frame.
+        - frame: int16 numpy array of one frame (may be a view that is reused later; it is copied).
+
+        Returns:
+        - A finished utterance, or None. An utterance is a dict with
+          'pcm_data' (a bytearray the caller now owns) or 'pcm_path' (a raw
+          int16 file the caller must delete), and 'speech_end', the
+          perf_counter() of its last speech frame.
+        """
+        if not self.is_recording:
+            slot = self.ring_position % self.pre_roll_frames
+            self.ring[slot] = frame
+            self.ring_speech[slot] = is_speech
+            self.ring_position += 1
+            if is_speech and self.onset_detected():
+                self.start_utterance()
+            return None
+
+        self.append(frame)
+        if is_speech:
+            self.last_speech_frame = self.num_frames
+            self.last_speech_time = time.perf_counter()
+            self.silent_frames = 0
+        else:
+            self.silent_frames += 1
+            if self.silent_frames > self.max_silence_frames:
+                return self.flush()
+        if self.num_frames >= self.max_frames:
+            return self.split()
+        return None
+
+    def flush(self):
+        """
+        Finishes the current utterance, e.g. on a long enough silence or when the source runs out.
+
+        Returns:
+        - The utterance (see feed), or None if none was in progress.
+        """
+        if not self.is_recording:
+            self.ring_position = 0
+            return None
+        end = min(self.num_frames, self.last_speech_frame + self.post_roll_frames)
+        utterance = self.take(end)
+        self.is_recording = False
+        self.ring_position = 0
+        self.ring_speech[:] = False
+        return utterance
+
+    def onset_detected(self):
+        window = min(self.onset_window, self.ring_position)
+        recent = [(self.ring_position - 1 - i) % self.pre_roll_frames for i in range(window)]
+        return int(self.ring_speech[recent].sum()) >= self.onset_frames
+
+    def start_utterance(self):
+        # The utterance starts with the pre-roll, oldest frame first
+        self.is_recording = True
+        self.buffer = bytearray()
+        self.num_frames = 0
+        count = min(self.ring_position, self.pre_roll_frames)
+        for i in range(count):
+            self.append(self.ring[(self.ring_position - count + i) % self.pre_roll_frames])
+        self.last_speech_frame = self.num_frames
+        self.last_speech_time = time.perf_counter()
+        self.silent_frames = 0
+
+    def append(self, frame):
+        self.energies[self.num_frames] = np.dot(frame, frame.astype(np.float32)) / len(frame)
+        self.num_frames += 1
+        if self.spill_file is not None:
+            self.spill_file.write(frame.data.cast('B'))
+            return
+        self.buffer.extend(frame.data.cast('B'))
+        if self.num_frames > self.spill_after_frames:
+            # Too long to keep in memory: move it to a file and keep appending there
+            self.spill_file = tempfile.NamedTemporaryFile(dir=self.spill_dir, prefix='utterance_', suffix='.pcm',
+                                                          delete=False)
+            self.spill_file.write(self.buffer)
+            self.buffer = bytearray()
+            self.spilled += 1
+
+    def split(self):
+        # Cut at the quietest frame near the end; the frames after it start the next clip
+        search_start = self.num_frames - self.split_frames
+        cut = search_start + int(np.argmin(self.energies[search_start:self.num_frames]))
+        cut = max(cut, 1)
+        rest_frames = self.num_frames - cut
+        last_speech = self.last_speech_frame
+        utterance = self.take(self.num_frames, cut)
+        self.energies[:rest_frames] = self.energies[cut:cut + rest_frames]
+        self.num_frames = rest_frames
+        self.last_speech_frame = max(last_speech - cut, 0)
+        self.splits += 1
+        return utterance
+
+    def take(self, end, cut=None):
+        """
+        Hands out frames [0, cut) of the utterance and keeps frames [cut, end) as a new one.
+
+        Frames from `end` on are discarded. Without `cut`, everything up to
+        `end` is handed out.
+        """
+        cut = end if cut is None else cut
+        speech_end = self.last_speech_time
+        if self.spill_file is None:
+            utterance = {'pcm_data': self.buffer, 'speech_end': speech_end}
+            self.buffer = bytearray(self.buffer[cut * self.frame_bytes:end * self.frame_bytes])
+            del utterance['pcm_data'][cut * self.frame_bytes:]
+            return utterance
+        spill_file = self.spill_file
+        spill_file.flush()
+        spill_file.seek(cut * self.frame_bytes)
+        rest = spill_file.read((end - cut) * self.frame_bytes)
+        spill_file.truncate(cut * self.frame_bytes)
+        spill_file.close()
+        self.spill_file = None
+        self.buffer = bytearray(rest)
+        return {'pcm_path': spill_file.name, 'speech_end': speech_end}
+
+    def close(self):
+        # Drop an unfinished utterance, deleting its spill file
+        if self.spill_file is not None:
+            self.spill_file.close()
+            os.remove(self.spill_file.name)
+            self.spill_file = None
+        self.buffer = bytearray()
+        self.is_recording = False
+
+    def get_stats(self):
+        return {'recording': self.is_recording, 'spilled': self.spilled, 'splits': self.splits}
@@ -0,0 +1,420 @@
+import threading
+import time
+import warnings
+import wave
+
+import numpy as np
+
+
+class SourceExhausted(Exception):
+    """Raised by a capture stream when a finite source (a file, a fixed-length synthetic run) has no audio left."""
+
+
+class CaptureSource:
+    """
+    Interface for where captured audio comes from.
+
+    A source works like a soundcard microphone: `recorder(samplerate)`
+    returns a stream to use in a `with` block, and the stream's
+    `record(numframes)` returns float32 samples of shape (numframes, 1).
+    Finite sources raise SourceExhausted once they run out.
+    """
+
+    name = 'base'
+
+    def recorder(self, samplerate):
+        raise NotImplementedError
+
+    def get_stats(self):
+        return {'source': self.name}
+
+
+class LoopbackSource(CaptureSource):
+    """
+    Records what a speaker plays, through soundcard's loopback device.
+
+    soundcard is only imported when the stream is created, so the rest of
+    the app can run on machines without an audio stack. soundcard reports
+    capture overruns only as "data discontinuity" warnings; those raised
+    while this source's stream is read are counted in `overruns` instead of
+    being printed.
+
+    Parameters:
+    - speaker: Substring of the speaker name, matched case-insensitively
+      (default: the default speaker), e.g. 'Discord' for a separate output
+      device the voice chat plays to.
+    - channel: Speaker channel to capture (0 = left, 1 = right, ...).
+    """
+
+    def __init__(self, speaker=None, channel=0):
+        self.speaker = speaker
+        self.channel = channel
+        self.name = 'loopback' + (f":{speaker}" if speaker else '') + (f"#{channel}" if channel else '')
+        self.overruns = 0
+
+    def find_microphone(self):
+        import soundcard as sc
+        if self.speaker is None:
+            speaker_name = sc.default_speaker().name
+        else:
+            names = [s.name for s in sc.all_speakers() if self.speaker.lower() in s.name.lower()]
+            if not names:
+                return None
+            speaker_name = names[0]
+        for mic in sc.all_microphones(include_loopback=True):
+            if mic.isloopback and mic.name == speaker_name:
+                return mic
+        return None
+
+    def recorder(self, samplerate):
+        mic = self.find_microphone()
+        if mic is None:
+            raise RuntimeError(f"Could not find loopback microphone for {self.speaker or 'the default speaker'}.")
+        watch_overruns()
+        return LoopbackStream(mic.recorder(samplerate=samplerate, channels=[self.channel], exclusive_mode=False), self)
+
+    def get_stats(self):
+        return {'source': self.name, 'overruns': self.overruns}
+
+
+class LoopbackStream:
+    """
+    Wraps a soundcard recorder so the overruns it reports are counted on its own source.
+
+    soundcard warns about an overrun from inside `record()`, on the thread
+    reading the stream, so the thread notes which source it is reading for
+    the warnings hook (see watch_overruns) while the call runs.
+    """
+
+    def __init__(self, recorder, source):
+        self.recorder = recorder
+        self.source = source
+        self.stream = None
+
+    def __enter__(self):
+        self.stream = self.recorder.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.recorder.__exit__(*exc_info)
+
+    def record(self, numframes):
+        reading.source = self.source
+        try:
+            return self.stream.record(numframes=numframes)
+        finally:
+            reading.source = None
+
+
+# The loopback source whose stream the current thread is reading, if any
+reading = threading.local()
+overrun_hook_lock = threading.Lock()
+overrun_hook_installed = False
+
+
+def watch_overruns():
+    # Install, once per process, the hook that counts "data discontinuity" warnings on the source being read
+    global overrun_hook_installed
+    with overrun_hook_lock:
+        if overrun_hook_installed:
+            return
+        overrun_hook_installed = True
+        warnings.filterwarnings('always', message='data discontinuity')  # Not just the first one
+        show_warning = warnings.showwarning
+
+        def count_overrun(message, category, filename, lineno, file=None, line=None):
+            source = getattr(reading, 'source', None)
+            if source is not None and 'data discontinuity' in str(message):
+                source.overruns += 1
+            else:
+                show_warning(message, category, filename, lineno, file, line)
+
+        warnings.showwarning = count_overrun
+
+
+class PacedStream:
+    """
+    Hands out audio from `read_func` at a fixed multiple of real time.
+
+    It behaves like a sound card with a small buffer. If the reader falls
+    further behind than `buffer_duration`, the oldest audio is thrown away
+    and counted in `dropped_samples` (and as one of `overruns`), just like
+    a device overrun. With `speed=None` audio is handed out as fast as it
+    is read and nothing is ever dropped.
+
+    Parameters:
+    - read_func: Function taking a sample count and returning up to that many
+      float32 mono samples (fewer, or none, at the end of the audio).
+    - sample_rate: Sample rate of the audio.
+    - speed: Multiple of real time (1.0 = real time), or None for max speed.
+    - buffer_duration: Seconds of audio the simulated device buffers before it overruns.
+    """
+
+    def __init__(self, read_func, sample_rate, speed=1.0, buffer_duration=0.5):
+        self.read_func = read_func
+        self.sample_rate = sample_rate
+        self.speed = speed
+        self.buffer_size = int(buffer_duration * sample_rate)
+        self.start_time = None
+        self.position = 0  # Samples handed out or dropped so far
+        self.dropped_samples = 0
+        self.overruns = 0
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def record(self, numframes):
+        if self.speed:
+            rate = self.sample_rate * self.speed
+            behind = int((time.perf_counter() - self.start_time) * rate) - self.position - numframes
+            if behind > self.buffer_size:
+                # The device buffer overflowed while we weren't reading; that audio is lost
+                lost = behind - self.buffer_size
+                self.position += len(self.read_func(lost))
+                self.dropped_samples += lost
+                self.overruns += 1
+            wait = self.start_time + (self.position + numframes) / rate - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        samples = self.read_func(numframes)
+        if len(samples) == 0:
+            raise SourceExhausted()
+        self.position += len(samples)
+        return samples.reshape(-1, 1)
+
+
+class FileSource(CaptureSource):
+    """
+    Replays a recording (WAV, or raw 16-bit PCM) as if it were live capture.
+
+    Parameters:
+    - path: .wav file, or a raw little-endian int16 file (.pcm/.raw).
+    - speed: Multiple of real time to replay at, or None for max speed.
+    - loop: Start again from the beginning instead of finishing at the end.
+    - sample_rate: Sample rate of a raw PCM file (WAV files carry their own).
+    - channels: Channel count of a raw PCM file.
+    - channel: Replay only this channel (default: mix all channels down).
+    """
+
+    def __init__(self, path, speed=1.0, loop=False, sample_rate=48000, channels=1, channel=None):
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.raw_sample_rate = sample_rate
+        self.raw_channels = channels
+        self.channel = channel
+        self.name = f"file:{path}" + (f"#{channel}" if channel is not None else '')
+        self.stream = None
+
+    def load(self, samplerate):
+        # Whole file (or one channel of it) as float32 mono at `samplerate`
+        if self.path.lower().endswith('.wav'):
+            with wave.open(self.path, 'rb') as wav_file:
+                if wav_file.getsampwidth() != 2:
+                    raise ValueError(f"{self.path} is not 16-bit PCM")
+                channels = wav_file.getnchannels()
+                rate = wav_file.getframerate()
+                data = wav_file.readframes(wav_file.getnframes())
+        else:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            channels = self.raw_channels
+            rate = self.raw_sample_rate
+        frames = np.frombuffer(data, dtype='<i2').reshape(-1, channels)
+        if self.channel is not None:
+            if self.channel >= channels:
+                raise ValueError(f"{self.path} has no channel {self.channel}")
+            samples = frames[:, self.channel] / 32768
+        else:
+            samples = frames.mean(axis=1) / 32768
+        if rate != samplerate and len(samples):
+            length = int(round(len(samples) * samplerate / rate))
+            samples = np.interp(np.linspace(0, len(samples) - 1, length), np.arange(len(samples)), samples)
+        return samples.astype(np.float32)
+
+    def recorder(self, samplerate):
+        samples = self.load(samplerate)
+        position = [0]
+
+        def read(count):
+            if self.loop and position[0] >= len(samples):
+                position[0] = 0
+            chunk = samples[position[0]:position[0] + count]
+            position[0] += len(chunk)
+            return chunk
+
+        self.stream = PacedStream(read, samplerate, self.speed)
+        return self.stream
+
+    def get_stats(self):
+        stats = {'source': self.name, 'speed': self.speed}
+        if self.stream is not None:
+            stats['position'] = self.stream.position
+            stats['dropped_samples'] = self.stream.dropped_samples
+            stats['overruns'] = self.stream.overruns
+        return stats
+
+
+def synthesize_voice(num_samples, sample_rate, rng):
+    # A voiced sound: harmonics of a wandering pitch shaped by one formant, gated into syllables
+    t = np.arange(num_samples) / sample_rate
+    pitch = rng.uniform(90, 220) + 30 * np.sin(2 * np.pi * rng.uniform(0.5, 2) * t)
+    phase = np.cumsum(2 * np.pi * pitch / sample_rate)
+    formant = rng.uniform(400, 2500)
+    voice = np.zeros(num_samples)
+    for k in range(1, 20):
+        voice += np.sin(k * phase) * np.exp(-((k * pitch - formant) / 500) ** 2)
+    syllables = 0.6 + 0.4 * np.sin(2 * np.pi * rng.uniform(3, 6) * t)
+    voice *= syllables / max(np.abs(voice).max(), 1e-9)
+    return voice.astype(np.float32)
+
+
+class SyntheticSource(CaptureSource):
+    """
+    Generates a lobby: bursts of voice-like sound separated by near-silence.
+
+    The pattern is random but repeatable for a given seed, and the start and
+    end of every burst is recorded in `utterances` (in samples) as ground
+    truth.
+
+    Parameters:
+    - duration: Seconds of audio to generate, or None to run forever.
+    - speed: Multiple of real time, or None for max speed.
+    - seed: Random seed.
+    - speech: (min, max) seconds per utterance.
+    - silence: (min, max) seconds between utterances.
+    - level: Peak level of the voice (0-1).
+    - noise_level: RMS level of the background noise (0-1).
+    """
+
+    name = 'synthetic'
+
+    def __init__(self, duration=60, speed=1.0, seed=0, speech=(0.6, 3.0), silence=(0.8, 3.0),
+                 level=0.3, noise_level=0.001):
+        self.duration = duration
+        self.speed = speed
+        self.seed = seed
+        self.speech = speech
+        self.silence = silence
+        self.level = level
+        self.noise_level = noise_level
+        self.utterances = []  # (start, end) sample positions of every generated utterance
+        self.stream = None
+
+    def generator(self, samplerate):
+        # Yields successive chunks of lobby audio: silence, utterance, silence, ...
+        rng = np.random.default_rng(self.seed)
+        position = 0
+        while True:
+            gap = int(rng.uniform(*self.silence) * samplerate)
+            yield rng.standard_normal(gap).astype(np.float32) * self.noise_level
+            position += gap
+            length = int(rng.uniform(*self.speech) * samplerate)
+            voice = synthesize_voice(length, samplerate, rng) * self.level
+            voice += rng.standard_normal(length).astype(np.float32) * self.noise_level
+            self.utterances.append((position, position + length))
+            yield voice
+            position += length
+
+    def recorder(self, samplerate):
+        self.utterances = []
+        chunks = self.generator(samplerate)
+        pending = [np.zeros(0, dtype=np.float32)]
+        remaining = [None if self.duration is None else int(self.duration * samplerate)]
+
+        def read(count):
+            if remaining[0] is not None:
+                count = min(count, remaining[0])
+            parts = []
+            needed = count
+            while needed > 0:
+                if len(pending[0]) == 0:
+                    pending[0] = next(chunks)
+                part = pending[0][:needed]
+                pending[0] = pending[0][needed:]
+                parts.append(part)
+                needed -= len(part)
+            if remaining[0] is not None:
+                remaining[0] -= count
+            return np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+
+        self.stream = PacedStream(read, samplerate, self.speed)
+        return self.stream
+
+    def render(self, path, samplerate=48000):
+        """
+        Writes the whole generated lobby to a 16-bit WAV file (needs a finite duration).
+
+        Returns:
+        - The list of (start, end) utterance positions, in samples.
+        """
+        stream = self.recorder(samplerate)
+        stream.speed = None
+        with wave.open(path, 'wb') as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(samplerate)
+            try:
+                while True:
+                    block = stream.record(samplerate)
+                    wav_file.writeframes((np.clip(block, -1, 1) * 32767).astype(np.int16).tobytes())
+            except SourceExhausted:
+                pass
+        return list(self.utterances)
+
+    def get_stats(self):
+        stats = {'source': self.name, 'speed': self.speed, 'utterances': len(self.utterances)}
+        if self.stream is not None:
+            stats['position'] = self.stream.position
+            stats['dropped_samples'] = self.stream.dropped_samples
+            stats['overruns'] = self.stream.overruns
+        return stats
+
+
+def parse_speed(text):
+    # '4' -> 4.0, 'max' -> None
+    return None if text == 'max' else float(text)
+
+
+def source_from_spec(spec):
+    """
+    Builds a capture source from a short description, e.g. from an environment variable.
+
+    Parameters:
+    - spec: 'loopback[:<speaker name>]', 'synthetic[:<seconds>]' or
+      'file:<path>'. Loopback and file sources take an optional '#<channel>'
+      to capture one channel only, and replayed sources an optional
+      '@<speed>' (a multiple of real time, or 'max'), e.g. 'loopback#1',
+      'loopback:Discord', 'file:lobby.wav@4' or 'synthetic:600@max'.
+    """
+    speed = 1.0
+    if '@' in spec:
+        spec, speed_text = spec.rsplit('@', 1)
+        speed = parse_speed(speed_text)
+    channel = None
+    if '#' in spec and spec.rsplit('#', 1)[1].isdigit():
+        spec, channel_text = spec.rsplit('#', 1)
+        channel = int(channel_text)
+    kind, _, argument = spec.partition(':')
+    if kind == 'loopback':
+        return LoopbackSource(speaker=argument or None, channel=channel or 0)
+    if kind == 'synthetic':
+        return SyntheticSource(duration=float(argument) if argument else None, speed=speed)
+    if kind == 'file':
+        return FileSource(argument, speed=speed, channel=channel)
+    raise ValueError(f"Unknown capture source '{spec}'")
+
+
+def sources_from_spec(specs):
+    # Several sources captured at once, separated by commas, e.g. 'loopback#0,loopback#1,loopback:Discord'
+    sources = [source_from_spec(spec.strip()) for spec in specs.split(',') if spec.strip()]
+    # The same speaker channel twice (e.g. 'loopback' and 'loopback#0') would record every clip twice
+    loopbacks = [source.name for source in sources if isinstance(source, LoopbackSource)]
+    duplicates = sorted({name for name in loopbacks if loopbacks.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Capture source {', '.join(duplicates)} is listed more than once")
+    return sources
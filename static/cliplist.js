@@ -0,0 +1,321 @@
+// Virtualised, keyed list of clips for the web UI (see templates/index.html).
+//
+// Only the rows in view, plus a few either side, exist in the DOM. Rows are
+// keyed by clip id. When the list changes, rows whose clip is still the same
+// object are only moved, changed clips are refilled in place, and rows are
+// made only for clips that scroll or are inserted into view. Clicks go
+// through one delegated listener, so rows carry no handlers of their own.
+(function(global) {
+    'use strict';
+
+    var ROW_HEIGHT = 92;  // px; every row is the same height, so row i sits at i * ROW_HEIGHT
+    var OVERSCAN = 6;  // Rows kept above and below the viewport, so fast scrolling doesn't show gaps
+    var SCROLL_IDLE = 120;  // ms without scrolling before waveforms of newly shown rows are drawn
+
+    function el(tag, className, text) {
+        var element = document.createElement(tag);
+        if (className) {
+            element.className = className;
+        }
+        if (text !== undefined) {
+            element.textContent = text;
+        }
+        return element;
+    }
+
+    function defaultTimestampText(clip) {
+        return new Date(clip.timestamp * 1000).toLocaleString();
+    }
+
+    function defaultTranscriptText(clip) {
+        return clip.text || '';
+    }
+
+    /**
+     * A scrollable list of clips, newest first, rendered into `container`.
+     *
+     * Options:
+     * - actions: Buttons of each row, e.g. [{action: 'play', label: 'Play', className: 'btn-primary play-button'}].
+     * - onAction(action, clip, value): Called when one is clicked; for 'rename' (Apply), value is the new name.
+     * - emptyText: Shown instead of the list when it has no clips.
+     * - timestampText(clip), transcriptText(clip): Cell text.
+     * - drawWaveform(canvas, clip): Draws a clip's waveform into its row's canvas.
+     */
+    function ClipList(container, options) {
+        this.options = options;
+        this.items = [];
+        this.rows = new Map();  // clip id -> row currently in the DOM
+        this.pool = [];  // Rows scrolled out of view, reused for the next ones scrolled in
+        this.editing = {};  // clip id -> {value} of names being edited (an input in view is never refilled)
+        this.anchor = null;  // {id, index, offset} of the first row in view, kept there when clips are added above
+        this.renderPending = false;
+        this.scrolling = false;
+        this.idleTimer = null;
+        this.stats = {renders: 0, rowsCreated: 0, rowsFilled: 0, rowsMoved: 0};
+
+        this.root = el('div', 'clip-list');
+        this.empty = el('p', 'clip-empty', options.emptyText || '');
+        this.header = el('div', 'clip-header');
+        ['Name', 'Timestamp', 'Transcription', 'Actions'].forEach(function(title, i) {
+            this.header.appendChild(el('div', 'clip-cell ' + ClipList.CELL_CLASSES[i], title));
+        }, this);
+        this.viewport = el('div', 'clip-viewport');
+        this.spacer = el('div', 'clip-spacer');
+        this.viewport.appendChild(this.header);  // Sticky, and scrolls sideways with the rows on narrow screens
+        this.viewport.appendChild(this.spacer);
+        this.root.appendChild(this.empty);
+        this.root.appendChild(this.viewport);
+        container.appendChild(this.root);
+
+        var self = this;
+        this.viewport.addEventListener('scroll', function() {
+            self.scrolling = true;
+            clearTimeout(self.idleTimer);
+            self.idleTimer = setTimeout(function() {
+                self.scrolling = false;
+                self.drawPendingWaveforms();
+            }, SCROLL_IDLE);
+            self.scheduleRender();
+        }, {passive: true});
+        this.root.addEventListener('click', function(event) { self.handleClick(event); });
+        this.root.addEventListener('input', function(event) {
+            var row = self.rowOf(event.target);
+            if (row && self.editing[row.clip.id]) {
+                self.editing[row.clip.id].value = event.target.value;
+            }
+        });
+        this.root.addEventListener('keydown', function(event) {
+            var row = self.rowOf(event.target);
+            if (event.key === 'Enter' && row && event.target === row.parts.input) {
+                self.options.onAction('rename', row.clip, event.target.value);
+            }
+        });
+        global.addEventListener('resize', function() { self.scheduleRender(); });
+        this.render();
+    }
+
+    ClipList.ROW_HEIGHT = ROW_HEIGHT;
+    ClipList.CELL_CLASSES = ['clip-name', 'clip-time', 'clip-text', 'clip-actions'];
+
+    // Show `items` (newest first). Rows are diffed by clip id, so pass the same objects for unchanged clips.
+    ClipList.prototype.setItems = function(items) {
+        this.items = items;
+        this.render();
+    };
+
+    ClipList.prototype.scheduleRender = function() {
+        if (this.renderPending) {
+            return;
+        }
+        this.renderPending = true;
+        var self = this;
+        global.requestAnimationFrame(function() {
+            self.renderPending = false;
+            self.render();
+        });
+    };
+
+    ClipList.prototype.render = function() {
+        var items = this.items;
+        this.stats.renders++;
+        this.empty.style.display = items.length ? 'none' : '';
+        this.viewport.style.display = items.length ? '' : 'none';
+        this.spacer.style.height = (items.length * ROW_HEIGHT) + 'px';
+        this.restoreAnchor();
+
+        var scrollTop = this.viewport.scrollTop;
+        var height = this.viewport.clientHeight || 10 * ROW_HEIGHT;  // Not laid out yet: assume ten rows
+        var first = Math.max(Math.floor(scrollTop / ROW_HEIGHT) - OVERSCAN, 0);
+        var last = Math.min(Math.ceil((scrollTop + height) / ROW_HEIGHT) + OVERSCAN, items.length);
+
+        // Retire the rows that are no longer in view, then place (and if needed fill) the ones that are
+        var visible = new Set();
+        for (var i = first; i < last; i++) {
+            visible.add(items[i].id);
+        }
+        this.rows.forEach(function(row, id) {
+            if (!visible.has(id)) {
+                this.rows.delete(id);
+                this.spacer.removeChild(row.element);
+                row.clip = null;
+                this.pool.push(row);
+            }
+        }, this);
+        for (var index = first; index < last; index++) {
+            var clip = items[index];
+            var row = this.rows.get(clip.id);
+            if (!row) {
+                row = this.pool.pop() || this.createRow();
+                row.index = -1;
+                this.rows.set(clip.id, row);
+                this.spacer.appendChild(row.element);
+            }
+            if (row.clip !== clip || row.editing !== Boolean(this.editing[clip.id])) {
+                this.fillRow(row, clip);
+            }
+            if (row.index !== index) {
+                row.index = index;
+                row.element.style.transform = 'translateY(' + (index * ROW_HEIGHT) + 'px)';
+                row.element.classList.toggle('clip-row-odd', index % 2 === 1);
+                this.stats.rowsMoved++;
+            }
+        }
+
+        var top = Math.min(Math.floor(scrollTop / ROW_HEIGHT), items.length - 1);
+        this.anchor = top >= 0 ? {id: items[top].id, index: top, offset: scrollTop - top * ROW_HEIGHT} : null;
+    };
+
+    // Keep the first row in view where it was when clips were inserted or removed above it
+    ClipList.prototype.restoreAnchor = function() {
+        var anchor = this.anchor;
+        var items = this.items;
+        if (anchor === null || this.viewport.scrollTop === 0) {
+            return;  // At the top, new clips should push the list down into view
+        }
+        if (items[anchor.index] && items[anchor.index].id === anchor.id) {
+            return;
+        }
+        for (var i = 0; i < items.length; i++) {
+            if (items[i].id === anchor.id) {
+                this.viewport.scrollTop = i * ROW_HEIGHT + anchor.offset;
+                return;
+            }
+        }
+    };
+
+    ClipList.prototype.createRow = function() {
+        var parts = {
+            nameView: el('div', 'name-view'),
+            nameLabel: el('span', 'name-label'),
+            nameEdit: el('div', 'name-edit d-none'),
+            input: el('input', 'form-control form-control-sm name-input'),
+            timestamp: el('span', 'clip-timestamp'),
+            source: el('small', 'text-muted clip-source'),
+            canvas: el('canvas', 'waveform'),
+            text: el('div', 'clip-cell clip-text')
+        };
+        parts.input.type = 'text';
+        parts.canvas.width = 160;
+        parts.canvas.height = 32;
+        parts.nameView.appendChild(parts.nameLabel);
+        parts.nameView.appendChild(this.button('edit', 'Edit', 'btn-secondary edit-button'));
+        parts.nameEdit.appendChild(parts.input);
+        parts.nameEdit.appendChild(this.button('rename', 'Apply', 'btn-success apply-button'));
+
+        var element = el('div', 'clip-row');
+        var nameCell = el('div', 'clip-cell clip-name');
+        nameCell.appendChild(parts.nameView);
+        nameCell.appendChild(parts.nameEdit);
+        var timeCell = el('div', 'clip-cell clip-time');
+        timeCell.appendChild(parts.timestamp);
+        timeCell.appendChild(parts.source);
+        timeCell.appendChild(parts.canvas);
+        var actionsCell = el('div', 'clip-cell clip-actions');
+        (this.options.actions || []).forEach(function(action) {
+            actionsCell.appendChild(this.button(action.action, action.label, action.className));
+        }, this);
+        element.appendChild(nameCell);
+        element.appendChild(timeCell);
+        element.appendChild(parts.text);
+        element.appendChild(actionsCell);
+
+        var row = {element: element, parts: parts, clip: null, index: -1, editing: false, waveformId: null};
+        element.clipRow = row;
+        this.stats.rowsCreated++;
+        return row;
+    };
+
+    ClipList.prototype.button = function(action, label, className) {
+        var button = el('button', 'btn btn-sm ' + className, label);
+        button.type = 'button';
+        button.dataset.action = action;
+        return button;
+    };
+
+    ClipList.prototype.fillRow = function(row, clip) {
+        var parts = row.parts;
+        var editing = this.editing[clip.id];
+        var options = this.options;
+        parts.nameLabel.textContent = clip.name || '[No Name]';
+        if (editing && (!row.editing || row.clip === null || row.clip.id !== clip.id)) {
+            parts.input.value = editing.value;
+        }
+        parts.nameView.classList.toggle('d-none', Boolean(editing));
+        parts.nameEdit.classList.toggle('d-none', !editing);
+        parts.timestamp.textContent = (options.timestampText || defaultTimestampText)(clip);
+        parts.source.textContent = clip.capture_source || '';  // Which source heard it
+        var text = (options.transcriptText || defaultTranscriptText)(clip);
+        parts.text.textContent = text;
+        parts.text.title = text;
+        if (row.waveformId !== clip.id) {
+            // The audio of a clip never changes, so its waveform is only drawn when the row shows another clip
+            parts.canvas.getContext('2d').clearRect(0, 0, parts.canvas.width, parts.canvas.height);
+            parts.canvas.dataset.clipId = clip.id;
+            row.waveformId = null;
+            if (!this.scrolling) {
+                this.drawWaveform(row, clip);
+            }
+        }
+        row.clip = clip;
+        row.editing = Boolean(editing);
+        this.stats.rowsFilled++;
+    };
+
+    ClipList.prototype.drawWaveform = function(row, clip) {
+        row.waveformId = clip.id;
+        if (this.options.drawWaveform) {
+            this.options.drawWaveform(row.parts.canvas, clip);
+        }
+    };
+
+    // Once scrolling stops, draw the waveforms skipped while rows flew past
+    ClipList.prototype.drawPendingWaveforms = function() {
+        this.rows.forEach(function(row) {
+            if (row.clip !== null && row.waveformId !== row.clip.id) {
+                this.drawWaveform(row, row.clip);
+            }
+        }, this);
+    };
+
+    ClipList.prototype.rowOf = function(element) {
+        var rowElement = element.closest ? element.closest('.clip-row') : null;
+        return rowElement && rowElement.clipRow && rowElement.clipRow.clip ? rowElement.clipRow : null;
+    };
+
+    ClipList.prototype.handleClick = function(event) {
+        var button = event.target.closest ? event.target.closest('[data-action]') : null;
+        var row = button ? this.rowOf(button) : null;
+        if (!row) {
+            return;
+        }
+        var action = button.dataset.action;
+        if (action === 'edit') {
+            this.startEditing(row.clip);
+        } else if (action === 'rename') {
+            this.options.onAction('rename', row.clip, row.parts.input.value);
+        } else {
+            this.options.onAction(action, row.clip);
+        }
+    };
+
+    ClipList.prototype.startEditing = function(clip) {
+        this.editing[clip.id] = {value: clip.name || ''};
+        this.render();
+        var row = this.rows.get(clip.id);
+        if (row) {
+            row.parts.input.focus();
+        }
+    };
+
+    // Leave edit mode for a clip (e.g. once its new name was saved)
+    ClipList.prototype.finishEditing = function(clipId) {
+        delete this.editing[clipId];
+        this.render();
+    };
+
+    ClipList.prototype.isEditing = function() {
+        return Object.keys(this.editing).length > 0;
+    };
+
+    global.ClipList = ClipList;
+})(window);
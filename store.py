@@ -0,0 +1,388 @@
+import glob
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from metrics import time_stage
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clips (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    list_type TEXT NOT NULL,            -- 'recordings' or 'favorites'
+    source_id INTEGER,                  -- For favorites: the recording it was made from
+    session TEXT,                       -- Session folder the clip was captured in
+    timestamp INTEGER NOT NULL,
+    wav_filename TEXT NOT NULL,
+    mp3_filename TEXT NOT NULL,
+    text TEXT NOT NULL DEFAULT '',
+    name TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS clips_list_time ON clips (list_type, timestamp, id);
+CREATE INDEX IF NOT EXISTS clips_session ON clips (session, list_type);
+CREATE UNIQUE INDEX IF NOT EXISTS favorites_source ON clips (source_id) WHERE list_type = 'favorites';
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS transcripts (
+    audio_hash TEXT NOT NULL,           -- sha1 of the PCM the backend was given
+    backend TEXT NOT NULL,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL,
+    PRIMARY KEY (audio_hash, backend)
+);
+"""
+
+# Columns added after the first release of the store: name -> definition
+ADDED_COLUMNS = {
+    # 'transcribing', 'pending' (dropped from a full queue), 'done', 'no_speech' or 'error'
+    'transcript_status': "TEXT NOT NULL DEFAULT 'done'",
+    'audio_hash': "TEXT",  # Blob the clip's audio is stored in (NULL for clips from before the blob store)
+    'repeat_count': "INTEGER NOT NULL DEFAULT 1",  # Times this clip was heard (near-duplicates merged into it)
+    'capture_source': "TEXT",  # Tag of the capture source the clip was heard on (NULL for older clips)
+    'play_count': "INTEGER NOT NULL DEFAULT 0",  # Times the clip was played to the virtual microphone
+    'last_played': "INTEGER",  # Unix time of the last play (NULL if never played)
+}
+# Indexes on added columns, created once the columns exist
+ADDED_INDEXES = """
+CREATE INDEX IF NOT EXISTS clips_audio_hash ON clips (audio_hash);
+CREATE INDEX IF NOT EXISTS clips_wav_filename ON clips (wav_filename);
+"""
+
+CLIP_COLUMNS = ('id', 'list_type', 'source_id', 'session', 'timestamp', 'wav_filename', 'mp3_filename', 'text', 'name',
+                'transcript_status', 'audio_hash', 'repeat_count', 'capture_source', 'play_count', 'last_played')
+UPDATABLE_COLUMNS = ('text', 'name', 'transcript_status', 'repeat_count')
+# When a clip was last used: played, or else captured. Retention evicts the least recently used first.
+LAST_USED = "COALESCE(last_played, timestamp)"
+# Recordings that have been favorited are kept by retention
+NOT_FAVORITED = ("NOT EXISTS (SELECT 1 FROM clips AS favorite "
+                 "WHERE favorite.list_type = 'favorites' AND favorite.source_id = clips.id)")
+
+
+class ClipStore:
+    """
+    SQLite-backed metadata store for recordings and favorites.
+
+    This replaces rewriting recordings.json / favorites.json in full on every
+    change. Each clip is one row with a unique id, so adding or renaming a
+    clip is a single indexed INSERT/UPDATE, committed atomically. The
+    database runs in WAL mode, so a crash can't leave a truncated file and
+    readers never block the writer.
+
+    Parameters:
+    - path: Database file path.
+    """
+
+    def __init__(self, path='echo.db'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.executescript(SCHEMA)
+            existing = {row['name'] for row in self.connection.execute("PRAGMA table_info(clips)")}
+            for column, definition in ADDED_COLUMNS.items():
+                if column not in existing:
+                    try:
+                        self.connection.execute(f"ALTER TABLE clips ADD COLUMN {column} {definition}")
+                    except sqlite3.OperationalError as e:
+                        if 'duplicate column' not in str(e):
+                            raise  # Otherwise the capture and API processes both opened a new database at once
+            self.connection.executescript(ADDED_INDEXES)
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def add(self, list_type, clip):
+        """
+        Inserts a clip and returns its new id (also stored in clip['id']).
+
+        Parameters:
+        - list_type: 'recordings' or 'favorites'.
+        - clip: Dict with the clip metadata (timestamp, wav_filename, mp3_filename, text, name, ...).
+        """
+        values = {column: clip.get(column) for column in CLIP_COLUMNS if column != 'id'}
+        values['list_type'] = list_type
+        values['text'] = values['text'] or ''
+        values['name'] = values['name'] or ''
+        values['transcript_status'] = values['transcript_status'] or 'done'
+        values['repeat_count'] = values['repeat_count'] or 1
+        values['play_count'] = values['play_count'] or 0
+        columns = ', '.join(values)
+        placeholders = ', '.join('?' for _ in values)
+        with time_stage('metadata_save'), self.lock:
+            try:
+                cursor = self.connection.execute(
+                    f"INSERT INTO clips ({columns}) VALUES ({placeholders})", tuple(values.values()))
+                self.connection.commit()
+            except Exception:
+                self.connection.rollback()  # E.g. a second favorite of one recording (sqlite3.IntegrityError)
+                raise
+        clip['id'] = cursor.lastrowid
+        clip['list_type'] = list_type
+        return clip['id']
+
+    def update(self, clip_id, **fields):
+        """
+        Updates some fields of one clip by id. Returns True if the clip exists.
+        """
+        for column in fields:
+            if column not in UPDATABLE_COLUMNS:
+                raise ValueError(f"Column '{column}' can't be updated")
+        assignments = ', '.join(f"{column} = ?" for column in fields)
+        with time_stage('metadata_save'), self.lock:
+            cursor = self.connection.execute(
+                f"UPDATE clips SET {assignments} WHERE id = ?", tuple(fields.values()) + (clip_id,))
+            self.connection.commit()
+        return cursor.rowcount > 0
+
+    def remove(self, clip_id):
+        # Delete one clip's metadata; its audio is removed separately once nothing references it
+        with time_stage('metadata_save'), self.lock:
+            cursor = self.connection.execute("DELETE FROM clips WHERE id = ?", (clip_id,))
+            self.connection.commit()
+        return cursor.rowcount > 0
+
+    def record_play(self, clip_id, timestamp):
+        # Count a play and remember when it happened, for least-recently-used eviction
+        with self.lock:
+            self.connection.execute(
+                "UPDATE clips SET play_count = play_count + 1, last_played = ? WHERE id = ?", (timestamp, clip_id))
+            self.connection.commit()
+
+    def replace_wav_filename(self, old_path, new_path):
+        # Point every clip stored in `old_path` at `new_path` (e.g. after compaction); returns the ids of those clips
+        with time_stage('metadata_save'), self.lock:
+            clip_ids = [row['id'] for row in self.connection.execute(
+                "SELECT id FROM clips WHERE wav_filename = ?", (old_path,))]
+            self.connection.execute("UPDATE clips SET wav_filename = ? WHERE wav_filename = ?", (new_path, old_path))
+            self.connection.commit()
+        return clip_ids
+
+    def get(self, clip_id):
+        with self.lock:
+            row = self.connection.execute("SELECT * FROM clips WHERE id = ?", (clip_id,)).fetchone()
+        return dict(row) if row else None
+
+    def get_list(self, list_type, session=None):
+        """
+        Returns all clips of one list, oldest first.
+
+        Parameters:
+        - list_type: 'recordings' or 'favorites'.
+        - session: If given, only clips captured in this session folder.
+        """
+        query = "SELECT * FROM clips WHERE list_type = ?"
+        params = [list_type]
+        if session is not None:
+            query += " AND session = ?"
+            params.append(session)
+        query += " ORDER BY timestamp, id"
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_untranscribed(self):
+        # Clips whose transcription never finished (the process stopped, or the job was dropped), oldest first
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, wav_filename FROM clips WHERE transcript_status IN ('transcribing', 'pending') "
+                "ORDER BY timestamp, id").fetchall()
+        return [dict(row) for row in rows]
+
+    def count_references(self, audio_hash):
+        # Number of clips (recordings and favorites) whose audio is this blob
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT COUNT(*) AS refs FROM clips WHERE audio_hash = ?", (audio_hash,)).fetchone()
+        return row['refs']
+
+    def count_path_references(self, wav_filename):
+        # Number of clips stored in this audio file (for clips from before the blob store)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT COUNT(*) AS refs FROM clips WHERE wav_filename = ?", (wav_filename,)).fetchone()
+        return row['refs']
+
+    def count_session(self, session):
+        # Number of recordings captured in a session
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT COUNT(*) AS clips FROM clips WHERE list_type = 'recordings' AND session = ?",
+                (session,)).fetchone()
+        return row['clips']
+
+    def get_least_recently_used(self, limit, used_before=None, session=None, exclude_session=None):
+        """
+        Returns recordings that retention may evict, least recently used first.
+
+        Favorited recordings are never returned. Among clips last used at the
+        same time, the least played goes first.
+
+        Parameters:
+        - limit: Maximum number of clips.
+        - used_before: If given, only clips last used (played, or else captured) before this Unix time.
+        - session: If given, only clips captured in this session.
+        - exclude_session: If given, skip clips captured in this session (e.g. the current one).
+        """
+        query = f"SELECT * FROM clips WHERE list_type = 'recordings' AND {NOT_FAVORITED}"
+        params = []
+        if used_before is not None:
+            query += f" AND {LAST_USED} < ?"
+            params.append(used_before)
+        if session is not None:
+            query += " AND session = ?"
+            params.append(session)
+        if exclude_session is not None:
+            query += " AND session IS NOT ?"
+            params.append(exclude_session)
+        query += f" ORDER BY {LAST_USED}, play_count, id LIMIT ?"
+        params.append(limit)
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_crowded_sessions(self, max_clips):
+        # (session, recording count) of the sessions holding more than max_clips recordings
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT session, COUNT(*) AS clips FROM clips WHERE list_type = 'recordings' AND session IS NOT NULL "
+                "GROUP BY session HAVING COUNT(*) > ?", (max_clips,)).fetchall()
+        return [(row['session'], row['clips']) for row in rows]
+
+    def get_uncompacted(self, used_before, limit, exclude=()):
+        """
+        Returns WAV files whose clips were all last used before `used_before`, oldest first.
+
+        Parameters:
+        - used_before: Unix time.
+        - limit: Maximum number of paths.
+        - exclude: Paths to skip (e.g. ones that failed to compact).
+        """
+        query = "SELECT wav_filename FROM clips WHERE wav_filename LIKE '%.wav'"
+        params = []
+        if exclude:
+            query += f" AND wav_filename NOT IN ({', '.join('?' for _ in exclude)})"
+            params += list(exclude)
+        query += f" GROUP BY wav_filename HAVING MAX({LAST_USED}) < ? ORDER BY MAX({LAST_USED}) LIMIT ?"
+        params += [used_before, limit]
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+        return [row['wav_filename'] for row in rows]
+
+    def get_transcript(self, audio_hash, backend):
+        # Cached transcription result for identical audio, or None
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT text, status FROM transcripts WHERE audio_hash = ? AND backend = ?",
+                (audio_hash, backend)).fetchone()
+        return dict(row) if row else None
+
+    def put_transcript(self, audio_hash, backend, text, status):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO transcripts (audio_hash, backend, text, status) VALUES (?, ?, ?, ?)",
+                (audio_hash, backend, text, status))
+            self.connection.commit()
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else default
+
+    def set_meta(self, key, value):
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, value))
+            self.connection.commit()
+
+    def migrate_json(self, favorites_folder='favorites', session_pattern='session_*'):
+        """
+        One-time import of the old JSON metadata and loose WAV files.
+
+        Reads favorites/favorites.json and every session_*/recordings.json,
+        plus any WAV in those folders that the JSON didn't list. Favorites
+        are linked to the recording they were copied from. The JSON files
+        are left where they are. Runs only once per database.
+
+        Returns:
+        - The number of clips imported.
+        """
+        if self.get_meta('json_migrated'):
+            return 0
+        logger.info("Migrating recordings.json / favorites.json into the clip store...")
+        imported = 0
+        rows = []
+        for session_folder in sorted(glob.glob(session_pattern)):
+            if os.path.isdir(session_folder):
+                rows += [dict(clip, list_type='recordings', session=session_folder)
+                         for clip in self.read_legacy_folder(session_folder, 'recordings.json')]
+        if os.path.isdir(favorites_folder):
+            rows += [dict(clip, list_type='favorites', session=None)
+                     for clip in self.read_legacy_folder(favorites_folder, 'favorites.json')]
+        # A legacy favorite was a copy of its recording, with the same timestamp and file name
+        recording_ids = {}  # (timestamp, wav file name) -> id of the imported recording
+        with self.lock:
+            try:
+                for clip in rows:
+                    key = (clip['timestamp'], os.path.basename(clip['wav_filename']))
+                    source_id = recording_ids.pop(key, None) if clip['list_type'] == 'favorites' else None
+                    cursor = self.connection.execute(
+                        "INSERT INTO clips (list_type, source_id, session, timestamp, wav_filename, mp3_filename, "
+                        "text, name) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (clip['list_type'], source_id, clip['session'], clip['timestamp'], clip['wav_filename'],
+                         clip['mp3_filename'], clip['text'], clip['name']))
+                    if clip['list_type'] == 'recordings':
+                        recording_ids.setdefault(key, cursor.lastrowid)
+                    imported += 1
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', '1')")
+                self.connection.commit()
+            except Exception:
+                self.connection.rollback()
+                raise
+        logger.info("Migrated %d clips.", imported)
+        return imported
+
+    @staticmethod
+    def read_legacy_folder(folder, json_name):
+        # Clips listed in the folder's JSON file, plus loose output_<timestamp>.wav files
+        clips = {}
+        json_path = os.path.join(folder, json_name)
+        if os.path.exists(json_path):
+            try:
+                with open(json_path, 'r') as f:
+                    for clip in json.load(f):
+                        clips[clip['timestamp']] = {
+                            'timestamp': clip['timestamp'],
+                            'wav_filename': os.path.join(folder, clip['wav_filename']),
+                            'mp3_filename': os.path.join(folder, clip['mp3_filename']),
+                            'text': clip.get('text', ''),
+                            'name': clip.get('name', '')
+                        }
+            except Exception as e:
+                logger.exception("Error reading %s: %s", json_path, e)
+        for filename in os.listdir(folder):
+            if filename.endswith('.wav'):
+                try:
+                    timestamp = int(filename.split('_')[1].split('.')[0])
+                except (IndexError, ValueError):
+                    continue  # Skip files with unexpected names
+                if timestamp not in clips:
+                    clips[timestamp] = {
+                        'timestamp': timestamp,
+                        'wav_filename': os.path.join(folder, filename),
+                        'mp3_filename': os.path.join(folder, f"output_{timestamp}.mp3"),
+                        'text': '',
+                        'name': ''
+                    }
+        return sorted(clips.values(), key=lambda clip: clip['timestamp'])
@@ -0,0 +1,322 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+
+import speech_recognition as sr
+
+import numpy as np
+
+from capture import decimate
+from encoding import read_audio
+from metrics import time_stage
+from pipeline import Stage
+
+logger = logging.getLogger(__name__)
+
+
+class NoSpeechError(Exception):
+    """Raised by a transcriber when it understood nothing in the clip (not worth retrying)."""
+
+
+class Transcriber:
+    """
+    Interface for speech-to-text backends.
+
+    Backends get 16 kHz mono int16 PCM bytes and return the recognised text,
+    or raise NoSpeechError when nothing intelligible was said. Any other
+    exception is treated as a transient failure and retried.
+    """
+
+    name = 'base'
+    sample_rate = 16000
+
+    def transcribe(self, pcm_data):
+        raise NotImplementedError
+
+
+class GoogleTranscriber(Transcriber):
+    """
+    The Google Web Speech API through speech_recognition (needs network access).
+
+    Parameters:
+    - language: Recognition language.
+    - timeout: Seconds before a request to Google is abandoned.
+    """
+
+    name = 'google'
+
+    def __init__(self, language='en-ZA', timeout=10):
+        self.language = language
+        self.timeout = timeout
+        self.local = threading.local()  # sr.Recognizer is not thread safe; one per worker
+
+    def get_recognizer(self):
+        recognizer = getattr(self.local, 'recognizer', None)
+        if recognizer is None:
+            recognizer = sr.Recognizer()
+            recognizer.operation_timeout = self.timeout
+            self.local.recognizer = recognizer
+        return recognizer
+
+    def transcribe(self, pcm_data):
+        audio_data = sr.AudioData(pcm_data, self.sample_rate, 2)
+        try:
+            # Get the recognition result with show_all=False to get a string directly
+            return self.get_recognizer().recognize_google(audio_data, language=self.language)
+        except sr.UnknownValueError:
+            raise NoSpeechError()
+
+
+class VoskTranscriber(Transcriber):
+    """
+    Offline recognition with Vosk (pip install vosk, plus a model from
+    https://alphacephei.com/vosk/models unpacked into `model_path`).
+
+    The model is loaded once and shared by all workers; each call gets its
+    own lightweight KaldiRecognizer.
+
+    Parameters:
+    - model_path: Folder of the unpacked Vosk model.
+    """
+
+    name = 'vosk'
+
+    def __init__(self, model_path='model'):
+        try:
+            import vosk
+        except ImportError:
+            raise RuntimeError("The 'vosk' package is required for offline transcription (pip install vosk).")
+        vosk.SetLogLevel(-1)
+        self.vosk = vosk
+        self.model = vosk.Model(model_path)
+
+    def transcribe(self, pcm_data):
+        recognizer = self.vosk.KaldiRecognizer(self.model, self.sample_rate)
+        recognizer.AcceptWaveform(pcm_data)
+        text = json.loads(recognizer.FinalResult()).get('text', '')
+        if not text:
+            raise NoSpeechError()
+        return text
+
+
+class FakeTranscriber(Transcriber):
+    """
+    Deterministic offline transcriber for tests and benchmarks.
+
+    Returns a canned response when the clip's content hash is in `responses`,
+    otherwise a description derived from the audio itself, so the same
+    audio always gives the same text.
+
+    Parameters:
+    - responses: Optional dict of sha1(pcm_data) hex digest -> text.
+    - delay: Seconds to sleep per call, to simulate a slow backend.
+    """
+
+    name = 'fake'
+
+    def __init__(self, responses=None, delay=0.0):
+        self.responses = responses or {}
+        self.delay = delay
+
+    def transcribe(self, pcm_data):
+        if self.delay:
+            time.sleep(self.delay)
+        digest = hashlib.sha1(pcm_data).hexdigest()
+        if digest in self.responses:
+            return self.responses[digest]
+        seconds = len(pcm_data) / 2 / self.sample_rate
+        return f"clip {digest[:8]} ({seconds:.1f}s)"
+
+
+TRANSCRIBERS = {
+    'google': GoogleTranscriber,
+    'vosk': VoskTranscriber,
+    'fake': FakeTranscriber,
+}
+
+
+def create_transcriber(name, **options):
+    # Build a backend by name: 'google', 'vosk' or 'fake'
+    if name not in TRANSCRIBERS:
+        raise ValueError(f"Unknown transcriber '{name}'")
+    return TRANSCRIBERS[name](**options)
+
+
+class TranscriptionService:
+    """
+    Runs transcription off the clip pipeline, in its own worker pool.
+
+    Clips are published straight away in a 'transcribing' state and handed
+    here with their in-memory samples. Each job is resampled for the backend,
+    looked up in the result cache by audio content hash, and only sent to
+    the backend on a miss, with retries. Identical audio that arrives while
+    the first copy is still being transcribed waits for that result instead
+    of calling the backend again. Results are reported through
+    `on_result(clip_id, text, status)`.
+
+    `submit` never waits, so a slow or offline backend can't hold up the
+    pipeline. When `maxsize` clips are already waiting, the oldest is
+    dropped and reported as 'pending'. `resume` transcribes such clips
+    later from their audio files.
+
+    Parameters:
+    - transcriber: A Transcriber backend.
+    - on_result: Callback taking (clip_id, text, status), where status is
+      'done', 'no_speech', 'error' or 'pending'.
+    - store: Optional ClipStore used as the persistent result cache.
+    - sample_rate: Sample rate of the samples passed to `submit`.
+    - workers: Number of worker threads.
+    - maxsize: Maximum number of clips waiting to be transcribed.
+    - retries: Extra attempts after a transient failure.
+    - retry_delay: Seconds to wait before the first retry (doubled each time).
+    """
+
+    def __init__(self, transcriber, on_result, store=None, sample_rate=48000, workers=4,
+                 maxsize=64, retries=2, retry_delay=1.0):
+        self.transcriber = transcriber
+        self.on_result = on_result
+        self.store = store
+        self.sample_rate = sample_rate
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.stage = Stage('transcribe', self.run_job, workers=workers, maxsize=maxsize, policy='drop_oldest',
+                           on_drop=self.drop_job)
+        self.stopping = threading.Event()
+        self.resume_thread = None
+        self.stats_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.failures = 0
+        self.in_flight = {}  # audio hash -> clip ids waiting for that transcription
+
+    def start(self):
+        self.stopping.clear()
+        self.stage.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.stage.stop()
+        if self.resume_thread is not None:
+            self.resume_thread.join()
+            self.resume_thread = None
+
+    def submit(self, clip_id, samples):
+        """
+        Queues a clip for transcription.
+
+        Parameters:
+        - clip_id: Id reported back to on_result.
+        - samples: int16 numpy array at self.sample_rate.
+        """
+        self.stage.put({'clip_id': clip_id, 'samples': samples})
+
+    def resume(self, clips):
+        """
+        Transcribes clips whose transcription never finished, reading their audio files.
+
+        Runs in a background thread that waits for room in the queue, so
+        new clips are never pushed out by the backlog.
+
+        Parameters:
+        - clips: Dicts with the clip 'id' and its 'wav_filename'.
+        """
+        if not clips:
+            return
+        logger.info("Resuming transcription of %d clips", len(clips))
+
+        def run():
+            for clip in clips:
+                if self.stopping.is_set():
+                    return
+                self.stage.put({'clip_id': clip['id'], 'path': clip['wav_filename']}, wait=True)
+
+        self.resume_thread = threading.Thread(target=run, name='transcribe-resume', daemon=True)
+        self.resume_thread.start()
+
+    def drop_job(self, job):
+        # Called for the oldest waiting clip when the queue is full; resume() picks it up later
+        self.on_result(job['clip_id'], '', 'pending')
+
+    @staticmethod
+    def content_hash(pcm_data):
+        return hashlib.sha1(pcm_data).hexdigest()
+
+    def run_job(self, job):
+        if 'path' in job:
+            try:
+                samples, sample_rate, channels = read_audio(job['path'])
+            except Exception as e:
+                logger.warning("Could not read %s for transcription: %s", job['path'], e)
+                self.on_result(job['clip_id'], f"[Error: {e}]", 'error')
+                return None
+            if channels > 1:
+                samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+        else:
+            samples, sample_rate = job['samples'], self.sample_rate
+        if sample_rate != self.transcriber.sample_rate:
+            samples = decimate(samples, sample_rate, self.transcriber.sample_rate)
+        pcm_data = samples.tobytes()
+        audio_hash = self.content_hash(pcm_data)
+
+        with self.stats_lock:
+            if audio_hash in self.in_flight:
+                # The same audio is being transcribed right now; share that result
+                self.in_flight[audio_hash].append(job['clip_id'])
+                self.cache_hits += 1
+                return None
+            self.in_flight[audio_hash] = [job['clip_id']]
+
+        try:
+            cached = self.store.get_transcript(audio_hash, self.transcriber.name) if self.store else None
+            if cached is not None:
+                text, status = cached['text'], cached['status']
+                with self.stats_lock:
+                    self.cache_hits += 1
+            else:
+                with self.stats_lock:
+                    self.cache_misses += 1
+                text, status = self.transcribe_with_retries(pcm_data)
+                if self.store and status != 'error':
+                    self.store.put_transcript(audio_hash, self.transcriber.name, text, status)
+        except Exception as e:
+            text, status = f"[Error: {e}]", 'error'
+            raise
+        finally:
+            with self.stats_lock:
+                clip_ids = self.in_flight.pop(audio_hash)
+            for clip_id in clip_ids:
+                self.on_result(clip_id, text, status)
+        return None
+
+    def transcribe_with_retries(self, pcm_data):
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                with time_stage('transcriber'):
+                    text = self.transcriber.transcribe(pcm_data)
+                logger.info("Transcription: %s", text)
+                return text, 'done'
+            except NoSpeechError:
+                return '', 'no_speech'
+            except Exception as e:
+                if attempt == self.retries:
+                    logger.exception("Transcription error: %s", e)
+                    with self.stats_lock:
+                        self.failures += 1
+                    return f"[Error: {e}]", 'error'
+                logger.warning("Transcription attempt %d failed (%s), retrying in %.1fs", attempt + 1, e, delay)
+                time.sleep(delay)
+                delay *= 2
+
+    def get_stats(self):
+        stats = self.stage.get_stats()
+        with self.stats_lock:
+            stats.update({
+                'backend': self.transcriber.name,
+                'cache_hits': self.cache_hits,
+                'cache_misses': self.cache_misses,
+                'failures': self.failures,
+            })
+        return stats
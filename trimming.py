@@ -0,0 +1,68 @@
+import numpy as np
+
+MAX_AMPLITUDE = 32768  # Same reference pydub uses for 16-bit audio (0 dBFS)
+
+
+def find_nonsilent_bounds(samples, sample_rate, silence_thresh=-50, min_silence_len=100):
+    """
+    Finds where the sound starts and ends in a clip, ignoring leading and trailing silence.
+
+    This is a vectorised equivalent of taking the first and last range from
+    pydub.silence.detect_nonsilent. It uses the same rules: a window of
+    min_silence_len ms is tried at every 1 ms step. A window counts as silent
+    when its (integer) RMS is at or below silence_thresh. Silent windows less
+    than min_silence_len apart are merged into one silent range. All window
+    RMS values come from one cumulative sum of squares instead of one
+    AudioSegment slice per millisecond.
+
+    Parameters:
+    - samples: 1-D int16 numpy array (mono).
+    - sample_rate: Sample rate of `samples`.
+    - silence_thresh: Silence threshold in dBFS. Default is -50 dBFS.
+    - min_silence_len: Minimum length of silence to detect (in ms). Default is 100 ms.
+
+    Returns:
+    - (start, end) sample indices of the non-silent part, so callers can take
+      `samples[start:end]` as a view. (0, 0) when the whole clip is silent.
+    """
+    num_samples = len(samples)
+    seg_len = int(round(1000 * num_samples / sample_rate))  # Length in ms, as pydub reports it
+
+    def to_sample(ms):
+        return min(int(ms * (sample_rate / 1000.0)), num_samples)
+
+    # A clip shorter than one window can't contain silence, so all of it is kept
+    if seg_len < min_silence_len:
+        return (0, num_samples)
+
+    threshold = (10 ** (silence_thresh / 20.0)) * MAX_AMPLITUDE
+
+    # Sum of squares of every window [i, i + min_silence_len) ms, i = 0 .. seg_len - min_silence_len
+    energy = np.zeros(num_samples + 1, dtype=np.int64)
+    np.cumsum(np.square(samples, dtype=np.int64), out=energy[1:])
+    starts_ms = np.arange(seg_len - min_silence_len + 1)
+    starts = np.minimum((starts_ms * (sample_rate / 1000.0)).astype(np.int64), num_samples)
+    window_ends = ((starts_ms + min_silence_len) * (sample_rate / 1000.0)).astype(np.int64)
+    ends = np.minimum(window_ends, num_samples)
+    # pydub pads a window that runs past the end with silence, so divide by the full length
+    lengths = np.maximum(window_ends - starts, 1)
+    # audioop.rms truncates to an integer, so do the same before comparing
+    rms = np.floor(np.sqrt((energy[ends] - energy[starts]) / lengths))
+    silent_starts = np.flatnonzero(rms <= threshold)
+
+    # No silence at all: the whole clip is sound
+    if len(silent_starts) == 0:
+        return (0, num_samples)
+
+    # Silent windows further apart than one window length start a new silent range
+    breaks = np.flatnonzero(np.diff(silent_starts) > min_silence_len)
+    first_range = (silent_starts[0], silent_starts[breaks[0] if len(breaks) else -1] + min_silence_len)
+    last_range = (silent_starts[breaks[-1] + 1] if len(breaks) else silent_starts[0],
+                  silent_starts[-1] + min_silence_len)
+
+    if first_range[0] == 0 and first_range[1] == seg_len:
+        return (0, 0)  # The entire clip is silent
+
+    start_ms = first_range[1] if first_range[0] == 0 else 0
+    end_ms = last_range[0] if last_range[1] == seg_len else seg_len
+    return (to_sample(start_ms), to_sample(end_ms))